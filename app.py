@@ -23,6 +23,8 @@ import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 import dotenv
+from src.services.frame_registry import FrameRegistry
+from src.services.jpeg_encoder import JpegEncoder
 
 app = Flask(__name__, static_url_path='/static', static_folder='static')
 
@@ -39,32 +41,28 @@ for directory in ['static/uploads', 'static/frames']:
 @app.route('/static/uploads/<path:filename>')
 def serve_image(filename):
     try:
-        app.logger.info(f"接收到圖片請求：{filename}")
-        app.logger.info(f"請求頭部：{request.headers}")
-        
         # 檢查文件是否存在
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         abs_path = os.path.abspath(file_path)
-        app.logger.info(f"圖片完整路徑：{abs_path}")
         
         if not os.path.isfile(abs_path):
             app.logger.error(f"找不到圖片檔案：{abs_path}")
             return "Image not found", 404
         
-        # 使用 send_from_directory 發送檔案
+        # 使用 send_from_directory 發送檔案（conditional 支援 If-None-Match 與 Range）
         response = send_from_directory(
             os.path.dirname(abs_path),
             os.path.basename(abs_path),
             mimetype='image/jpeg',
             as_attachment=False,
+            conditional=True,
+            etag=True,
             max_age=31536000
         )
         
         # 設定額外的標頭
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Cache-Control'] = 'public, max-age=31536000'
-        
-        app.logger.info(f"圖片發送成功，響應標頭：{response.headers}")
         return response
         
     except Exception as e:
@@ -224,14 +222,14 @@ def process_image_with_frame(image_filename, frame_style):
             
             app.logger.debug(f"調整後的目標尺寸：{target_width}x{target_height}")
             
-            # 讀取相框並獲取其原始尺寸
-            with Image.open(frame_path) as frame_size_check:
-                frame_width, frame_height = frame_size_check.size
-                frame_ratio = frame_width / frame_height
-                
-                # 使用相框的原始比例計算目標尺寸
-                target_height = 1080
-                target_width = int(target_height * frame_ratio)
+            # 從相框註冊表取得已解碼的相框（整個請求只解碼一次）
+            frame_handle = FrameRegistry.get(os.path.basename(frame_path), FRAMES_FOLDER)
+            frame_width, frame_height = frame_handle.size
+            frame_ratio = frame_width / frame_height
+            
+            # 使用相框的原始比例計算目標尺寸
+            target_height = 1080
+            target_width = int(target_height * frame_ratio)
             
             # 調整圖片大小，保持原始比例
             img_ratio = img.size[0] / img.size[1]
@@ -257,83 +255,69 @@ def process_image_with_frame(image_filename, frame_style):
             canvas.paste(img, (paste_x, paste_y))
             app.logger.debug(f"圖片已置中貼上，位置：({paste_x}, {paste_y})")
             
-            # 讀取相框並獲取其原始尺寸
-            with Image.open(frame_path) as frame:
-                app.logger.debug(f"相框原始模式：{frame.mode}, 尺寸：{frame.size}")
-                frame_width, frame_height = frame.size
-                frame_ratio = frame_width / frame_height
-                
-                if frame.mode != 'RGBA':
-                    frame = frame.convert('RGBA')
-                    app.logger.debug("已將相框轉換為 RGBA 模式")
-                
-                # 使用相框的原始比例計算畫布尺寸
-                target_height = 1080
-                target_width = int(target_height * frame_ratio)
-                
-                # 調整相框大小，保持原始比例
-                frame = frame.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                app.logger.debug(f"調整後的相框尺寸：{target_width}x{target_height}")
-                
-                # 重新設定畫布尺寸以符合相框比例
-                canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
-                
-                # 重新計算圖片的貼上位置
-                paste_x = (target_width - target_width) // 2
-                paste_y = (target_height - target_height) // 2
-                canvas.paste(img, (paste_x, paste_y))
-                
-                # 合成圖片
-                try:
-                    result = Image.alpha_composite(canvas, frame)
-                    app.logger.debug("圖片合成成功")
-                except ValueError as ve:
-                    app.logger.error(f"圖片合成失敗：{str(ve)}")
-                    app.logger.error(f"畫布模式：{canvas.mode}, 尺寸：{canvas.size}")
-                    app.logger.error(f"相框模式：{frame.mode}, 尺寸：{frame.size}")
-                    raise
-                
-                # 生成輸出檔名
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                output_filename = f"processed_{timestamp}_{image_filename}"
-                output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-                
-                # 轉換為 RGB
-                result = result.convert('RGB')
-                
-                # 調整圖片尺寸
-                target_size = (800, 800)  # 使用更小的尺寸
-                result.thumbnail(target_size, Image.Resampling.LANCZOS)
-                
-                # 確保圖片小於 200KB
-                max_size_bytes = 200000  # 200KB
-                quality = 80  # 降低品質
-                
-                # 記錄原始圖片資訊
-                app.logger.info(f"原始圖片尺寸：{result.size}")
-                
-                # 使用自適應品質來控制檔案大小
-                while quality > 60:  # 不要讓品質太低
-                    # 先在記憶體中測試
-                    from io import BytesIO
-                    temp_buffer = BytesIO()
-                    result.save(temp_buffer, 'JPEG', quality=quality)
-                    size = temp_buffer.tell()
-                    
-                    if size <= max_size_bytes:
-                        break
-                    
-                    quality -= 5
-                    app.logger.info(f"調整品質至：{quality}, 當前大小：{size} bytes")
-                
-                # 儲存最終的圖片
-                result.save(output_path, 'JPEG', quality=quality)
-                
-                # 確認最終檔案大小
-                final_size = os.path.getsize(output_path)
-                app.logger.info(f"圖片處理完成：{output_filename}, 最終大小：{final_size} bytes, 品質：{quality}")
-                
-                return output_filename
+            # 讀取已解碼的相框（共用的唯讀圖片，以下操作都會產生新圖片）
+            frame = frame_handle.image
+            app.logger.debug(f"相框原始模式：{frame.mode}, 尺寸：{frame.size}")
+            frame_width, frame_height = frame.size
+            frame_ratio = frame_width / frame_height
+            
+            if frame.mode != 'RGBA':
+                frame = frame.convert('RGBA')
+                app.logger.debug("已將相框轉換為 RGBA 模式")
+            
+            # 使用相框的原始比例計算畫布尺寸
+            target_height = 1080
+            target_width = int(target_height * frame_ratio)
+            
+            # 調整相框大小，保持原始比例
+            frame = frame.resize((target_width, target_height), Image.Resampling.LANCZOS)
+            app.logger.debug(f"調整後的相框尺寸：{target_width}x{target_height}")
+            
+            # 重新設定畫布尺寸以符合相框比例
+            canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
+            
+            # 重新計算圖片的貼上位置
+            paste_x = (target_width - target_width) // 2
+            paste_y = (target_height - target_height) // 2
+            canvas.paste(img, (paste_x, paste_y))
+            
+            # 合成圖片
+            try:
+                result = Image.alpha_composite(canvas, frame)
+                app.logger.debug("圖片合成成功")
+            except ValueError as ve:
+                app.logger.error(f"圖片合成失敗：{str(ve)}")
+                app.logger.error(f"畫布模式：{canvas.mode}, 尺寸：{canvas.size}")
+                app.logger.error(f"相框模式：{frame.mode}, 尺寸：{frame.size}")
+                raise
+            
+            # 生成輸出檔名
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output_filename = f"processed_{timestamp}_{image_filename}"
+            output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+            
+            # 轉換為 RGB
+            result = result.convert('RGB')
+            
+            # 調整圖片尺寸
+            target_size = (800, 800)  # 使用更小的尺寸
+            result.thumbnail(target_size, Image.Resampling.LANCZOS)
+            
+            # 確保圖片小於 200KB，在記憶體中搜尋品質後只寫入一次檔案
+            encoded = JpegEncoder.encode(result, max_bytes=200000, quality=80, min_quality=60, profile='fast')
+            quality = encoded.quality
+            
+            # 記錄原始圖片資訊
+            app.logger.info(f"原始圖片尺寸：{result.size}, 編碼嘗試次數：{encoded.attempts}")
+            
+            # 儲存最終的圖片
+            encoded.save(output_path)
+            
+            # 確認最終檔案大小
+            final_size = os.path.getsize(output_path)
+            app.logger.info(f"圖片處理完成：{output_filename}, 最終大小：{final_size} bytes, 品質：{quality}")
+            
+            return output_filename
             
     except Exception as e:
         app.logger.error(f"處理圖片時發生錯誤：{str(e)}")
@@ -1,15 +1,27 @@
 import os
 import json
+import posixpath
+import time
+import asyncio
 import logging
 import cloudinary
-from quart import Quart, request, abort, send_from_directory
+from quart import Quart, request, abort, jsonify
 from linebot.v3 import WebhookParser
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent, FollowEvent
 
 from src.config import settings
 from src.handlers.message_handler import MessageHandler
+from src.services.image_service import ImageService
+from src.services.compositing_pool import CompositingPool
+from src.services.result_cache import ResultCache
+from src.services.memory_budget import MemoryBudget
+from src.services.cloudinary_uploader import CloudinaryUploader
+from src.services.storage_backend import LocalStorage
+from src.services.janitor import Janitor
+from src.services.job_queue import Job, JobQueue, JobQueueFull
+from src.utils.tracing import Tracer, HistogramSink
+from src.utils.static_files import send_static_file
 
 # 設定日誌
 logging.basicConfig(
@@ -18,8 +30,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 初始化 Quart
-app = Quart(__name__)
+# 初始化 Quart（停用內建的 /static 路由，由 serve_static 提供 static 目錄）
+app = Quart(__name__, static_folder=None)
 
 # 初始化 LINE Bot
 configuration = Configuration(access_token=settings.LINE_CHANNEL_ACCESS_TOKEN)
@@ -33,22 +45,126 @@ cloudinary.config(
     api_secret=settings.CLOUDINARY_API_SECRET
 )
 
+# 初始化處理階段計時
+Tracer.configure(settings.TRACE_SINKS, settings.TRACE_JSON_PATH)
+
 # 初始化訊息處理器
 message_handler = MessageHandler()
 
+@app.before_serving
+async def preload_frames():
+    """啟動時預先解碼所有相框並建立區域遮罩，讓請求不再需要讀檔與解壓縮 PNG"""
+    await asyncio.to_thread(ImageService.preload_frames)
+    if settings.COMPOSITE_BACKEND == 'process':
+        # 預先建立合成子行程，避免第一個請求等待子行程啟動
+        await asyncio.to_thread(CompositingPool.start)
+
+@app.before_serving
+async def check_storage_secret():
+    """確認本地 URL 的簽章金鑰（未設定時產生臨時金鑰並記錄警告）"""
+    LocalStorage.ensure_secret()
+
+@app.before_serving
+async def check_upload_settings():
+    """確認上傳的整體期限長於每次嘗試的期限（否則記錄警告）"""
+    CloudinaryUploader.check_settings()
+
+@app.before_serving
+async def start_job_queue():
+    """啟動 webhook 工作佇列的 worker"""
+    JobQueue.start()
+
+@app.after_serving
+async def stop_job_queue():
+    """等待佇列中的工作完成（最多 JOB_SHUTDOWN_TIMEOUT 秒）"""
+    await JobQueue.stop()
+
+@app.before_serving
+async def start_janitor():
+    """定期清理暫存檔案（用戶狀態仍參照的檔案不會被刪除）"""
+    Janitor.start(message_handler.referenced_files)
+
+@app.after_serving
+async def stop_janitor():
+    await Janitor.stop()
+
+@app.after_serving
+async def shutdown_compositing_pool():
+    """關閉合成子行程"""
+    await asyncio.to_thread(CompositingPool.shutdown)
+
+@app.after_serving
+async def close_uploader():
+    """關閉上傳的連線池"""
+    await CloudinaryUploader.close()
+
 # 設定靜態文件路由
 @app.route('/static/<path:filename>')
 async def serve_static(filename):
-    return await send_from_directory('static', filename)
+    return await send_static_file(settings.STATIC_FOLDER, filename, 'static')
 
 # 設定上傳文件路由
 @app.route('/tmp/uploads/<path:filename>')
 async def serve_uploads(filename):
-    return await send_from_directory(settings.UPLOAD_FOLDER, filename)
+    # 不接受 . 與 .. 路徑片段：否則 ./objects/<name> 之類的路徑會略過下方物件 URL 的簽章檢查
+    if posixpath.normpath(filename) != filename:
+        abort(404)
+    object_prefix = f"{LocalStorage.URL_PREFIX}/"
+    if not filename.startswith(object_prefix):
+        # 未簽署的路徑不可取得物件目錄中的檔案（不論經由哪個路徑或連結解析到物件目錄）
+        path = os.path.realpath(os.path.join(settings.UPLOAD_FOLDER, filename))
+        object_folder = os.path.realpath(settings.STORAGE_OBJECT_FOLDER)
+        if os.path.commonpath([path, object_folder]) == object_folder:
+            abort(404)
+        return await send_static_file(settings.UPLOAD_FOLDER, filename, 'uploads')
+
+    # 本地儲存後端的物件：驗證簽章與到期時間，內容以雜湊命名不會改變，可長期快取
+    name = filename[len(object_prefix):]
+    expires = request.args.get('expires')
+    if not LocalStorage.verify(name, expires, request.args.get('sig')):
+        abort(403)
+    # 快取時間不超過 URL 的到期時間（CDN 不會在到期後繼續提供）
+    max_age = max(0, min(365 * 24 * 3600, int(expires) - int(time.time())))
+    return await send_static_file(
+        settings.STORAGE_OBJECT_FOLDER, name, f"uploads/{LocalStorage.URL_PREFIX}", immutable=True, max_age=max_age
+    )
+
+# 處理結果快取統計
+@app.route('/metrics/cache')
+async def cache_metrics():
+    return jsonify(ResultCache.stats())
+
+# 圖片解碼的記憶體預留狀態
+@app.route('/metrics/memory')
+async def memory_metrics():
+    return jsonify(MemoryBudget.stats())
+
+# 上傳統計
+@app.route('/metrics/uploads')
+async def upload_metrics():
+    return jsonify(CloudinaryUploader.stats())
+
+# webhook 工作佇列統計
+@app.route('/metrics/jobs')
+async def job_metrics():
+    return jsonify(JobQueue.stats())
+
+# 暫存檔案清理統計
+@app.route('/metrics/janitor')
+async def janitor_metrics():
+    return jsonify(Janitor.stats())
+
+# 處理階段的耗時分佈（TRACE_SINKS 需包含 histogram）
+@app.route('/metrics/spans')
+async def span_metrics():
+    histogram = Tracer.find_sink(HistogramSink)
+    if histogram is None:
+        return jsonify({'error': 'histogram sink 未啟用'}), 404
+    return jsonify(histogram.export())
 
 @app.route("/callback", methods=['POST'])
 async def callback():
-    """處理 LINE Webhook"""
+    """處理 LINE Webhook（驗證簽章後將事件放入工作佇列，立即回覆）"""
     signature = request.headers.get('X-Line-Signature', '')
     body = await request.get_data(as_text=True)
     
@@ -56,23 +172,22 @@ async def callback():
         # 解析事件
         events = WebhookParser(settings.LINE_CHANNEL_SECRET).parse(body, signature)
         
-        # 處理每個事件
-        for event in events:
-            if isinstance(event, FollowEvent):
-                # 處理用戶關注事件
-                logger.info("收到關注事件")
-                await message_handler.handle_follow_event(event)
-            elif isinstance(event, MessageEvent):
-                if isinstance(event.message, TextMessageContent):
-                    await message_handler.handle_text_message(event)
-                elif isinstance(event.message, ImageMessageContent):
-                    await message_handler.handle_image_message(event)
+        # 每個事件交由工作佇列的 worker 處理：不同用戶同時處理，同一用戶依序處理
+        # 整批加入，空間不足時整批拒絕（回覆 503 後 LINE 會重送整批事件，不能有事件已在佇列中）
+        JobQueue.submit_many([
+            Job(type(event).__name__, message_handler.handle_event, (event,), key=message_handler.lane_key(event))
+            for event in events
+        ])
         
-        logger.info("webhook 處理成功")
+        logger.info(f"webhook 已接收 {len(events)} 個事件")
         return 'OK'
     except InvalidSignatureError:
         logger.error("無效的簽章")
         abort(400)
+    except JobQueueFull as e:
+        # 回覆 503 讓 LINE 稍後重送
+        logger.error(str(e))
+        abort(503)
     except Exception as e:
         logger.error(f"處理 webhook 時發生錯誤：{str(e)}")
         abort(500)
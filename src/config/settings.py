@@ -11,6 +11,26 @@ LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', None)
 CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME', None)
 CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY', None)
 CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET', None)
+# 上傳 API 的位址（測試時可指向本地的替代伺服器，例如 http://127.0.0.1:8765）
+CLOUDINARY_API_BASE = os.getenv('CLOUDINARY_API_BASE', 'https://api.cloudinary.com')
+
+# 上傳設定：同時上傳數量、每次嘗試的期限（秒）、重試次數與退避時間（秒）、連線池
+# 每次嘗試的期限需短於整體期限 UPLOAD_DEADLINE，逾時後才有時間重試
+UPLOAD_MAX_CONCURRENCY = int(os.getenv('UPLOAD_MAX_CONCURRENCY', '4'))
+UPLOAD_ATTEMPT_TIMEOUT = float(os.getenv('UPLOAD_ATTEMPT_TIMEOUT', '8'))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv('UPLOAD_MAX_ATTEMPTS', '3'))
+UPLOAD_BACKOFF_BASE = float(os.getenv('UPLOAD_BACKOFF_BASE', '0.5'))
+UPLOAD_BACKOFF_MAX = float(os.getenv('UPLOAD_BACKOFF_MAX', '8'))
+UPLOAD_POOL_SIZE = int(os.getenv('UPLOAD_POOL_SIZE', '10'))
+UPLOAD_KEEPALIVE_TIMEOUT = float(os.getenv('UPLOAD_KEEPALIVE_TIMEOUT', '60'))
+# 整個上傳（含重試）的期限（秒），超過時改用本地 URL，避免 LINE 的 reply token 失效
+UPLOAD_DEADLINE = float(os.getenv('UPLOAD_DEADLINE', '20'))
+# 對沖上傳：超過最近成功上傳耗時的此百分位數仍未完成時，同時送出第二個上傳（0 表示停用）
+# 樣本數不足 UPLOAD_HEDGE_MIN_SAMPLES 時等待 UPLOAD_HEDGE_DEFAULT_DELAY 秒，最少等待 UPLOAD_HEDGE_MIN_DELAY 秒
+UPLOAD_HEDGE_PERCENTILE = float(os.getenv('UPLOAD_HEDGE_PERCENTILE', '0.95'))
+UPLOAD_HEDGE_MIN_SAMPLES = int(os.getenv('UPLOAD_HEDGE_MIN_SAMPLES', '20'))
+UPLOAD_HEDGE_DEFAULT_DELAY = float(os.getenv('UPLOAD_HEDGE_DEFAULT_DELAY', '3'))
+UPLOAD_HEDGE_MIN_DELAY = float(os.getenv('UPLOAD_HEDGE_MIN_DELAY', '0.5'))
 
 # 印表機設定
 PRINTER_HOST = os.getenv('PRINTER_HOST', None)
@@ -22,9 +42,64 @@ PRINTER_EMAIL = os.getenv('PRINTER_EMAIL', None)
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tmp', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# 下載 LINE 訊息內容的限制
+CONTENT_ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'WEBP'}  # Pillow 辨識的格式
+CONTENT_MAX_BYTES = int(os.getenv('CONTENT_MAX_BYTES', str(20 * 1024 * 1024)))  # 檔案大小上限
+CONTENT_MAX_PIXELS = int(os.getenv('CONTENT_MAX_PIXELS', str(50000000)))  # 像素數上限（約 8660x5773）
+CONTENT_SPILL_BYTES = int(os.getenv('CONTENT_SPILL_BYTES', str(4 * 1024 * 1024)))  # 超過此大小直接寫入檔案
+CONTENT_CHUNK_SIZE = 64 * 1024
+CONTENT_SNIFF_BYTES = 256 * 1024  # 超過此大小仍無法辨識檔頭即視為不支援的格式
+
+# 下載模式：full 等待原圖下載完成後再處理；preview 先以 LINE 的預覽圖合成並回覆，
+# 原圖同時在背景下載，完成後重新合成高解析度版本供列印使用
+INGEST_MODE = os.getenv('INGEST_MODE', 'full').lower()
+
 # 確保上傳目錄存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 儲存後端：cloudinary（上傳到 Cloudinary）或 local（寫入本地物件目錄，以 /tmp/uploads/objects/ 提供
+# 簽署且有期限的 URL，可放在自己的 CDN 後方）；cloudinary 失敗時也會改用 local
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'cloudinary').lower()
+STORAGE_OBJECT_FOLDER = os.path.join(UPLOAD_FOLDER, 'objects')
+# 本地 URL 的對外位址（例如 CDN 的網址），未設定則使用 get_base_url()
+STORAGE_PUBLIC_BASE_URL = os.getenv('STORAGE_PUBLIC_BASE_URL', None)
+# 本地 URL 的簽章金鑰（需另外設定，不使用 LINE_CHANNEL_SECRET；未設定時啟動時產生臨時金鑰，
+# 重新啟動後先前的 URL 會失效）與有效期間（秒）
+STORAGE_URL_SECRET = os.getenv('STORAGE_URL_SECRET', None)
+STORAGE_URL_TTL = int(os.getenv('STORAGE_URL_TTL', str(30 * 24 * 3600)))
+os.makedirs(STORAGE_OBJECT_FOLDER, exist_ok=True)
+
+# 靜態檔案目錄
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'static')
+
+# 靜態檔案（/static、/tmp/uploads）的快取秒數（以雜湊命名的檔案固定為 immutable）
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '3600'))
+# 由前方的 nginx 傳送檔案內容：應用程式只回傳 X-Accel-Redirect，nginx 以 sendfile 傳送
+# STATIC_ACCEL_PREFIX 下的 internal location（見 nginx.conf）
+STATIC_ACCEL_REDIRECT = os.getenv('STATIC_ACCEL_REDIRECT', 'false').lower() == 'true'
+STATIC_ACCEL_PREFIX = os.getenv('STATIC_ACCEL_PREFIX', '/_accel')
+
+# 列印用 PDF 的目錄
+PDF_FOLDER = os.path.join(STATIC_FOLDER, 'pdf')
+
+# 暫存檔案清理：執行間隔（秒，0 表示停用）、每批處理的檔案數、最短保留時間（秒，避免刪除正在使用的檔案）
+JANITOR_INTERVAL = int(os.getenv('JANITOR_INTERVAL', '600'))
+JANITOR_BATCH_SIZE = int(os.getenv('JANITOR_BATCH_SIZE', '200'))
+JANITOR_MIN_AGE = int(os.getenv('JANITOR_MIN_AGE', '600'))
+# 各目錄的保留時間（秒）與總大小上限（bytes），0 表示不限制；本地儲存物件保留到 URL 到期
+UPLOAD_RETENTION_SECONDS = int(os.getenv('UPLOAD_RETENTION_SECONDS', str(24 * 3600)))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(512 * 1024 * 1024)))
+PDF_RETENTION_SECONDS = int(os.getenv('PDF_RETENTION_SECONDS', str(24 * 3600)))
+PDF_MAX_BYTES = int(os.getenv('PDF_MAX_BYTES', str(256 * 1024 * 1024)))
+STORAGE_OBJECT_MAX_BYTES = int(os.getenv('STORAGE_OBJECT_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# 處理結果快取（相同照片直接使用先前的合成結果與上傳 URL）
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tmp', 'result_cache')
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv('RESULT_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+RESULT_CACHE_DISK_BYTES = int(os.getenv('RESULT_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+os.makedirs(RESULT_CACHE_FOLDER, exist_ok=True)
+
 # 相框樣式設定
 FRAME_STYLES = {
     '1': '可愛風格',
@@ -43,6 +118,62 @@ FRAME_FILES = {
 PORTRAIT_FRAME = 'only-frame-protrait.png'  # 直式相框
 LANDSCAPE_FRAME = 'only-frame-land.png'     # 橫式相框
 
+# 相框目錄與透明區域清單（sidecar JSON）設定
+FRAME_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'static', 'frames')
+FRAME_MANIFEST_SUFFIX = '.slots.json'
+
+# 輸出圖片尺寸上限（LINE 平台限制）
+MAX_OUTPUT_WIDTH = 1024
+MAX_OUTPUT_HEIGHT = 1024
+
+# JPEG 輸出設定：大小上限與編碼設定檔（default、progressive、fast、compact）
+JPEG_MAX_BYTES = 500000  # 500KB
+JPEG_PROFILE = os.getenv('JPEG_PROFILE', 'default')
+# 輸出圖片的起始品質（直式照片使用稍低的品質以減小檔案大小）
+JPEG_QUALITY_PORTRAIT = 85
+JPEG_QUALITY_LANDSCAPE = 90
+
+# 預覽圖設定（LINE preview_image_url 建議 240x240 以內）
+PREVIEW_MAX_SIZE = 240
+PREVIEW_QUALITY = 80
+
+# 直接以輸出解析度合成（相框與透明區域先縮放到輸出尺寸，省去全解析度畫布與最後的縮放）
+COMPOSE_AT_OUTPUT_RESOLUTION = os.getenv('COMPOSE_AT_OUTPUT_RESOLUTION', 'true').lower() == 'true'
+
+# 合成核心：numpy（單一 RGB 陣列，只處理相框非不透明的區域）或 pillow（RGBA 畫布逐層 paste）
+COMPOSITE_KERNEL = os.getenv('COMPOSITE_KERNEL', 'numpy').lower()
+
+# 啟動時預先載入的相框（以逗號分隔的檔名，未設定則只載入直式與橫式相框，其他相框在第一次使用時載入）
+FRAME_PRELOAD = [
+    name.strip() for name in os.getenv('FRAME_PRELOAD', '').split(',') if name.strip()
+] or [PORTRAIT_FRAME, LANDSCAPE_FRAME]
+# 啟動時載入相框目錄中的全部相框（每個相框解碼後約佔數十 MB，預設關閉）
+FRAME_PRELOAD_ALL = os.getenv('FRAME_PRELOAD_ALL', 'false').lower() == 'true'
+
+# 合成後端：thread（事件迴圈的線程池）或 process（固定數量的子行程，可使用多核心）
+COMPOSITE_BACKEND = os.getenv('COMPOSITE_BACKEND', 'thread').lower()
+# 子行程數，未設定時為 CPU 核心數但最多 4 個（每個子行程各自載入相框，解碼後約 60 MB，不計入記憶體預算）
+COMPOSITE_WORKERS = int(os.getenv('COMPOSITE_WORKERS', '0')) or min(os.cpu_count() or 1, 4)
+# 每個子行程處理多少個工作後重新啟動（0 表示不重新啟動）
+COMPOSITE_MAX_JOBS_PER_WORKER = int(os.getenv('COMPOSITE_MAX_JOBS_PER_WORKER', '200'))
+# 超過此大小的圖片以共享記憶體傳給子行程，避免經由管線序列化
+COMPOSITE_SHM_THRESHOLD = int(os.getenv('COMPOSITE_SHM_THRESHOLD', str(1024 * 1024)))
+
+# 圖片解碼的記憶體預算（整個行程共用，0 表示不限制），超過時之後的請求排隊等待
+MEMORY_BUDGET_BYTES = int(os.getenv('MEMORY_BUDGET_BYTES', str(192 * 1024 * 1024)))
+
+# webhook 工作佇列：執行 worker 數（即同時處理的事件數上限，同一用戶的事件依序處理）、
+# 等待中的工作上限（已滿時回覆 503 讓 LINE 重送）、關閉時等待工作完成的秒數
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_QUEUE_MAX_SIZE = int(os.getenv('JOB_QUEUE_MAX_SIZE', '100'))
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv('JOB_SHUTDOWN_TIMEOUT', '10'))
+
+# 處理階段計時的輸出目標（以逗號分隔：log、histogram、json），未設定則停用
+TRACE_SINKS = [name.strip() for name in os.getenv('TRACE_SINKS', '').lower().split(',') if name.strip()]
+TRACE_JSON_PATH = os.getenv(
+    'TRACE_JSON_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tmp', 'spans.jsonl')
+)
+
 # 預設框架風格
 DEFAULT_FRAME_STYLE = '簡約風格'
 
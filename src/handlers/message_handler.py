@@ -1,11 +1,15 @@
 import os
+import asyncio
 import logging
 import traceback
 from datetime import datetime
 from linebot.v3.messaging import ImageMessage, TextMessage, TemplateMessage, MessageAction, ConfirmTemplate, URIAction
+from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent, FollowEvent
 from src.config import settings
-from src.services.line_service import LineService
+from src.services.line_service import LineService, ContentRejected
 from src.services.image_service import ImageService
+from src.services.result_cache import ResultCache
+from src.services.storage_backend import Storage
 from src.services.printer_service import PrinterService
 
 logger = logging.getLogger(__name__)
@@ -15,6 +19,7 @@ class MessageHandler:
         self.line_service = LineService()
         self.image_service = ImageService()
         self.user_states = {}  # 用來存儲用戶的狀態
+        self.background_tasks = set()  # 背景工作（保留參照避免被回收）
         
         # 歡迎訊息和使用說明
         self.welcome_message = (
@@ -35,6 +40,48 @@ class MessageHandler:
         # 幫助關鍵字列表
         self.help_keywords = ["幫助", "說明", "help", "指南", "怎麼用", "如何使用"]
 
+    def referenced_files(self):
+        """
+        用戶狀態仍參照的檔案（原圖與處理後的圖片），暫存檔案清理時不可刪除
+
+        Returns:
+            set: 檔案路徑
+        """
+        paths = set()
+        for state in list(self.user_states.values()):
+            for key in ('image', 'processed_image'):
+                if state.get(key):
+                    paths.add(os.path.join(settings.UPLOAD_FOLDER, state[key]))
+            for key in ('original_path', 'processed_path'):
+                if state.get(key):
+                    paths.add(state[key])
+        return paths
+
+    @staticmethod
+    def lane_key(event):
+        """
+        事件的序列鍵：同一用戶（沒有用戶 ID 時為同一群組或聊天室）的事件依序處理
+
+        Returns:
+            str: 序列鍵，無法判斷來源時回傳 None（不限制順序）
+        """
+        source = event.source
+        if source is None:
+            return None
+        return getattr(source, 'user_id', None) or getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+
+    async def handle_event(self, event):
+        """依事件類型分派處理（由工作佇列的 worker 執行）"""
+        if isinstance(event, FollowEvent):
+            # 處理用戶關注事件
+            logger.info("收到關注事件")
+            await self.handle_follow_event(event)
+        elif isinstance(event, MessageEvent):
+            if isinstance(event.message, TextMessageContent):
+                await self.handle_text_message(event)
+            elif isinstance(event.message, ImageMessageContent):
+                await self.handle_image_message(event)
+
     async def handle_follow_event(self, event):
         """處理用戶關注事件"""
         try:
@@ -119,11 +166,77 @@ class MessageHandler:
             # 用戶尚未上傳圖片
             await self.line_service.reply_text(event.reply_token, "請上傳一張照片，讓我為您加上精美的框架！")
 
+    async def download_image(self, message_id, image_path):
+        """
+        下載用戶上傳的圖片
+
+        settings.INGEST_MODE 為 preview 時，先下載 LINE 的預覽圖供合成回覆使用，
+        原圖同時在背景下載；預覽圖無法取得時改為等待原圖。
+
+        Args:
+            message_id (str): 訊息 ID
+            image_path (str): 原圖的儲存路徑（大檔案下載時直接寫入）
+
+        Returns:
+            tuple: (合成用的 MessageContent, 原圖下載工作；直接使用原圖時為 None)
+
+        Raises:
+            ContentRejected: 原圖不符合要求
+        """
+        if settings.INGEST_MODE != 'preview':
+            return await self.line_service.download_message_content(message_id, spill_path=image_path), None
+
+        full_download = asyncio.create_task(
+            self.line_service.download_message_content(message_id, spill_path=image_path)
+        )
+        # 處理流程提早結束時不會等待原圖，避免未取得的例外產生警告
+        full_download.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            preview = await self.line_service.download_message_content(message_id, preview=True)
+            logger.info(f"使用預覽圖合成: {message_id}, 尺寸: {preview.width}x{preview.height}")
+            return preview, full_download
+        except Exception as e:
+            logger.warning(f"無法取得預覽圖，改為等待原圖：{str(e)}")
+            return await full_download, None
+
+    async def finish_full_resolution(self, user_id, full_download, image_filename, image_path, preview_processed):
+        """
+        原圖下載完成後重新合成高解析度版本，取代以預覽圖合成的結果，供列印使用
+
+        Args:
+            user_id (str): 用戶 ID
+            full_download (asyncio.Task): 原圖下載工作
+            image_filename (str): 原圖檔名
+            image_path (str): 原圖路徑
+            preview_processed (ProcessedImage): 以預覽圖合成的結果
+        """
+        try:
+            content = await full_download
+            if content.in_memory:
+                ImageService.persist_in_background(content.data, image_path)
+
+            processed = await self.image_service.render_image_with_frame(image_filename, content.data)
+            if not processed:
+                logger.error(f"高解析度合成失敗，保留預覽圖合成結果: {image_filename}")
+                return
+
+            # 等待預覽圖合成結果寫入完成，避免覆蓋高解析度的檔案
+            await ImageService.ensure_persisted(preview_processed)
+            await asyncio.to_thread(processed.save)
+
+            state = self.user_states.get(user_id)
+            if state and state.get('image') == image_filename:
+                state['processed_image'] = processed.filename
+                state['processed_path'] = processed.path
+            logger.info(f"高解析度合成完成: {processed.filename}, 原圖大小: {content.size} bytes")
+        except Exception as e:
+            logger.error(f"高解析度合成失敗：{str(e)}")
+            logger.error(traceback.format_exc())
+
     async def handle_image_message(self, event):
         """處理圖片訊息"""
         try:
             logger.info(f"開始處理圖片訊息: {event.message.id}")
-            message_content = await self.line_service.get_message_content(event.message.id)
             
             # 生成檔案名稱
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -131,16 +244,17 @@ class MessageHandler:
             image_path = os.path.join(settings.UPLOAD_FOLDER, image_filename)
             logger.info(f"生成圖片檔名: {image_filename}")
             
-            # 儲存圖片
-            with open(image_path, 'wb') as f:
-                f.write(message_content)
-            
-            # 檢查檔案是否成功儲存
-            if not os.path.exists(image_path):
-                logger.error(f"圖片儲存失敗: {image_path}")
-                await self.line_service.reply_text(event.reply_token, "圖片儲存失敗，請重新上傳。")
+            # 串流下載，大檔案直接寫入 image_path，不保留在記憶體中
+            try:
+                content, full_download = await self.download_image(event.message.id, image_path)
+            except ContentRejected as e:
+                await self.line_service.reply_text(event.reply_token, str(e))
                 return
-                
+            
+            # 原始圖片在背景寫入磁碟，合成直接使用記憶體中的內容（預覽圖不寫入）
+            if content.in_memory and full_download is None:
+                ImageService.persist_in_background(content.data, image_path)
+            
             # 更新用戶狀態
             self.user_states[event.source.user_id] = {
                 'image': image_filename,
@@ -150,50 +264,94 @@ class MessageHandler:
             
             # 自動判斷照片方向並處理圖片
             try:
-                # 處理圖片，不指定框架風格，讓系統自動判斷
-                logger.info(f"開始處理圖片: {image_filename}")
-                processed_filename = await self.image_service.process_image_with_frame(image_filename)
-                if not processed_filename:
-                    logger.error(f"圖片處理失敗: {image_filename}")
-                    await self.line_service.reply_text(event.reply_token, "圖片處理失敗，請重新上傳照片。")
-                    return
+                # 相同照片（重複上傳或 LINE 重送）直接使用快取的結果，略過合成、編碼與上傳
+                # 以預覽圖合成時不使用快取（快取鍵需要原圖內容，且結果為低解析度）
+                cache_key, cached = None, None
+                if full_download is None:
+                    cache_key, cached = await asyncio.to_thread(ResultCache.lookup, content.sha256)
+                if cached:
+                    processed = cached.processed
+                    cloudinary_url = cached.url
+                    preview_url = cached.preview_url or cached.url
+                    processed_filename = processed.filename
+                    processed_path = processed.path
+                    # 檔案來自先前的請求，可能已被暫存檔案清理刪除：重新寫入（同時更新修改時間），供列印使用
+                    processed.persist_task = ImageService.persist_in_background(processed.data, processed_path)
+                    self.user_states[event.source.user_id]['processed_image'] = processed_filename
+                    logger.info(f"處理結果快取命中: {processed_filename}, URL: {cloudinary_url}")
+                else:
+                    # 處理圖片，不指定框架風格，讓系統自動判斷
+                    logger.info(f"開始處理圖片: {image_filename}")
+                    # 內容已寫入檔案時（content.data 為 None）直接從檔案解碼
+                    processed = await self.image_service.render_image_with_frame(image_filename, content.data)
+                    if not processed:
+                        logger.error(f"圖片處理失敗: {image_filename}")
+                        await self.line_service.reply_text(event.reply_token, "圖片處理失敗，請重新上傳照片。")
+                        return
+                    processed_filename = processed.filename
+                    processed_path = processed.path
+                
+                    # 處理後的圖片在背景寫入磁碟，供之後列印與本地 URL 使用
+                    processed.persist_task = ImageService.persist_in_background(processed.data, processed_path)
+                    preview = processed.preview
+                    if preview:
+                        preview.persist_task = ImageService.persist_in_background(preview.data, preview.path)
 
-                # 儲存處理後的圖片檔名
-                self.user_states[event.source.user_id]['processed_image'] = processed_filename
-                logger.info(f"處理後的圖片檔名: {processed_filename}")
+                    # 儲存處理後的圖片檔名
+                    self.user_states[event.source.user_id]['processed_image'] = processed_filename
+                    logger.info(f"處理後的圖片檔名: {processed_filename}")
                 
-                # 上傳到 Cloudinary
-                try:
-                    processed_path = os.path.join(settings.UPLOAD_FOLDER, processed_filename)
-                    logger.info(f"開始上傳到 Cloudinary: {processed_path}")
-                    cloudinary_url = await self.image_service.upload_to_cloudinary(processed_path)
-                    if not cloudinary_url:
-                        logger.error(f"上傳到 Cloudinary 失敗: {processed_path}")
-                        raise Exception("上傳到 Cloudinary 失敗")
+                    # 以設定的儲存後端（Cloudinary 或本地）保存並取得 URL
+                    try:
+                        logger.info(f"開始上傳: {processed_filename}")
+                        # 直接保存記憶體中的合成結果，不再重新讀檔與編碼；預覽圖同時保存（不做放大轉換）
+                        uploads = [self.image_service.store_image(processed)]
+                        if preview:
+                            uploads.append(self.image_service.store_image(preview, transformation=[]))
+                        cloudinary_url, *preview_urls = await asyncio.gather(*uploads)
+                        if not cloudinary_url:
+                            logger.error(f"上傳圖片失敗: {processed_path}")
+                            raise Exception("上傳圖片失敗")
                     
-                    # 記錄 Cloudinary URL
-                    logger.info(f"Cloudinary URL: {cloudinary_url}")
-                except Exception as e:
-                    logger.error(f"上傳到 Cloudinary 失敗：{str(e)}")
-                    logger.error(traceback.format_exc())
-                    await self.line_service.reply_text(event.reply_token, "圖片上傳失敗，請稍後再試。")
-                    return
+                        # 預覽圖上傳失敗時改用原圖作為預覽
+                        preview_url = (preview_urls and preview_urls[0]) or cloudinary_url
+
+                        # 記錄圖片 URL
+                        logger.info(f"圖片 URL: {cloudinary_url}, 預覽圖: {preview_url}")
+                    except Exception as e:
+                        logger.error(f"上傳圖片失敗：{str(e)}")
+                        logger.error(traceback.format_exc())
+                        await self.line_service.reply_text(event.reply_token, "圖片上傳失敗，請稍後再試。")
+                        return
+
+                    # 只快取不依賴暫存檔案的 URL（本地 URL 會過期，檔案也可能被清除）
+                    if cache_key and Storage.is_durable(cloudinary_url) and Storage.is_durable(preview_url):
+                        await asyncio.to_thread(ResultCache.put, cache_key, processed, cloudinary_url, preview_url)
 
                 # 儲存處理後的圖片路徑
                 self.user_states[event.source.user_id]['processed_path'] = processed_path
                 self.user_states[event.source.user_id]['original_path'] = os.path.join(settings.UPLOAD_FOLDER, image_filename)
                 self.user_states[event.source.user_id]['cloudinary_url'] = cloudinary_url
+                self.user_states[event.source.user_id]['preview_url'] = preview_url
+
+                # 以預覽圖合成時，原圖下載完成後在背景重新合成高解析度版本
+                if full_download is not None:
+                    task = asyncio.create_task(self.finish_full_resolution(
+                        event.source.user_id, full_download, image_filename, image_path, processed
+                    ))
+                    self.background_tasks.add(task)
+                    task.add_done_callback(self.background_tasks.discard)
 
                 try:
                     # 發送處理後的圖片
                     logger.info(f"準備發送處理後的圖片: {cloudinary_url}")
                     image_message = ImageMessage(
                         original_content_url=cloudinary_url,
-                        preview_image_url=cloudinary_url
+                        preview_image_url=preview_url
                     )
                     
                     # 檢查是否為直式照片
-                    is_portrait = "portrait" in processed_filename
+                    is_portrait = processed.is_portrait
                     logger.info(f"照片方向: {'直式' if is_portrait else '橫式'}")
                     
                     if is_portrait:
@@ -209,7 +367,8 @@ class MessageHandler:
                             # 然後使用 push_image 發送圖片
                             await self.line_service.push_image(
                                 event.source.user_id,
-                                cloudinary_url
+                                cloudinary_url,
+                                preview_url
                             )
                             
                             # 發送確認模板訊息
@@ -236,7 +395,8 @@ class MessageHandler:
                                 logger.info(f"嘗試使用 reply_image 發送直式照片")
                                 await self.line_service.reply_image(
                                     event.reply_token,
-                                    cloudinary_url
+                                    cloudinary_url,
+                                    preview_url
                                 )
                                 logger.info(f"使用 reply_image 發送直式照片成功")
                                 
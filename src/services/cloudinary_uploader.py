@@ -0,0 +1,343 @@
+import time
+import random
+import hashlib
+import asyncio
+import logging
+import aiohttp
+from collections import deque
+import cloudinary.utils
+from src.config import settings
+from src.utils.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class CloudinaryUploadError(Exception):
+    """上傳失敗（retryable 表示可以重試，例如逾時、連線錯誤、429 或 5xx）"""
+
+    def __init__(self, message, status=None, retryable=True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CloudinaryUploader:
+    """
+    非同步的 Cloudinary 上傳
+
+    在本地簽署上傳參數（與 cloudinary SDK 相同的簽章），透過共用的 aiohttp session
+    （連線池、keep-alive）以 multipart 串流上傳，不會阻塞事件迴圈：
+        - 同時上傳數量上限 settings.UPLOAD_MAX_CONCURRENCY（等待重試時不佔用名額）
+        - 每次嘗試的期限 settings.UPLOAD_ATTEMPT_TIMEOUT
+        - 可重試的錯誤以指數退避加上隨機抖動（full jitter）重試，最多 settings.UPLOAD_MAX_ATTEMPTS 次
+        - 開始上傳後超過最近上傳耗時的百分位數仍未完成時同時送出第二個上傳（對沖），採用先完成的結果
+        - 整個上傳的期限 settings.UPLOAD_DEADLINE
+
+    settings.CLOUDINARY_API_BASE 可指向本地的替代伺服器（tests/cloudinary_stub.py）進行測試。
+    """
+
+    _session = None
+    _semaphore = None
+    _loop = None  # session 與 semaphore 所屬的事件迴圈
+    _stats = {
+        'uploads': 0, 'failures': 0, 'attempts': 0, 'retries': 0, 'in_flight': 0, 'bytes': 0,
+        'hedges': 0, 'hedges_won': 0, 'deadline_exceeded': 0
+    }
+    _latencies = deque(maxlen=200)  # 最近成功上傳的耗時（秒），用於計算對沖的等待時間
+
+    @staticmethod
+    async def _close_session(session, loop):
+        """
+        關閉 session（可能屬於其他事件迴圈）
+
+        Args:
+            session (aiohttp.ClientSession): 要關閉的 session
+            loop (asyncio.AbstractEventLoop): session 所屬的事件迴圈
+        """
+        if session is None or session.closed:
+            return
+        if loop is None or loop is asyncio.get_running_loop() or loop.is_closed():
+            # 所屬的事件迴圈已關閉時 aiohttp 無法再關閉該迴圈的連線，close() 只會將 session 標記為已關閉
+            # （事件迴圈結束前應先呼叫 CloudinaryUploader.close()，例如 app 的 after_serving）
+            await session.close()
+        elif loop.is_running():
+            # 所屬的事件迴圈仍在其他執行緒中執行，在該迴圈上關閉
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            # 所屬的事件迴圈已停止但尚未關閉，在背景執行緒中暫時執行該迴圈完成關閉
+            await asyncio.to_thread(loop.run_until_complete, session.close())
+
+    @staticmethod
+    async def _resources():
+        """取得目前事件迴圈的 session 與 semaphore（不同的事件迴圈各自建立，並關閉先前事件迴圈的 session）"""
+        loop = asyncio.get_running_loop()
+        session, semaphore = CloudinaryUploader._session, CloudinaryUploader._semaphore
+        if CloudinaryUploader._loop is loop and not session.closed:
+            return session, semaphore
+
+        previous, previous_loop = session, CloudinaryUploader._loop
+        # 先換成新的 session 再關閉先前的 session，同時呼叫的上傳不會各自建立 session
+        connector = aiohttp.TCPConnector(
+            limit=settings.UPLOAD_POOL_SIZE,
+            keepalive_timeout=settings.UPLOAD_KEEPALIVE_TIMEOUT
+        )
+        session = CloudinaryUploader._session = aiohttp.ClientSession(connector=connector)
+        semaphore = CloudinaryUploader._semaphore = asyncio.Semaphore(settings.UPLOAD_MAX_CONCURRENCY)
+        CloudinaryUploader._loop = loop
+        try:
+            await CloudinaryUploader._close_session(previous, previous_loop)
+        except Exception as e:
+            logger.warning(f"關閉先前的上傳連線池失敗：{str(e)}")
+        return session, semaphore
+
+    @staticmethod
+    async def close():
+        """關閉連線池"""
+        session, loop = CloudinaryUploader._session, CloudinaryUploader._loop
+        CloudinaryUploader._session = None
+        CloudinaryUploader._loop = None
+        await CloudinaryUploader._close_session(session, loop)
+
+    @staticmethod
+    def check_settings():
+        """
+        確認上傳期限的設定（啟動時呼叫）
+
+        整體期限 settings.UPLOAD_DEADLINE 不長於每次嘗試的期限 settings.UPLOAD_ATTEMPT_TIMEOUT 時，
+        一次緩慢的嘗試就會用完整體期限，重試、退避與對沖都不會發生，記錄警告。
+
+        Returns:
+            bool: 整體期限是否長於每次嘗試的期限
+        """
+        if settings.UPLOAD_DEADLINE > settings.UPLOAD_ATTEMPT_TIMEOUT:
+            return True
+        logger.warning(
+            f"UPLOAD_DEADLINE（{settings.UPLOAD_DEADLINE} 秒）不長於 UPLOAD_ATTEMPT_TIMEOUT"
+            f"（{settings.UPLOAD_ATTEMPT_TIMEOUT} 秒），逾時的上傳不會重試；"
+            f"請將 UPLOAD_ATTEMPT_TIMEOUT 設為整體期限的一部分"
+        )
+        return False
+
+    @staticmethod
+    def upload_url():
+        return f"{settings.CLOUDINARY_API_BASE.rstrip('/')}/v1_1/{settings.CLOUDINARY_CLOUD_NAME}/image/upload"
+
+    @staticmethod
+    def signed_params(**options):
+        """
+        建立已簽署的上傳參數
+
+        Args:
+            **options: 上傳選項（folder、transformation 等，與 cloudinary.uploader.upload 相同）
+
+        Returns:
+            dict: 含 timestamp、signature 與 api_key 的參數
+        """
+        params = cloudinary.utils.build_upload_params(**options)
+        return cloudinary.utils.sign_request(params, {
+            'api_key': settings.CLOUDINARY_API_KEY,
+            'api_secret': settings.CLOUDINARY_API_SECRET
+        })
+
+    @staticmethod
+    def backoff(attempt):
+        """第 attempt 次失敗後的等待秒數（指數退避，在 [0, 上限] 之間隨機）"""
+        ceiling = min(settings.UPLOAD_BACKOFF_MAX, settings.UPLOAD_BACKOFF_BASE * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    async def _attempt(session, data, filename, params):
+        """單次上傳（受 settings.UPLOAD_ATTEMPT_TIMEOUT 限制）"""
+        form = aiohttp.FormData()
+        for key, value in params.items():
+            form.add_field(key, str(value))
+        form.add_field('file', data, filename=filename, content_type='image/jpeg')
+
+        timeout = aiohttp.ClientTimeout(total=settings.UPLOAD_ATTEMPT_TIMEOUT)
+        try:
+            async with session.post(CloudinaryUploader.upload_url(), data=form, timeout=timeout) as response:
+                if response.status == 200:
+                    return await response.json()
+                body = await response.text()
+                retryable = response.status == 429 or response.status >= 500
+                raise CloudinaryUploadError(
+                    f"Cloudinary 回應狀態碼: {response.status}, 錯誤: {body[:200]}",
+                    status=response.status, retryable=retryable
+                )
+        except asyncio.TimeoutError:
+            raise CloudinaryUploadError(f"上傳逾時（{settings.UPLOAD_ATTEMPT_TIMEOUT} 秒）")
+        except aiohttp.ClientError as e:
+            raise CloudinaryUploadError(f"連線錯誤：{str(e)}")
+
+    @staticmethod
+    def hedge_delay():
+        """
+        送出第二個上傳前等待的秒數
+
+        為最近成功上傳耗時的百分位數（settings.UPLOAD_HEDGE_PERCENTILE），樣本不足時使用
+        settings.UPLOAD_HEDGE_DEFAULT_DELAY，不低於 settings.UPLOAD_HEDGE_MIN_DELAY。
+
+        Returns:
+            float: 等待秒數，停用或不短於每次嘗試的期限時回傳 None
+        """
+        if settings.UPLOAD_HEDGE_PERCENTILE <= 0:
+            return None
+        samples = sorted(CloudinaryUploader._latencies)
+        if len(samples) < settings.UPLOAD_HEDGE_MIN_SAMPLES:
+            delay = settings.UPLOAD_HEDGE_DEFAULT_DELAY
+        else:
+            delay = samples[min(len(samples) - 1, int(len(samples) * settings.UPLOAD_HEDGE_PERCENTILE))]
+        delay = max(delay, settings.UPLOAD_HEDGE_MIN_DELAY)
+        # 第一個上傳在第二個送出前就會逾時，不需要對沖
+        if delay >= settings.UPLOAD_ATTEMPT_TIMEOUT:
+            return None
+        return delay
+
+    @staticmethod
+    async def _timed_attempt(session, semaphore, data, filename, options, attempt, hedge=False, started=None):
+        """
+        取得上傳名額後執行單次上傳，成功時記錄耗時
+
+        Args:
+            started (asyncio.Future, optional): 取得上傳名額、開始上傳時設定結果
+        """
+        stats = CloudinaryUploader._stats
+        # 每次嘗試重新簽署，timestamp 才不會過期
+        params = CloudinaryUploader.signed_params(**options)
+        async with semaphore:
+            if started is not None:
+                started.set_result(None)
+            stats['attempts'] += 1
+            stats['in_flight'] += 1
+            start = time.perf_counter()
+            try:
+                with Tracer.span('upload', filename=filename, bytes=len(data), attempt=attempt, hedge=hedge):
+                    result = await CloudinaryUploader._attempt(session, data, filename, params)
+                elapsed = time.perf_counter() - start
+                CloudinaryUploader._latencies.append(elapsed)
+                logger.info(f"Cloudinary 上傳成功：{filename}，{elapsed * 1000:.0f}ms，第 {attempt} 次嘗試{'（對沖）' if hedge else ''}")
+                return result
+            finally:
+                stats['in_flight'] -= 1
+
+    @staticmethod
+    async def _hedged_attempt(session, semaphore, data, filename, options, attempt):
+        """
+        單次嘗試加上對沖：第一個上傳開始後超過 hedge_delay() 仍未完成時同時送出第二個，
+        採用先成功的結果並取消另一個（兩者使用相同的 public_id，不會留下多餘的資源）
+
+        等待上傳名額的時間不計入對沖的等待時間，同時上傳數量已滿時不會因排隊而送出更多上傳。
+
+        Raises:
+            CloudinaryUploadError: 兩個上傳都失敗（回傳第一個錯誤）
+        """
+        stats = CloudinaryUploader._stats
+        started = asyncio.get_running_loop().create_future()
+        primary = asyncio.create_task(
+            CloudinaryUploader._timed_attempt(session, semaphore, data, filename, options, attempt, started=started)
+        )
+        pending = {primary}
+        try:
+            delay = CloudinaryUploader.hedge_delay()
+            if delay is not None:
+                # 取得上傳名額（或未取得就失敗）後才開始計算對沖的等待時間
+                await asyncio.wait({primary, started}, return_when=asyncio.FIRST_COMPLETED)
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    stats['hedges'] += 1
+                    logger.info(f"上傳超過 {delay * 1000:.0f}ms 仍未完成，同時送出第二個上傳：{filename}")
+                    pending.add(asyncio.create_task(CloudinaryUploader._timed_attempt(
+                        session, semaphore, data, filename, options, attempt, hedge=True
+                    )))
+                else:
+                    pending = done
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 先取出全部的例外（避免未取得例外的警告），再採用成功的結果
+                errors = {task: task.exception() for task in done}
+                for task, exception in errors.items():
+                    if exception is None:
+                        if task is not primary:
+                            stats['hedges_won'] += 1
+                        return task.result()
+                error = error or next(iter(errors.values()))
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _upload_with_retries(data, filename, options):
+        session, semaphore = await CloudinaryUploader._resources()
+        stats = CloudinaryUploader._stats
+        max_attempts = settings.UPLOAD_MAX_ATTEMPTS
+
+        for attempt in range(1, max_attempts + 1):
+            try:
+                result = await CloudinaryUploader._hedged_attempt(session, semaphore, data, filename, options, attempt)
+                stats['uploads'] += 1
+                stats['bytes'] += len(data)
+                return result
+            except CloudinaryUploadError as e:
+                error = e
+
+            logger.warning(f"Cloudinary 上傳失敗 (嘗試 {attempt}/{max_attempts}): {str(error)}")
+            if not error.retryable or attempt == max_attempts:
+                break
+            stats['retries'] += 1
+            await asyncio.sleep(CloudinaryUploader.backoff(attempt))
+
+        stats['failures'] += 1
+        raise error
+
+    @staticmethod
+    async def upload(data, filename, **options):
+        """
+        上傳圖片
+
+        整個上傳（含對沖、重試與退避）不超過 settings.UPLOAD_DEADLINE 秒，
+        呼叫端才能在 LINE 的 reply token 失效前改用其他方式回覆。
+
+        未指定 public_id 時以圖片內容的 SHA-256 命名並覆寫（overwrite），對沖與重試的上傳
+        都寫入同一個資源，被取消或較慢的上傳不會在 Cloudinary 上留下多餘的副本。
+
+        Args:
+            data (bytes): 圖片內容
+            filename (str): 檔名（multipart 的檔名）
+            **options: 上傳選項（folder、transformation、public_id 等）
+
+        Returns:
+            dict: Cloudinary 的回應（含 secure_url）
+
+        Raises:
+            CloudinaryUploadError: 不可重試的錯誤、重試次數用盡或超過整體期限
+        """
+        if not options.get('public_id'):
+            options['public_id'] = hashlib.sha256(data).hexdigest()
+            options.setdefault('overwrite', True)
+        try:
+            return await asyncio.wait_for(
+                CloudinaryUploader._upload_with_retries(data, filename, options), settings.UPLOAD_DEADLINE
+            )
+        except asyncio.TimeoutError:
+            CloudinaryUploader._stats['deadline_exceeded'] += 1
+            CloudinaryUploader._stats['failures'] += 1
+            raise CloudinaryUploadError(f"上傳超過整體期限（{settings.UPLOAD_DEADLINE} 秒）", retryable=False)
+
+    @staticmethod
+    def stats():
+        """
+        回報上傳統計資料
+
+        Returns:
+            dict: 成功與失敗的上傳數、嘗試與重試次數、進行中的上傳數、上傳的位元組數、
+                  對沖次數與對沖勝出次數、超過整體期限的次數與目前的對沖等待時間
+        """
+        delay = CloudinaryUploader.hedge_delay()
+        return dict(
+            CloudinaryUploader._stats,
+            max_concurrency=settings.UPLOAD_MAX_CONCURRENCY,
+            hedge_delay_ms=None if delay is None else round(delay * 1000, 1)
+        )
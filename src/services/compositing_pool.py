@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import multiprocessing
+from io import BytesIO
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from src.config import settings
+from src.services.image_service import ImageService
+from src.utils.tracing import Tracer, CollectSink
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker():
+    """子行程啟動時預先載入合成會用到的相框（直式與橫式）與建立區域遮罩"""
+    # 子行程不直接輸出計時，階段由 _composite_job 收集後傳回主行程記錄
+    Tracer.configure([])
+    # 每個子行程都有自己的一份相框，只載入合成用的兩個相框，不受 FRAME_PRELOAD_ALL 影響
+    ImageService.preload_frames([settings.PORTRAIT_FRAME, settings.LANDSCAPE_FRAME])
+    logger.info(f"合成子行程已啟動：pid={os.getpid()}")
+
+
+def _composite_job(source, image_filename, trace=False):
+    """
+    在子行程中合成圖片
+
+    Args:
+        source (tuple): ('bytes', data)、('shm', name, size) 或 ('path', path)
+        image_filename (str): 原始圖片的檔名
+        trace (bool): 是否收集各階段的計時（主行程有設定輸出目標時）
+
+    Returns:
+        tuple: (ProcessedImage 合成結果, 子行程中的階段計時 [Span, ...])
+    """
+    kind = source[0]
+    if kind == 'shm':
+        _, name, size = source
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            data = bytes(shm.buf[:size])
+        finally:
+            shm.close()
+        source = BytesIO(data)
+    elif kind == 'bytes':
+        source = BytesIO(source[1])
+    else:
+        source = source[1]
+    collector = Tracer.add_sink(CollectSink()) if trace else None
+    try:
+        with Tracer.trace(image_filename):
+            result = ImageService.compose_image_with_frame(source, image_filename)
+    finally:
+        if collector is not None:
+            Tracer.remove_sink(collector)
+    return result, collector.spans if collector is not None else []
+
+
+class CompositingPool:
+    """
+    以子行程執行圖片合成的工作池
+
+    每個子行程在啟動時預先載入直式與橫式相框（每個子行程各佔一份相框記憶體，不計入 MemoryBudget，
+    因此預設子行程數有上限，見 settings.COMPOSITE_WORKERS），圖片內容以 bytes 傳入（大檔案改用共享記憶體），
+    合成結果（已編碼的 JPEG）再以 bytes 傳回。工作池平均每個子行程處理固定數量的工作後，
+    會換成新的工作池（舊的工作池完成手上的工作後自行結束），避免長時間執行造成記憶體碎片。
+    各階段的計時在子行程中收集，連同合成結果傳回後由主行程記錄（/metrics/spans 包含子行程的階段）。
+
+    註：不使用 ProcessPoolExecutor 的 max_tasks_per_child，Python 3.11 在子行程重新啟動
+    且仍有排隊工作時可能會卡住。
+    """
+
+    _lock = threading.Lock()
+    _executor = None
+    _executor_jobs = 0  # 目前工作池已接受的工作數
+    _stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'busy_seconds': 0.0}
+
+    @staticmethod
+    def _create_executor():
+        executor = ProcessPoolExecutor(
+            max_workers=settings.COMPOSITE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        CompositingPool._executor_jobs = 0
+        logger.info(f"合成工作池已建立：{settings.COMPOSITE_WORKERS} 個子行程")
+        return executor
+
+    @staticmethod
+    def start():
+        """建立工作池（已建立時直接回傳）"""
+        with CompositingPool._lock:
+            if CompositingPool._executor is None:
+                CompositingPool._executor = CompositingPool._create_executor()
+            return CompositingPool._executor
+
+    @staticmethod
+    def _acquire():
+        """取得要提交工作的工作池，達到工作數上限時換成新的工作池"""
+        retired = None
+        with CompositingPool._lock:
+            max_jobs = settings.COMPOSITE_MAX_JOBS_PER_WORKER * settings.COMPOSITE_WORKERS
+            if CompositingPool._executor is not None and max_jobs and CompositingPool._executor_jobs >= max_jobs:
+                retired = CompositingPool._executor
+                CompositingPool._executor = None
+                logger.info(f"合成工作池已處理 {CompositingPool._executor_jobs} 個工作，重新建立子行程")
+            if CompositingPool._executor is None:
+                CompositingPool._executor = CompositingPool._create_executor()
+            CompositingPool._executor_jobs += 1
+            executor = CompositingPool._executor
+        if retired is not None:
+            # 不等待：已提交的工作會繼續完成，之後子行程自行結束
+            retired.shutdown(wait=False)
+        return executor
+
+    @staticmethod
+    def shutdown(wait=True):
+        """關閉工作池"""
+        with CompositingPool._lock:
+            executor = CompositingPool._executor
+            CompositingPool._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info("合成工作池已關閉")
+
+    @staticmethod
+    def _reset(executor):
+        """子行程異常結束時丟棄損壞的工作池，下次提交時重新建立"""
+        with CompositingPool._lock:
+            if CompositingPool._executor is executor:
+                CompositingPool._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def submit(source, image_filename):
+        """
+        將合成工作提交到子行程
+
+        Args:
+            source (bytes | str): 原始圖片內容，或原始圖片路徑
+            image_filename (str): 原始圖片的檔名
+
+        Returns:
+            ProcessedImage: 合成結果
+        """
+        executor = CompositingPool._acquire()
+        shm = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            if len(source) >= settings.COMPOSITE_SHM_THRESHOLD:
+                shm = shared_memory.SharedMemory(create=True, size=len(source))
+                shm.buf[:len(source)] = source
+                job_source = ('shm', shm.name, len(source))
+            else:
+                job_source = ('bytes', bytes(source))
+        else:
+            job_source = ('path', source)
+
+        CompositingPool._stats['submitted'] += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, spans = await loop.run_in_executor(
+                executor, _composite_job, job_source, image_filename, Tracer.enabled()
+            )
+            # 子行程的階段（decode、composite、encode 等）記錄到主行程的輸出目標
+            for span in spans:
+                Tracer.emit(span)
+            CompositingPool._stats['completed'] += 1
+            return result
+        except BrokenProcessPool:
+            CompositingPool._stats['failed'] += 1
+            logger.error("合成子行程異常結束，重新建立工作池")
+            logger.error(traceback.format_exc())
+            CompositingPool._reset(executor)
+            raise
+        except Exception:
+            CompositingPool._stats['failed'] += 1
+            raise
+        finally:
+            CompositingPool._stats['busy_seconds'] += time.perf_counter() - start
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    @staticmethod
+    def stats():
+        """
+        回報工作池的統計資料，用於量測每個核心的吞吐量
+
+        Returns:
+            dict: 子行程數、提交/完成/失敗的工作數與累計處理時間
+        """
+        return dict(CompositingPool._stats, workers=settings.COMPOSITE_WORKERS)
@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import traceback
+from PIL import Image
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+SOURCE_DETECTED = 'detected'
+SOURCE_MANUAL = 'manual'
+
+
+class FrameManifest:
+    """
+    相框透明區域清單
+
+    每個相框旁邊會有一個 sidecar JSON（例如 only-frame-land.slots.json），
+    內容以相框檔案的 SHA-256 為鍵，只有相框內容變更時才重新偵測。
+    若清單的 source 為 "manual"，則直接使用手動設定的座標，不進行任何偵測。
+
+    清單格式：
+        {
+            "version": 1,
+            "frame": "only-frame-land.png",
+            "sha256": "...",
+            "size": [寬, 高],
+            "source": "detected" | "manual",
+            "regions": [[x1, y1, x2, y2], ...]
+        }
+    """
+
+    _lock = threading.Lock()
+    _cache = {}  # frame_path -> {'stat': (mtime, size, sidecar_mtime), 'manifest': dict}
+
+    @staticmethod
+    def manifest_path(frame_path):
+        """取得相框對應的 sidecar JSON 路徑"""
+        base, _ = os.path.splitext(frame_path)
+        return base + settings.FRAME_MANIFEST_SUFFIX
+
+    @staticmethod
+    def hash_file(path):
+        """計算檔案內容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _read_manifest(path):
+        """讀取 sidecar JSON，不存在或格式錯誤時回傳 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if not isinstance(manifest.get('regions'), list):
+                logger.warning(f"相框清單缺少 regions 欄位：{path}")
+                return None
+            return manifest
+        except Exception as e:
+            logger.warning(f"讀取相框清單失敗：{path}，錯誤：{str(e)}")
+            return None
+
+    @staticmethod
+    def _write_manifest(path, manifest):
+        """以原子方式寫入 sidecar JSON，失敗時只記錄警告"""
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            logger.info(f"已寫入相框清單：{path}")
+        except Exception as e:
+            logger.warning(f"寫入相框清單失敗：{path}，錯誤：{str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _detect(frame_path, frame_image, sha256):
+        """偵測相框透明區域並建立清單"""
+        # 避免循環匯入
+        from src.services.image_service import ImageService
+
+        if frame_image is None:
+            with Image.open(frame_path) as image:
+                image.load()
+                regions = ImageService.find_transparent_regions(image)
+                size = image.size
+        else:
+            regions = ImageService.find_transparent_regions(frame_image)
+            size = frame_image.size
+
+        return {
+            'version': MANIFEST_VERSION,
+            'frame': os.path.basename(frame_path),
+            'sha256': sha256,
+            'size': list(size),
+            'source': SOURCE_DETECTED,
+            'regions': [list(region) for region in regions]
+        }
+
+    @staticmethod
+    def load(frame_path, frame_image=None):
+        """
+        取得相框的透明區域清單，必要時重新偵測並寫回 sidecar JSON
+
+        Args:
+            frame_path (str): 相框圖片路徑
+            frame_image (PIL.Image, optional): 已開啟的相框圖片，偵測時可避免重新解碼
+
+        Returns:
+            dict: 相框清單
+        """
+        sidecar_path = FrameManifest.manifest_path(frame_path)
+        stat = os.stat(frame_path)
+        sidecar_stat = os.stat(sidecar_path) if os.path.exists(sidecar_path) else None
+        stat_key = (
+            stat.st_mtime_ns, stat.st_size,
+            sidecar_stat.st_mtime_ns if sidecar_stat else None
+        )
+
+        with FrameManifest._lock:
+            cached = FrameManifest._cache.get(frame_path)
+            if cached and cached['stat'] == stat_key:
+                return cached['manifest']
+
+            manifest = FrameManifest._read_manifest(sidecar_path)
+
+            if manifest and manifest.get('source') == SOURCE_MANUAL:
+                # 手動設定的清單優先於偵測結果
+                logger.info(f"使用手動設定的相框清單：{sidecar_path}")
+            else:
+                sha256 = FrameManifest.hash_file(frame_path)
+                if not manifest or manifest.get('sha256') != sha256 or manifest.get('version') != MANIFEST_VERSION:
+                    logger.info(f"相框清單不存在或已過期，重新偵測：{frame_path}")
+                    try:
+                        manifest = FrameManifest._detect(frame_path, frame_image, sha256)
+                    except Exception as e:
+                        logger.error(f"偵測相框透明區域失敗：{str(e)}")
+                        logger.error(traceback.format_exc())
+                        raise
+                    FrameManifest._write_manifest(sidecar_path, manifest)
+                    if os.path.exists(sidecar_path):
+                        stat_key = stat_key[:2] + (os.stat(sidecar_path).st_mtime_ns,)
+
+            FrameManifest._cache[frame_path] = {'stat': stat_key, 'manifest': manifest}
+            return manifest
+
+    @staticmethod
+    def get_regions(frame_path, frame_image=None):
+        """
+        取得相框的透明區域
+
+        Returns:
+            list: 透明區域的邊界框列表 [(x1, y1, x2, y2), ...]
+        """
+        manifest = FrameManifest.load(frame_path, frame_image)
+        return [tuple(region) for region in manifest['regions']]
+
+    @staticmethod
+    def version(frame_path):
+        """取得相框清單的版本識別（手動清單使用清單內容的雜湊）"""
+        manifest = FrameManifest.load(frame_path)
+        if manifest.get('source') == SOURCE_MANUAL:
+            payload = json.dumps(manifest, sort_keys=True).encode('utf-8')
+            return hashlib.sha256(payload).hexdigest()
+        return manifest['sha256']
+
+    @staticmethod
+    def clear_cache():
+        """清除記憶體中的清單快取"""
+        with FrameManifest._lock:
+            FrameManifest._cache.clear()
@@ -0,0 +1,218 @@
+import os
+import glob
+import logging
+import threading
+import traceback
+from PIL import Image
+from src.config import settings
+from src.services.frame_manifest import FrameManifest
+from src.utils.alpha_composite import FrameOverlay
+
+logger = logging.getLogger(__name__)
+
+
+class FrameHandle:
+    """
+    已解碼的相框（唯讀）
+
+    image 為所有請求共用的 RGBA 圖片，呼叫端只能讀取（例如作為 paste 的來源或遮罩），
+    需要修改時請先呼叫 copy() 取得私有副本。
+    """
+
+    __slots__ = ('name', 'path', 'image', 'stat', '_overlay')
+
+    def __init__(self, name, path, image, stat):
+        self.name = name
+        self.path = path
+        self.image = image
+        self.stat = stat
+        self._overlay = None
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def nbytes(self):
+        """解碼後佔用的記憶體大小（bytes）"""
+        width, height = self.image.size
+        nbytes = width * height * len(self.image.getbands())
+        if self._overlay is not None:
+            nbytes += self._overlay.nbytes
+        return nbytes
+
+    @property
+    def overlay(self):
+        """合成用的相框疊加資料（第一次使用時建立）"""
+        if self._overlay is None:
+            self._overlay = FrameOverlay(self.image)
+        return self._overlay
+
+    def copy(self):
+        """取得可修改的相框副本"""
+        return self.image.copy()
+
+
+class FrameRegistry:
+    """
+    相框註冊表
+
+    啟動時將相框目錄中的所有相框解碼為 RGBA 並常駐記憶體，
+    之後每個請求直接取得已解碼的相框，不再重新讀檔與解壓縮 PNG。
+    相框檔案變更時會在下次取用時自動重新載入。
+    """
+
+    _lock = threading.Lock()
+    _frames = {}  # 檔名 -> FrameHandle
+    _scaled = {}  # (檔名, (寬, 高)) -> (原始 FrameHandle, 縮放後 FrameHandle)
+
+    @staticmethod
+    def _stat_key(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _load(name, path):
+        """解碼單一相框並預先建立透明區域清單"""
+        stat = FrameRegistry._stat_key(path)
+        with Image.open(path) as image:
+            image.load()
+            frame = image if image.mode == 'RGBA' else image.convert('RGBA')
+            # 保留檔名，讓區域偵測可以依相框類型排序
+            frame.filename = path
+        FrameManifest.load(path, frame)
+        handle = FrameHandle(name, path, frame, stat)
+        logger.info(f"已載入相框：{name}，尺寸：{frame.size[0]}x{frame.size[1]}，記憶體：{handle.nbytes} bytes")
+        return handle
+
+    @staticmethod
+    def preload(folder=None, names=None):
+        """
+        預先載入相框目錄中的相框
+
+        Args:
+            folder (str, optional): 相框目錄，預設為 settings.FRAME_FOLDER
+            names (list, optional): 要載入的相框檔名，預設為 settings.FRAME_PRELOAD
+                （settings.FRAME_PRELOAD_ALL 啟用時載入相框目錄中的全部相框）
+
+        Returns:
+            int: 成功載入的相框數量
+        """
+        folder = folder or settings.FRAME_FOLDER
+        if names:
+            paths = [os.path.join(folder, name) for name in names]
+        elif settings.FRAME_PRELOAD_ALL:
+            paths = sorted(glob.glob(os.path.join(folder, '*.png')))
+        else:
+            paths = [os.path.join(folder, name) for name in settings.FRAME_PRELOAD]
+
+        loaded = 0
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                handle = FrameRegistry._load(name, path)
+                with FrameRegistry._lock:
+                    FrameRegistry._frames[name] = handle
+                loaded += 1
+            except Exception as e:
+                logger.error(f"載入相框失敗：{path}，錯誤：{str(e)}")
+                logger.error(traceback.format_exc())
+
+        usage = FrameRegistry.memory_usage()
+        logger.info(f"相框預先載入完成：{loaded} 個相框，共 {usage['total_bytes']} bytes")
+        return loaded
+
+    @staticmethod
+    def get(name, folder=None):
+        """
+        取得已解碼的相框
+
+        Args:
+            name (str): 相框檔名
+            folder (str, optional): 相框目錄，預設為 settings.FRAME_FOLDER
+
+        Returns:
+            FrameHandle: 相框，找不到檔案時回傳 None
+        """
+        path = os.path.join(folder or settings.FRAME_FOLDER, name)
+        if not os.path.exists(path):
+            logger.error(f"找不到框架圖片：{path}")
+            return None
+
+        stat = FrameRegistry._stat_key(path)
+        with FrameRegistry._lock:
+            handle = FrameRegistry._frames.get(name)
+            if handle and handle.path == path and handle.stat == stat:
+                return handle
+
+            if handle:
+                logger.info(f"相框檔案已變更，重新載入：{name}")
+            handle = FrameRegistry._load(name, path)
+            FrameRegistry._frames[name] = handle
+            return handle
+
+    @staticmethod
+    def get_scaled(name, size, folder=None):
+        """
+        取得縮放到指定尺寸的相框，每個輸出尺寸只縮放一次
+
+        Args:
+            name (str): 相框檔名
+            size (tuple): 輸出尺寸 (寬, 高)
+            folder (str, optional): 相框目錄，預設為 settings.FRAME_FOLDER
+
+        Returns:
+            FrameHandle: 縮放後的相框，找不到檔案時回傳 None
+        """
+        handle = FrameRegistry.get(name, folder)
+        if handle is None:
+            return None
+        size = tuple(size)
+        if handle.size == size:
+            return handle
+
+        key = (name, size)
+        with FrameRegistry._lock:
+            cached = FrameRegistry._scaled.get(key)
+            if cached and cached[0] is handle:
+                return cached[1]
+
+            scaled_image = handle.image.resize(size, Image.Resampling.LANCZOS)
+            scaled_image.filename = handle.path
+            scaled = FrameHandle(name, handle.path, scaled_image, handle.stat)
+            FrameRegistry._scaled[key] = (handle, scaled)
+            logger.info(f"已建立縮放相框：{name}，尺寸：{size[0]}x{size[1]}，記憶體：{scaled.nbytes} bytes")
+            return scaled
+
+    @staticmethod
+    def names():
+        """已載入的相框檔名"""
+        with FrameRegistry._lock:
+            return list(FrameRegistry._frames)
+
+    @staticmethod
+    def memory_usage():
+        """
+        回報相框註冊表佔用的記憶體
+
+        Returns:
+            dict: {'total_bytes': int, 'frames': {檔名: bytes}, 'scaled': {"檔名@寬x高": bytes}}
+        """
+        with FrameRegistry._lock:
+            frames = {name: handle.nbytes for name, handle in FrameRegistry._frames.items()}
+            scaled = {
+                f"{name}@{size[0]}x{size[1]}": entry[1].nbytes
+                for (name, size), entry in FrameRegistry._scaled.items()
+            }
+        return {
+            'total_bytes': sum(frames.values()) + sum(scaled.values()),
+            'frames': frames,
+            'scaled': scaled
+        }
+
+    @staticmethod
+    def clear():
+        """清除所有已載入的相框"""
+        with FrameRegistry._lock:
+            FrameRegistry._frames.clear()
+            FrameRegistry._scaled.clear()
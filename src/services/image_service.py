@@ -1,20 +1,66 @@
 import os
 import logging
+import tempfile
 import traceback
 from PIL import Image
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
 import asyncio
 from io import BytesIO
 import time
 import math
 from src.config import settings
+from src.services.frame_manifest import FrameManifest
+from src.services.frame_registry import FrameRegistry
+from src.services.jpeg_encoder import JpegEncoder
+from src.services.memory_budget import MemoryBudget
+from src.services.storage_backend import Storage
+from src.utils.region_labeling import label_regions
+from src.utils.tracing import Tracer
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+class ProcessedImage:
+    """
+    合成後的圖片（已編碼的 JPEG 保留在記憶體中）
+
+    合成、上傳與回覆都直接使用記憶體中的資料，寫入磁碟只是選擇性的背景工作。
+    preview 為同一次合成產生的小尺寸預覽圖（同樣是 ProcessedImage），供 LINE 的 preview_image_url 使用。
+    """
+
+    __slots__ = ('filename', 'data', 'width', 'height', 'orientation', 'quality', 'persist_task', 'preview')
+
+    def __init__(self, filename, data, size, orientation, quality, preview=None):
+        self.filename = filename
+        self.data = data
+        self.width, self.height = size
+        self.orientation = orientation
+        self.quality = quality
+        self.persist_task = None
+        self.preview = preview
+
+    @property
+    def size(self):
+        """JPEG 資料大小（bytes）"""
+        return len(self.data)
+
+    @property
+    def is_portrait(self):
+        return self.orientation == 'portrait'
+
+    @property
+    def path(self):
+        """寫入磁碟時的路徑"""
+        return os.path.join(settings.UPLOAD_FOLDER, self.filename)
+
+    def save(self, path=None):
+        """將 JPEG 資料寫入磁碟"""
+        with open(path or self.path, 'wb') as f:
+            f.write(self.data)
+
+
 class ImageService:
+    _background_tasks = set()  # 背景寫入工作（保留參照避免被回收）
+
     @staticmethod
     def allowed_file(filename):
         """檢查檔案是否為允許的類型"""
@@ -29,12 +75,170 @@ class ImageService:
         return is_portrait
 
     @staticmethod
-    def find_transparent_regions(frame_image):
+    def output_size(image_size, max_width=None, max_height=None):
+        """
+        計算輸出圖片尺寸，確保不超過 LINE 平台的限制（寬度優先）
+
+        Args:
+            image_size (tuple): 原始尺寸 (寬, 高)
+            max_width (int, optional): 最大寬度，預設為 settings.MAX_OUTPUT_WIDTH
+            max_height (int, optional): 最大高度，預設為 settings.MAX_OUTPUT_HEIGHT
+
+        Returns:
+            tuple: 輸出尺寸 (寬, 高)
+        """
+        max_width = max_width or settings.MAX_OUTPUT_WIDTH
+        max_height = max_height or settings.MAX_OUTPUT_HEIGHT
+        width, height = image_size
+
+        if width > max_width:
+            return max_width, int(height * max_width / width)
+        if height > max_height:
+            return int(width * max_height / height), max_height
+        return width, height
+
+    @staticmethod
+    def scale_regions(regions, from_size, to_size):
+        """
+        將透明區域座標從原始相框尺寸換算到縮放後的相框尺寸
+
+        Returns:
+            list: 縮放後的邊界框列表 [(x1, y1, x2, y2), ...]
+        """
+        if tuple(from_size) == tuple(to_size):
+            return list(regions)
+        scale_x = to_size[0] / from_size[0]
+        scale_y = to_size[1] / from_size[1]
+        return [
+            (round(x1 * scale_x), round(y1 * scale_y), round(x2 * scale_x), round(y2 * scale_y))
+            for x1, y1, x2, y2 in regions
+        ]
+
+    @staticmethod
+    def required_source_size(image_size, target_sizes, fill=True):
+        """
+        計算原始圖片至少需要的解碼尺寸，讓縮放到每個目標區域時都不需要放大
+
+        Args:
+            image_size (tuple): 原始圖片尺寸 (寬, 高)
+            target_sizes (list): 目標區域尺寸列表 [(寬, 高), ...]
+            fill (bool): 是否為填滿模式（與 fit_image_to_region 相同）
+
+        Returns:
+            tuple: 需要的最小尺寸 (寬, 高)，不會超過原始尺寸
+        """
+        img_width, img_height = image_size
+        ratio = 0
+        for target_width, target_height in target_sizes:
+            width_ratio = target_width / img_width
+            height_ratio = target_height / img_height
+            ratio = max(ratio, max(width_ratio, height_ratio) if fill else min(width_ratio, height_ratio))
+
+        ratio = min(ratio, 1)
+        return (
+            max(1, math.ceil(img_width * ratio)),
+            max(1, math.ceil(img_height * ratio))
+        )
+
+    @staticmethod
+    def decode_target_size(image_size, is_portrait_image, frame_size, transparent_regions):
+        """
+        依相框的透明區域計算照片需要的解碼尺寸（沒有足夠的透明區域時使用預設位置的大小）
+
+        Args:
+            image_size (tuple): 原始圖片尺寸 (寬, 高)
+            is_portrait_image (bool): 是否為直式照片
+            frame_size (tuple): 合成用相框的尺寸 (寬, 高)
+            transparent_regions (list): 透明區域 [(x1, y1, x2, y2), ...]
+
+        Returns:
+            tuple: 需要的最小尺寸 (寬, 高)
+        """
+        frame_width, frame_height = frame_size
+        if transparent_regions and len(transparent_regions) >= 2:
+            target_sizes = [(r[2] - r[0], r[3] - r[1]) for r in transparent_regions]
+            return ImageService.required_source_size(image_size, target_sizes, fill=True)
+        if is_portrait_image:
+            return ImageService.required_source_size(
+                image_size, [(int(frame_width * 0.45), int(frame_height * 0.8))], fill=False
+            )
+        return ImageService.required_source_size(
+            image_size, [(int(frame_width * 0.8), int(frame_height * 0.45))], fill=False
+        )
+
+    @staticmethod
+    def estimate_decode_bytes(source):
+        """
+        只讀取檔頭估計合成一張圖片需要的記憶體
+
+        包含照片解碼後的像素（JPEG 以 draft 模式縮小解碼後的尺寸；其他格式需先完整解碼），
+        以及輸出尺寸的工作空間（合成陣列、RGB 圖片、縮放後的照片與編碼緩衝，約 4 份）。
+
+        Args:
+            source (str | file-like): 原始圖片的路徑或檔案物件
+
+        Returns:
+            int: 預估的 bytes
+        """
+        with Image.open(source) as user_image:
+            is_portrait_image = user_image.height > user_image.width
+            frame_filename = settings.PORTRAIT_FRAME if is_portrait_image else settings.LANDSCAPE_FRAME
+            frame, transparent_regions, output_size = ImageService.prepare_frame(frame_filename)
+            bands = len(user_image.getbands())
+            decoded = user_image.width * user_image.height * bands
+            if frame is not None:
+                required_size = ImageService.decode_target_size(
+                    user_image.size, is_portrait_image, frame.size, transparent_regions
+                )
+                if user_image.format == 'JPEG':
+                    # draft 只調整解碼比例，不會解碼像素
+                    user_image.draft(user_image.mode, required_size)
+                    decoded = user_image.width * user_image.height * bands
+            else:
+                output_size = ImageService.output_size(user_image.size)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return decoded + output_size[0] * output_size[1] * 3 * 4
+
+    @staticmethod
+    def reduce_for_target(image, target_size):
+        """
+        以較小的尺寸解碼圖片，但仍不小於目標尺寸
+
+        JPEG 使用 libjpeg 的 DCT 縮放（draft 模式），在解碼時就縮小為 1/2、1/4 或 1/8；
+        其他格式則在解碼後以整數倍 reduce() 縮小，最後再由呼叫端做精確的重新取樣。
+
+        Args:
+            image (PIL.Image): 尚未載入像素的圖片（Image.open 的結果）
+            target_size (tuple): 需要的最小尺寸 (寬, 高)
+
+        Returns:
+            PIL.Image: 縮小後的圖片（JPEG 為同一個物件）
+        """
+        original_size = image.size
+        target_width, target_height = target_size
+
+        if image.format == 'JPEG':
+            image.draft(image.mode, (target_width, target_height))
+            if image.size != original_size:
+                logger.info(f"JPEG draft 解碼: {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}")
+            return image
+
+        factor = min(original_size[0] // target_width, original_size[1] // target_height)
+        if factor >= 2:
+            image = image.reduce(factor)
+            logger.info(f"整數倍縮小 (factor={factor}): {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}")
+        return image
+
+    @staticmethod
+    def find_transparent_regions(frame_image, step=5, max_regions=None):
         """
         分析相框圖片中的透明區域，找出挖空的位置
         
         Args:
             frame_image (PIL.Image): 相框圖片
+            step (int): 取樣步長，每隔 step 個像素檢查一次
+            max_regions (int, optional): 最多保留的區域數（依面積由大到小），None 表示全部保留
             
         Returns:
             list: 透明區域的邊界框列表 [(x1, y1, x2, y2), ...]
@@ -43,6 +247,7 @@ class ImageService:
             # 記錄相框尺寸
             frame_width, frame_height = frame_image.size
             logger.info(f"相框尺寸: {frame_width}x{frame_height}")
+            frame_filename = os.path.basename(frame_image.filename) if getattr(frame_image, 'filename', None) else "unknown"
             
             # 確保圖片是 RGBA 模式
             if frame_image.mode != 'RGBA':
@@ -50,84 +255,51 @@ class ImageService:
                 logger.info(f"將相框轉換為 RGBA 模式")
                 
             # 獲取圖片的 alpha 通道
-            alpha = np.array(frame_image.getchannel('A'))
+            alpha = np.asarray(frame_image.getchannel('A'))
             
-            # 找出透明區域（alpha 值小於 128 的區域）
-            transparent = alpha < 128
+            # 找出透明區域（alpha 值小於 128 的區域），只取樣步長格點
+            transparent = alpha[::step, ::step] < 128
             
             # 獲取圖片尺寸
-            height, width = transparent.shape
+            height, width = alpha.shape
             
-            # 初始化透明區域列表
-            regions = []
+            # 一次標記所有連通的透明區域
+            components = label_regions(transparent)
+            
+            # 將格點座標換算回像素座標
+            min_x = components['x1'] * step
+            min_y = components['y1'] * step
+            max_x = components['x2'] * step
+            max_y = components['y2'] * step
+            
+            # 計算區域面積與透明度比例
+            area = (max_x - min_x + 1) * (max_y - min_y + 1)
+            transparency_ratio = components['pixels'] / (area / (step * step))
+            
+            # 如果透明區域足夠大且透明度比例足夠高
+            min_area = frame_width * frame_height * 0.05  # 至少為總面積的5%
+            keep = (area > min_area) & (transparency_ratio > 0.5)
             
-            # 檢測連續的透明區域
-            visited = np.zeros_like(transparent, dtype=bool)
-            
-            # 遍歷圖片的每個像素，使用較大的步長以提高效率
-            step = 5  # 每5個像素檢查一次
-            for y in range(0, height, step):
-                for x in range(0, width, step):
-                    # 如果該像素是透明的且未被訪問過
-                    if transparent[y, x] and not visited[y, x]:
-                        # 使用 BFS 找出連續的透明區域
-                        queue = [(x, y)]
-                        visited[y, x] = True
-                        min_x, min_y, max_x, max_y = x, y, x, y
-                        area_pixels = 0  # 計算區域包含的像素數
-                        
-                        while queue:
-                            cx, cy = queue.pop(0)
-                            area_pixels += 1
-                            
-                            # 更新邊界框
-                            min_x = min(min_x, cx)
-                            min_y = min(min_y, cy)
-                            max_x = max(max_x, cx)
-                            max_y = max(max_y, cy)
-                            
-                            # 檢查相鄰的像素，使用較大的步長
-                            for dx, dy in [(0, step), (step, 0), (0, -step), (-step, 0)]:
-                                nx, ny = cx + dx, cy + dy
-                                if 0 <= nx < width and 0 <= ny < height and transparent[ny, nx] and not visited[ny, nx]:
-                                    queue.append((nx, ny))
-                                    visited[ny, nx] = True
-                                    
-                                    # 標記中間的像素為已訪問
-                                    for i in range(1, step):
-                                        if dx != 0 and 0 <= cx + i * dx // step < width:
-                                            visited[cy, cx + i * dx // step] = True
-                                        if dy != 0 and 0 <= cy + i * dy // step < height:
-                                            visited[cy + i * dy // step, cx] = True
-                        
-                        # 計算區域面積
-                        area = (max_x - min_x + 1) * (max_y - min_y + 1)
-                        
-                        # 計算區域的透明度比例
-                        transparency_ratio = area_pixels / (area / (step * step))
-                        
-                        # 如果透明區域足夠大且透明度比例足夠高
-                        min_area = frame_width * frame_height * 0.05  # 至少為總面積的5%
-                        if area > min_area and transparency_ratio > 0.5:
-                            # 擴展邊界以確保包含所有透明像素
-                            margin = 5
-                            min_x = max(0, min_x - margin)
-                            min_y = max(0, min_y - margin)
-                            max_x = min(width - 1, max_x + margin)
-                            max_y = min(height - 1, max_y + margin)
-                            
-                            # 檢查是否為有效的矩形區域
-                            if max_x > min_x and max_y > min_y:
-                                regions.append((min_x, min_y, max_x, max_y))
-                                logger.info(f"找到透明區域: ({min_x}, {min_y}, {max_x}, {max_y}), 面積: {area}, 透明度比例: {transparency_ratio:.2f}")
+            # 擴展邊界以確保包含所有透明像素
+            margin = 5
+            min_x = np.maximum(0, min_x - margin)
+            min_y = np.maximum(0, min_y - margin)
+            max_x = np.minimum(width - 1, max_x + margin)
+            max_y = np.minimum(height - 1, max_y + margin)
+            
+            # 檢查是否為有效的矩形區域
+            keep &= (max_x > min_x) & (max_y > min_y)
+            
+            regions = []
+            for i in np.flatnonzero(keep):
+                region = (int(min_x[i]), int(min_y[i]), int(max_x[i]), int(max_y[i]))
+                regions.append(region)
+                logger.info(f"找到透明區域: {region}, 面積: {area[i]}, 透明度比例: {transparency_ratio[i]:.2f}")
             
             # 如果沒有找到透明區域，嘗試使用預定義的區域
             if not regions:
                 logger.warning("未找到透明區域，嘗試使用預定義的區域")
                 
-                # 檢查相框文件名以確定類型
-                frame_filename = os.path.basename(frame_image.filename) if hasattr(frame_image, 'filename') else "unknown"
-                
                 if frame_filename == settings.PORTRAIT_FRAME:
                     # 直式相框 - 左右兩個區域
                     left_region_width = int(frame_width * 0.45)
@@ -166,19 +338,18 @@ class ImageService:
             # 根據區域大小排序（從大到小）
             regions.sort(key=lambda r: (r[2] - r[0]) * (r[3] - r[1]), reverse=True)
             
-            # 如果找到的區域太多，只保留最大的兩個
-            if len(regions) > 2:
-                regions = regions[:2]
+            # 如果有限制區域數，只保留最大的幾個
+            if max_regions is not None and len(regions) > max_regions:
+                regions = regions[:max_regions]
                 
             # 根據位置排序
-            frame_filename = os.path.basename(frame_image.filename) if hasattr(frame_image, 'filename') else "unknown"
             if frame_filename == settings.PORTRAIT_FRAME:
                 # 直式相框（用於直式照片）- 按 x 坐標排序（左右排列）
-                regions.sort(key=lambda r: r[0])
+                regions.sort(key=lambda r: (r[0], r[1]))
                 logger.info(f"直式相框 ({frame_filename}): 按 x 坐標排序透明區域")
             else:
                 # 橫式相框（用於橫式照片）- 按 y 坐標排序（上下排列）
-                regions.sort(key=lambda r: r[1])
+                regions.sort(key=lambda r: (r[1], r[0]))
                 logger.info(f"橫式相框 ({frame_filename}): 按 y 坐標排序透明區域")
                 
             logger.info(f"最終找到 {len(regions)} 個透明區域: {regions}")
@@ -209,11 +380,48 @@ class ImageService:
             logger.info(f"使用預設區域: {default_regions}")
             return default_regions
 
+    @staticmethod
+    def plan_fit(image_size, region_width, region_height, fill=True):
+        """
+        規劃一次到位的縮放：計算原始圖片中要取樣的精確範圍與輸出尺寸
+
+        Args:
+            image_size (tuple): 原始圖片尺寸 (寬, 高)
+            region_width (int): 目標區域寬度
+            region_height (int): 目標區域高度
+            fill (bool): 是否填滿區域（True: 填滿但可能裁剪，False: 完整顯示但可能有空白）
+
+        Returns:
+            tuple: (輸出尺寸 (寬, 高), 原始圖片中的取樣範圍 (left, top, right, bottom))
+        """
+        img_width, img_height = image_size
+        width_ratio = region_width / img_width
+        height_ratio = region_height / img_height
+
+        if fill:
+            # 填滿模式：以較大的比例縮放，並只取樣置中且剛好覆蓋區域的範圍
+            ratio = max(width_ratio, height_ratio)
+            # 浮點誤差可能讓取樣範圍略大於原始圖片（或起點略小於 0），需限制在圖片範圍內
+            source_width = min(region_width / ratio, img_width)
+            source_height = min(region_height / ratio, img_height)
+            left = max(0.0, (img_width - source_width) / 2)
+            top = max(0.0, (img_height - source_height) / 2)
+            right = min(float(img_width), left + source_width)
+            bottom = min(float(img_height), top + source_height)
+            return (region_width, region_height), (left, top, right, bottom)
+
+        # 適應模式：以較小的比例縮放整張圖片
+        ratio = min(width_ratio, height_ratio)
+        new_size = (max(1, int(img_width * ratio)), max(1, int(img_height * ratio)))
+        return new_size, (0, 0, img_width, img_height)
+
     @staticmethod
     def fit_image_to_region(image, region_width, region_height, fill=True):
         """
         調整圖片大小以適應指定區域，保持原始比例
         
+        只進行一次重新取樣：先規劃原始圖片中的取樣範圍，再以 resize(box=...) 直接輸出目標尺寸。
+        
         Args:
             image (PIL.Image): 原始圖片
             region_width (int): 目標區域寬度
@@ -228,53 +436,17 @@ class ImageService:
             img_width, img_height = image.size
             logger.info(f"原始圖片尺寸: {img_width}x{img_height}, 目標區域尺寸: {region_width}x{region_height}")
             
-            # 檢查圖片方向
-            is_portrait = img_height > img_width
-            logger.info(f"圖片方向: {'直式' if is_portrait else '橫式'}")
+            # 規劃取樣範圍與輸出尺寸
+            new_size, box = ImageService.plan_fit(image.size, region_width, region_height, fill=fill)
+            logger.info(f"{'填滿' if fill else '適應'}模式: 取樣範圍 {tuple(round(v, 2) for v in box)}, 輸出尺寸 {new_size[0]}x{new_size[1]}")
             
-            # 計算縮放比例
-            width_ratio = region_width / img_width
-            height_ratio = region_height / img_height
-            
-            # 根據填充模式選擇縮放比例
-            if fill:
-                # 填滿模式：選擇較大的比例，確保圖片完全填滿區域（可能需要裁剪）
-                ratio = max(width_ratio, height_ratio)
-                logger.info(f"填滿模式: 選擇較大的比例 {ratio} 以確保完全填滿區域")
-            else:
-                # 適應模式：選擇較小的比例，確保圖片完整顯示（可能有空白）
-                ratio = min(width_ratio, height_ratio)
-                logger.info(f"適應模式: 選擇較小的比例 {ratio}")
-            
-            # 計算新尺寸
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            logger.info(f"調整後的圖片尺寸: {new_width}x{new_height}")
-            
-            # 調整圖片大小
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 如果是填滿模式且圖片大於區域，進行裁剪
-            if fill and (new_width > region_width or new_height > region_height):
-                # 計算裁剪區域，以中心點為對焦點
-                left = (new_width - region_width) // 2 if new_width > region_width else 0
-                top = (new_height - region_height) // 2 if new_height > region_height else 0
-                right = left + region_width if new_width > region_width else new_width
-                bottom = top + region_height if new_height > region_height else new_height
-                
-                logger.info(f"裁剪區域: ({left}, {top}, {right}, {bottom})")
-                
-                # 裁剪圖片
-                resized_image = resized_image.crop((left, top, right, bottom))
-                logger.info(f"裁剪後的圖片尺寸: {resized_image.size}")
-                
-                # 確保裁剪後的圖片尺寸與目標區域完全一致
-                if resized_image.size != (region_width, region_height):
-                    logger.info(f"調整最終尺寸以完全匹配目標區域: {region_width}x{region_height}")
-                    resized_image = resized_image.resize((region_width, region_height), Image.Resampling.LANCZOS)
+            # 一次完成裁剪與縮放
+            with Tracer.span('fit', width=img_width, height=img_height, target_width=new_size[0], target_height=new_size[1]):
+                resized_image = image.resize(new_size, Image.Resampling.LANCZOS, box=box)
             
             # 如果圖片小於區域，創建一個透明背景並將圖片居中放置
-            elif not fill and (new_width < region_width or new_height < region_height):
+            new_width, new_height = new_size
+            if not fill and (new_width < region_width or new_height < region_height):
                 # 創建透明背景
                 background = Image.new('RGBA', (region_width, region_height), (0, 0, 0, 0))
                 
@@ -291,7 +463,6 @@ class ImageService:
             return resized_image
         except Exception as e:
             logger.error(f"調整圖片大小時發生錯誤: {str(e)}")
-            import traceback
             logger.error(traceback.format_exc())
             
             # 發生錯誤時，嘗試簡單調整大小並返回
@@ -311,415 +482,565 @@ class ImageService:
                 return image
 
     @staticmethod
-    async def process_image_with_frame(image_filename, frame_style=None):
+    def prepare_frame(frame_filename):
         """
-        將用戶的圖片與選擇的框架合成，自動判斷照片方向
+        取得合成用的相框與透明區域，並預先建立各區域的可見像素遮罩（每個相框只建立一次）
         
         Args:
-            image_filename (str): 原始圖片的檔名
-            frame_style (str, optional): 選擇的框架樣式，如果為 None 則自動根據照片方向選擇
+            frame_filename (str): 相框檔名
             
         Returns:
-            str: 處理後的圖片檔名，如果處理失敗則返回 None
+            tuple: (FrameHandle, 透明區域列表, 最終輸出尺寸)，找不到相框時為 (None, None, None)
+        """
+        # 從相框註冊表取得已解碼的相框（唯讀，不需重新讀檔）
+        with Tracer.span('frame_load', frame=frame_filename) as span:
+            frame = FrameRegistry.get(frame_filename)
+            if frame is None:
+                return None, None, None
+            span.set(width=frame.size[0], height=frame.size[1])
+        
+        # 從相框清單取得透明區域（只有相框變更時才重新偵測）
+        with Tracer.span('region_detection', frame=frame_filename) as span:
+            regions = FrameManifest.get_regions(frame.path, frame.image)
+            span.set(regions=len(regions))
+        
+        # 計算最終輸出尺寸（不超過 LINE 平台的限制）
+        output_size = ImageService.output_size(frame.size)
+        
+        if settings.COMPOSE_AT_OUTPUT_RESOLUTION:
+            # 先將相框與透明區域縮放到最終輸出尺寸（每個尺寸只縮放一次），直接以輸出解析度合成
+            regions = ImageService.scale_regions(regions, frame.size, output_size)
+            logger.info(f"以輸出解析度合成: {frame.size[0]}x{frame.size[1]} -> {output_size[0]}x{output_size[1]}")
+            with Tracer.span('frame_scale', frame=frame_filename, width=output_size[0], height=output_size[1]):
+                frame = FrameRegistry.get_scaled(frame_filename, output_size)
+        
+        if settings.COMPOSITE_KERNEL == 'numpy':
+            overlay = frame.overlay
+            for region in regions:
+                if region not in overlay.slots:
+                    overlay.prepare_slots([region])
+                    slot = overlay.slots[region]
+                    visible = slot.visible_pixels if slot else 0
+                    area = (region[2] - region[0]) * (region[3] - region[1])
+                    logger.info(f"已建立區域遮罩: {frame_filename} {region}，可見像素 {visible}/{area}")
+        
+        return frame, regions, output_size
+
+    @staticmethod
+    def preload_frames(names=None):
+        """
+        預先載入相框，並建立合成用的縮放相框與區域遮罩
+
+        Args:
+            names (list, optional): 要載入的相框檔名，預設依 settings.FRAME_PRELOAD 與 settings.FRAME_PRELOAD_ALL
+        """
+        FrameRegistry.preload(names=names)
+        for frame_filename in names or FrameRegistry.names():
+            try:
+                ImageService.prepare_frame(frame_filename)
+            except Exception as e:
+                logger.error(f"準備相框失敗：{frame_filename}，錯誤：{str(e)}")
+
+    @staticmethod
+    def _placements_overlap(placements):
+        """檢查照片之間是否有重疊"""
+        boxes = [(x, y, x + photo.width, y + photo.height) for photo, (x, y) in placements]
+        for i, a in enumerate(boxes):
+            for b in boxes[i + 1:]:
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    return True
+        return False
+
+    @staticmethod
+    def composite_with_frame(frame, placements):
+        """
+        將照片放在相框下方，合成為 RGB 圖片
+        
+        預設使用 NumPy 合成核心（settings.COMPOSITE_KERNEL == 'numpy'），直接寫入單一 RGB 陣列，
+        結果與建立 RGBA 畫布後依序 paste 照片與相框、再轉為 RGB 相同。
+        
+        Args:
+            frame (FrameHandle): 相框
+            placements (list): [(照片, (x, y)), ...]
+            
+        Returns:
+            PIL.Image: RGB 圖片
+        """
+        photos = [
+            (photo if photo.mode in ('RGB', 'RGBA') else photo.convert('RGBA'), position)
+            for photo, position in placements
+        ]
+        
+        if settings.COMPOSITE_KERNEL == 'numpy':
+            if not ImageService._placements_overlap(photos):
+                return Image.fromarray(frame.overlay.composite(photos), 'RGB')
+            logger.warning("照片位置互相重疊，改用 Pillow 合成")
+        
+        result = Image.new('RGBA', frame.size, (0, 0, 0, 0))
+        for photo, position in photos:
+            photo = photo.convert('RGBA')
+            result.paste(photo, position, photo)
+        result.paste(frame.image, (0, 0), frame.image)
+        return result.convert('RGB')
+
+    @staticmethod
+    def compose_image_with_frame(source, image_filename):
+        """
+        將用戶的圖片與相框合成並編碼為 JPEG，自動判斷照片方向（同步執行，不寫入磁碟）
+        
+        Args:
+            source (str | file-like): 原始圖片的路徑或檔案物件
+            image_filename (str): 原始圖片的檔名（用來產生輸出檔名）
+            
+        Returns:
+            ProcessedImage: 合成結果，如果處理失敗則返回 None
         """
         try:
-            # 構建檔案路徑
-            image_path = os.path.join(settings.UPLOAD_FOLDER, image_filename)
-            
-            # 檢查原始圖片是否存在
-            if not os.path.exists(image_path):
-                logger.error(f"找不到原始圖片：{image_path}")
-                return None
-            
-            # 在線程池中執行同步的圖片處理操作
-            def process_image():
-                try:
-                    # 讀取原始圖片
-                    with Image.open(image_path) as user_image:
-                        # 判斷圖片方向
-                        is_portrait_image = ImageService.is_portrait(user_image)
-                        logger.info(f"圖片方向: {'直式' if is_portrait_image else '橫式'}")
-                        
-                        # 根據圖片方向選擇相框
-                        frame_filename = settings.PORTRAIT_FRAME if is_portrait_image else settings.LANDSCAPE_FRAME
-                        frame_path = os.path.join('static', 'frames', frame_filename)
-                        logger.info(f"選擇的相框: {frame_filename}, 路徑: {frame_path}")
-                        
-                        # 檢查相框圖片是否存在
-                        if not os.path.exists(frame_path):
-                            logger.error(f"找不到框架圖片：{frame_path}")
-                            return None
-                        
-                        # 讀取相框圖片
-                        with Image.open(frame_path) as frame_image:
-                            # 獲取原始圖片和框架尺寸
-                            user_width, user_height = user_image.size
-                            frame_width, frame_height = frame_image.size
-                            logger.info(f"用戶圖片尺寸: {user_width}x{user_height}, 相框尺寸: {frame_width}x{frame_height}")
-                            
-                            # 創建一個新的空白圖像，大小與框架相同
-                            result = Image.new('RGBA', (frame_width, frame_height), (0, 0, 0, 0))
-                            
-                            # 分析相框中的透明區域
-                            transparent_regions = ImageService.find_transparent_regions(frame_image)
-                            
-                            # 如果沒有找到透明區域，使用預設的位置
-                            if not transparent_regions or len(transparent_regions) < 2:
-                                logger.warning("未找到足夠的透明區域，使用預設位置")
-                                
-                                if is_portrait_image:
-                                    # 直式照片 - 放在左右兩個框框中
-                                    # 計算每個框框的大小（假設左右兩個框框大小相同）
-                                    frame_box_width = int(frame_width * 0.45)  # 每個框框寬度約為總寬度的45%
-                                    frame_box_height = int(frame_height * 0.8)  # 每個框框高度約為總高度的80%
-                                    logger.info(f"使用預設位置 - 直式照片: 框框大小 {frame_box_width}x{frame_box_height}")
-                                    
-                                    # 計算縮放比例，保持原始照片的長寬比
-                                    width_ratio = frame_box_width / user_width
-                                    height_ratio = frame_box_height / user_height
-                                    
-                                    # 直式照片通常需要填滿寬度，所以使用寬度比例，但確保不超過高度
-                                    ratio = min(width_ratio, height_ratio) * 0.95  # 縮小5%以確保有邊距
-                                    logger.info(f"縮放比例: {ratio}")
-                                    
-                                    # 縮放用戶圖片
-                                    new_width = int(user_width * ratio)
-                                    new_height = int(user_height * ratio)
-                                    user_image_resized = user_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                                    logger.info(f"縮放後的圖片尺寸: {new_width}x{new_height}")
-                                    
-                                    # 將用戶圖片轉換為 RGBA 模式
-                                    user_image_resized = user_image_resized.convert('RGBA')
-                                    
-                                    # 計算左側框框的位置 - 水平居中，垂直居中
-                                    x_offset_left = int(frame_width * 0.05)  # 左側框框的左側位置
-                                    y_offset_left = (frame_height - new_height) // 2  # 垂直居中
-                                    
-                                    # 計算右側框框的位置 - 水平居中，垂直居中
-                                    x_offset_right = int(frame_width * 0.5)  # 右側框框的左側位置
-                                    y_offset_right = (frame_height - new_height) // 2  # 垂直居中
-                                    
-                                    logger.info(f"左側照片位置: ({x_offset_left}, {y_offset_left}), 右側照片位置: ({x_offset_right}, {y_offset_right})")
-                                    
-                                    # 將照片粘貼到結果圖像上
-                                    result.paste(user_image_resized, (x_offset_left, y_offset_left), user_image_resized)
-                                    result.paste(user_image_resized, (x_offset_right, y_offset_right), user_image_resized)
-                                    
-                                    logger.info(f"直式照片處理: 原始大小 ({user_width}x{user_height}), 縮放後 ({new_width}x{new_height})")
-                                    logger.info(f"左側照片位置: ({x_offset_left}, {y_offset_left}), 右側照片位置: ({x_offset_right}, {y_offset_right})")
-                                    
-                                else:
-                                    # 橫式照片 - 放在上下兩個框框中
-                                    # 計算每個框框的大小（假設上下兩個框框大小相同）
-                                    frame_box_width = int(frame_width * 0.8)  # 每個框框寬度約為總寬度的80%
-                                    frame_box_height = int(frame_height * 0.45)  # 每個框框高度約為總高度的45%
-                                    logger.info(f"使用預設位置 - 橫式照片: 框框大小 {frame_box_width}x{frame_box_height}")
-                                    
-                                    # 計算縮放比例，保持原始照片的長寬比
-                                    width_ratio = frame_box_width / user_width
-                                    height_ratio = frame_box_height / user_height
-                                    
-                                    # 橫式照片通常需要填滿寬度，所以使用寬度比例，但確保不超過高度
-                                    ratio = min(width_ratio, height_ratio) * 0.95  # 縮小5%以確保有邊距
-                                    logger.info(f"縮放比例: {ratio}")
-                                    
-                                    # 縮放用戶圖片
-                                    new_width = int(user_width * ratio)
-                                    new_height = int(user_height * ratio)
-                                    user_image_resized = user_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                                    logger.info(f"縮放後的圖片尺寸: {new_width}x{new_height}")
-                                    
-                                    # 將用戶圖片轉換為 RGBA 模式
-                                    user_image_resized = user_image_resized.convert('RGBA')
-                                    
-                                    # 計算上方框框的位置 - 水平居中，垂直位置固定
-                                    x_offset_top = (frame_width - new_width) // 2  # 水平居中
-                                    y_offset_top = int(frame_height * 0.05)  # 上方框框的頂部位置
-                                    
-                                    # 計算下方框框的位置 - 水平居中，垂直位置固定
-                                    x_offset_bottom = (frame_width - new_width) // 2  # 水平居中
-                                    y_offset_bottom = int(frame_height * 0.5)  # 下方框框的頂部位置
-                                    
-                                    logger.info(f"上方照片位置: ({x_offset_top}, {y_offset_top}), 下方照片位置: ({x_offset_bottom}, {y_offset_bottom})")
-                                    
-                                    # 將照片粘貼到結果圖像上
-                                    result.paste(user_image_resized, (x_offset_top, y_offset_top), user_image_resized)
-                                    result.paste(user_image_resized, (x_offset_bottom, y_offset_bottom), user_image_resized)
-                                    
-                                    logger.info(f"橫式照片處理: 原始大小 ({user_width}x{user_height}), 縮放後 ({new_width}x{new_height})")
-                                    logger.info(f"上方照片位置: ({x_offset_top}, {y_offset_top}), 下方照片位置: ({x_offset_bottom}, {y_offset_bottom})")
-                            else:
-                                # 使用找到的透明區域來放置照片
-                                region1, region2 = transparent_regions[:2]
-                                
-                                # 計算每個透明區域的尺寸
-                                region1_width = region1[2] - region1[0]
-                                region1_height = region1[3] - region1[1]
-                                region2_width = region2[2] - region2[0]
-                                region2_height = region2[3] - region2[1]
-                                
-                                logger.info(f"區域1尺寸: {region1_width}x{region1_height}, 區域2尺寸: {region2_width}x{region2_height}")
-                                
-                                # 使用改進的 fit_image_to_region 方法來調整圖片大小
-                                # 為每個區域單獨調整圖片大小，使用填滿模式確保完全填滿黑框區域
-                                fill_mode = True  # 使用填滿模式
-                                
-                                # 調整區域尺寸以確保完全填滿
-                                user_image_region1 = ImageService.fit_image_to_region(
-                                    user_image, region1_width, region1_height, fill=fill_mode
-                                )
-                                user_image_region2 = ImageService.fit_image_to_region(
-                                    user_image, region2_width, region2_height, fill=fill_mode
-                                )
-                                
-                                # 將用戶圖片轉換為 RGBA 模式
-                                user_image_region1 = user_image_region1.convert('RGBA')
-                                user_image_region2 = user_image_region2.convert('RGBA')
-                                
-                                # 將照片粘貼到結果圖像上，精確放置在透明區域
-                                result.paste(user_image_region1, (region1[0], region1[1]), user_image_region1)
-                                result.paste(user_image_region2, (region2[0], region2[1]), user_image_region2)
-                                
-                                logger.info(f"照片處理: 原始大小 ({user_width}x{user_height})")
-                                logger.info(f"區域1照片大小: {user_image_region1.size}, 區域2照片大小: {user_image_region2.size}")
-                                logger.info(f"區域1照片位置: ({region1[0]}, {region1[1]}), 區域2照片位置: ({region2[0]}, {region2[1]})")
-                            
-                            # 將框架粘貼到結果圖像上
-                            result.paste(frame_image, (0, 0), frame_image)
-                            
-                            # 生成新檔名
-                            timestamp = image_filename.split('_')[0]  # 取得時間戳記
-                            orientation = "portrait" if is_portrait_image else "landscape"
-                            processed_filename = f"processed_{timestamp}_{orientation}_{image_filename}"
-                            processed_path = os.path.join(settings.UPLOAD_FOLDER, processed_filename)
-                            logger.info(f"生成的新檔名: {processed_filename}")
-                            
-                            # 檢查結果圖片的尺寸
-                            result_width, result_height = result.size
-                            logger.info(f"處理後的圖片尺寸: {result_width}x{result_height}")
-                            
-                            # 確保圖片尺寸不超過 LINE 平台的限制
-                            max_width = 1024
-                            max_height = 1024
-                            needs_resize = False
-                            
-                            if result_width > max_width:
-                                ratio = max_width / result_width
-                                new_width = max_width
-                                new_height = int(result_height * ratio)
-                                needs_resize = True
-                            elif result_height > max_height:
-                                ratio = max_height / result_height
-                                new_height = max_height
-                                new_width = int(result_width * ratio)
-                                needs_resize = True
-                            
-                            if needs_resize:
-                                logger.info(f"調整最終圖片尺寸為: {new_width}x{new_height}")
-                                result = result.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                            
-                            # 儲存處理後的圖片（轉換為 RGB 以移除透明度）
-                            result = result.convert('RGB')
-                            
-                            # 使用適當的質量設置，直式照片使用較低的質量以減小文件大小
-                            quality = 85 if is_portrait_image else 90
-                            result.save(processed_path, 'JPEG', quality=quality, optimize=True)
-                            
-                            # 檢查文件大小，如果太大則進一步壓縮
-                            file_size = os.path.getsize(processed_path)
-                            logger.info(f"初始處理後的圖片大小：{file_size} bytes")
-                            
-                            # 如果文件仍然太大，進一步降低質量
-                            max_size = 500000  # 500KB
-                            if file_size > max_size:
-                                with Image.open(processed_path) as img:
-                                    for q in [80, 75, 70, 65]:
-                                        img.save(processed_path, 'JPEG', quality=q, optimize=True)
-                                        new_size = os.path.getsize(processed_path)
-                                        logger.info(f"進一步壓縮照片，質量={q}，新大小={new_size} bytes")
-                                        if new_size <= max_size:
-                                            break
-                            
-                            # 記錄最終處理後的圖片大小
-                            final_size = os.path.getsize(processed_path)
-                            logger.info(f"圖片處理完成：{processed_path}")
-                            logger.info(f"最終處理後的圖片大小：{final_size} bytes")
-                            
-                            return processed_filename
-                except Exception as e:
-                    logger.error(f"處理圖片時發生錯誤：{str(e)}")
-                    import traceback
-                    logger.error(traceback.format_exc())
+            # 讀取原始圖片（只讀取檔頭）
+            with Tracer.span('open') as span:
+                user_image = Image.open(source)
+                span.set(format=user_image.format, width=user_image.width, height=user_image.height)
+            with user_image:
+                # 判斷圖片方向
+                with Tracer.span('orientation', width=user_image.width, height=user_image.height) as span:
+                    is_portrait_image = ImageService.is_portrait(user_image)
+                    span.set(portrait=is_portrait_image)
+                logger.info(f"圖片方向: {'直式' if is_portrait_image else '橫式'}")
+            
+                # 根據圖片方向選擇相框
+                frame_filename = settings.PORTRAIT_FRAME if is_portrait_image else settings.LANDSCAPE_FRAME
+                frame_path = os.path.join(settings.FRAME_FOLDER, frame_filename)
+                logger.info(f"選擇的相框: {frame_filename}, 路徑: {frame_path}")
+            
+                # 取得合成用的相框、透明區域與最終輸出尺寸
+                frame, transparent_regions, output_size = ImageService.prepare_frame(frame_filename)
+                if frame is None:
                     return None
+                frame_image = frame.image
+            
+                # 獲取框架尺寸
+                frame_width, frame_height = frame_image.size
+            
+                # 要放在相框下方的照片與位置 [(照片, (x, y)), ...]
+                placements = []
+            
+                # 依目標區域大小降低解碼尺寸，避免完整解碼高解析度照片
+                required_size = ImageService.decode_target_size(
+                    user_image.size, is_portrait_image, frame_image.size, transparent_regions
+                )
+                with Tracer.span('decode', format=user_image.format) as span:
+                    user_image = ImageService.reduce_for_target(user_image, required_size)
+                    user_image.load()
+                    span.set(width=user_image.width, height=user_image.height,
+                             bytes=user_image.width * user_image.height * len(user_image.getbands()))
+            
+                # 獲取原始圖片尺寸（縮小解碼後）
+                user_width, user_height = user_image.size
+                logger.info(f"用戶圖片尺寸: {user_width}x{user_height}, 相框尺寸: {frame_width}x{frame_height}")
             
-            # 在線程池中執行同步操作
-            return await asyncio.to_thread(process_image)
+                # 如果沒有找到透明區域，使用預設的位置
+                if not transparent_regions or len(transparent_regions) < 2:
+                    logger.warning("未找到足夠的透明區域，使用預設位置")
                 
+                    if is_portrait_image:
+                        # 直式照片 - 放在左右兩個框框中
+                        # 計算每個框框的大小（假設左右兩個框框大小相同）
+                        frame_box_width = int(frame_width * 0.45)  # 每個框框寬度約為總寬度的45%
+                        frame_box_height = int(frame_height * 0.8)  # 每個框框高度約為總高度的80%
+                        logger.info(f"使用預設位置 - 直式照片: 框框大小 {frame_box_width}x{frame_box_height}")
+                    
+                        # 計算縮放比例，保持原始照片的長寬比
+                        width_ratio = frame_box_width / user_width
+                        height_ratio = frame_box_height / user_height
+                    
+                        # 直式照片通常需要填滿寬度，所以使用寬度比例，但確保不超過高度
+                        ratio = min(width_ratio, height_ratio) * 0.95  # 縮小5%以確保有邊距
+                        logger.info(f"縮放比例: {ratio}")
+                    
+                        # 縮放用戶圖片
+                        new_width = int(user_width * ratio)
+                        new_height = int(user_height * ratio)
+                        user_image_resized = user_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                        logger.info(f"縮放後的圖片尺寸: {new_width}x{new_height}")
+                    
+                        # 計算左側框框的位置 - 水平居中，垂直居中
+                        x_offset_left = int(frame_width * 0.05)  # 左側框框的左側位置
+                        y_offset_left = (frame_height - new_height) // 2  # 垂直居中
+                    
+                        # 計算右側框框的位置 - 水平居中，垂直居中
+                        x_offset_right = int(frame_width * 0.5)  # 右側框框的左側位置
+                        y_offset_right = (frame_height - new_height) // 2  # 垂直居中
+                    
+                        logger.info(f"左側照片位置: ({x_offset_left}, {y_offset_left}), 右側照片位置: ({x_offset_right}, {y_offset_right})")
+                    
+                        # 將照片放在左右兩個框框中
+                        placements.append((user_image_resized, (x_offset_left, y_offset_left)))
+                        placements.append((user_image_resized, (x_offset_right, y_offset_right)))
+                    
+                        logger.info(f"直式照片處理: 原始大小 ({user_width}x{user_height}), 縮放後 ({new_width}x{new_height})")
+                        logger.info(f"左側照片位置: ({x_offset_left}, {y_offset_left}), 右側照片位置: ({x_offset_right}, {y_offset_right})")
+                    
+                    else:
+                        # 橫式照片 - 放在上下兩個框框中
+                        # 計算每個框框的大小（假設上下兩個框框大小相同）
+                        frame_box_width = int(frame_width * 0.8)  # 每個框框寬度約為總寬度的80%
+                        frame_box_height = int(frame_height * 0.45)  # 每個框框高度約為總高度的45%
+                        logger.info(f"使用預設位置 - 橫式照片: 框框大小 {frame_box_width}x{frame_box_height}")
+                    
+                        # 計算縮放比例，保持原始照片的長寬比
+                        width_ratio = frame_box_width / user_width
+                        height_ratio = frame_box_height / user_height
+                    
+                        # 橫式照片通常需要填滿寬度，所以使用寬度比例，但確保不超過高度
+                        ratio = min(width_ratio, height_ratio) * 0.95  # 縮小5%以確保有邊距
+                        logger.info(f"縮放比例: {ratio}")
+                    
+                        # 縮放用戶圖片
+                        new_width = int(user_width * ratio)
+                        new_height = int(user_height * ratio)
+                        user_image_resized = user_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                        logger.info(f"縮放後的圖片尺寸: {new_width}x{new_height}")
+                    
+                        # 計算上方框框的位置 - 水平居中，垂直位置固定
+                        x_offset_top = (frame_width - new_width) // 2  # 水平居中
+                        y_offset_top = int(frame_height * 0.05)  # 上方框框的頂部位置
+                    
+                        # 計算下方框框的位置 - 水平居中，垂直位置固定
+                        x_offset_bottom = (frame_width - new_width) // 2  # 水平居中
+                        y_offset_bottom = int(frame_height * 0.5)  # 下方框框的頂部位置
+                    
+                        logger.info(f"上方照片位置: ({x_offset_top}, {y_offset_top}), 下方照片位置: ({x_offset_bottom}, {y_offset_bottom})")
+                    
+                        # 將照片放在上下兩個框框中
+                        placements.append((user_image_resized, (x_offset_top, y_offset_top)))
+                        placements.append((user_image_resized, (x_offset_bottom, y_offset_bottom)))
+                    
+                        logger.info(f"橫式照片處理: 原始大小 ({user_width}x{user_height}), 縮放後 ({new_width}x{new_height})")
+                        logger.info(f"上方照片位置: ({x_offset_top}, {y_offset_top}), 下方照片位置: ({x_offset_bottom}, {y_offset_bottom})")
+                else:
+                    # 使用找到的透明區域來放置照片（支援兩個以上的區域）
+                    # 使用改進的 fit_image_to_region 方法來調整圖片大小
+                    # 為每個區域單獨調整圖片大小，使用填滿模式確保完全填滿黑框區域
+                    fill_mode = True  # 使用填滿模式
+                
+                    logger.info(f"照片處理: 原始大小 ({user_width}x{user_height})")
+                
+                    # 相同尺寸的區域共用同一張縮放後的照片
+                    fitted_images = {}
+                    for index, region in enumerate(transparent_regions, start=1):
+                        # 計算透明區域的尺寸
+                        region_width = region[2] - region[0]
+                        region_height = region[3] - region[1]
+                        logger.info(f"區域{index}尺寸: {region_width}x{region_height}")
+                    
+                        user_image_region = fitted_images.get((region_width, region_height))
+                        if user_image_region is None:
+                            # 調整區域尺寸以確保完全填滿
+                            user_image_region = ImageService.fit_image_to_region(
+                                user_image, region_width, region_height, fill=fill_mode
+                            )
+                            fitted_images[(region_width, region_height)] = user_image_region
+                        else:
+                            logger.info(f"區域{index}與先前區域尺寸相同，重複使用縮放結果")
+                    
+                        # 將照片精確放置在透明區域
+                        placements.append((user_image_region, (region[0], region[1])))
+                        logger.info(f"區域{index}照片大小: {user_image_region.size}, 位置: ({region[0]}, {region[1]})")
+            
+                # 將照片與相框合成為 RGB 圖片
+                with Tracer.span('paste', kernel=settings.COMPOSITE_KERNEL, photos=len(placements),
+                                 width=frame.size[0], height=frame.size[1]):
+                    result = ImageService.composite_with_frame(frame, placements)
+            
+                # 生成新檔名
+                timestamp = image_filename.split('_')[0]  # 取得時間戳記
+                orientation = "portrait" if is_portrait_image else "landscape"
+                processed_filename = f"processed_{timestamp}_{orientation}_{image_filename}"
+                logger.info(f"生成的新檔名: {processed_filename}")
+            
+                # 檢查結果圖片的尺寸
+                result_width, result_height = result.size
+                logger.info(f"處理後的圖片尺寸: {result_width}x{result_height}")
+            
+                # 確保圖片尺寸不超過 LINE 平台的限制（以輸出解析度合成時不需要再縮放）
+                new_width, new_height = output_size
+                if output_size != result.size:
+                    logger.info(f"調整最終圖片尺寸為: {new_width}x{new_height}")
+                    with Tracer.span('resize', width=result_width, height=result_height,
+                                     target_width=new_width, target_height=new_height):
+                        result = result.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            
+                # 使用適當的質量設置，直式照片使用較低的質量以減小文件大小
+                # 在記憶體中搜尋符合大小上限的最高品質，結果直接保留在記憶體中
+                quality = settings.JPEG_QUALITY_PORTRAIT if is_portrait_image else settings.JPEG_QUALITY_LANDSCAPE
+                encoded = JpegEncoder.encode(result, quality=quality)
+                logger.info(f"圖片處理完成：{processed_filename}，大小：{encoded.size} bytes，品質={encoded.quality}，嘗試次數={encoded.attempts}")
+            
+                # 同一次處理中產生預覽圖，聊天列表與訊息泡泡不需要下載完整圖片
+                with Tracer.span('preview') as span:
+                    preview = ImageService.render_preview(result, processed_filename, orientation)
+                    span.set(width=preview.width, height=preview.height, bytes=preview.size)
+            
+                return ProcessedImage(processed_filename, encoded.data, result.size, orientation, encoded.quality, preview)
         except Exception as e:
             logger.error(f"處理圖片時發生錯誤：{str(e)}")
-            import traceback
             logger.error(traceback.format_exc())
             return None
 
     @staticmethod
-    async def upload_to_cloudinary(image_path):
-        """上傳圖片到 Cloudinary"""
+    def render_preview(image, filename, orientation):
+        """
+        由最終輸出圖片產生預覽圖（長邊不超過 settings.PREVIEW_MAX_SIZE）
+        
+        Args:
+            image (PIL.Image): 最終輸出的 RGB 圖片
+            filename (str): 輸出圖片的檔名
+            orientation (str): 照片方向
+            
+        Returns:
+            ProcessedImage: 預覽圖
+        """
+        preview_image = image.copy()
+        preview_image.thumbnail((settings.PREVIEW_MAX_SIZE, settings.PREVIEW_MAX_SIZE), Image.Resampling.LANCZOS)
+        encoded = JpegEncoder.encode(preview_image, quality=settings.PREVIEW_QUALITY)
+        logger.info(f"預覽圖尺寸: {preview_image.size[0]}x{preview_image.size[1]}，大小：{encoded.size} bytes")
+        return ProcessedImage(f"preview_{filename}", encoded.data, preview_image.size, orientation, encoded.quality)
+
+    @staticmethod
+    async def render_image_with_frame(image_filename, content=None):
+        """
+        在線程池或子行程中合成圖片（依 settings.COMPOSITE_BACKEND），結果保留在記憶體中
+        
+        解碼前先依檔頭估計需要的記憶體並向 MemoryBudget 預留，預算不足時排隊等待。
+        
+        Args:
+            image_filename (str): 原始圖片的檔名
+            content (bytes, optional): 原始圖片內容，提供時直接從記憶體解碼，不讀取磁碟
+            
+        Returns:
+            ProcessedImage: 合成結果，如果處理失敗則返回 None
+        """
         try:
-            # 檢查 Cloudinary 配置是否完整
-            if not all([settings.CLOUDINARY_CLOUD_NAME, settings.CLOUDINARY_API_KEY, settings.CLOUDINARY_API_SECRET]):
-                logger.error("Cloudinary 配置不完整")
-                return None
+            if content is None:
+                path = os.path.join(settings.UPLOAD_FOLDER, image_filename)
                 
-            # 檢查文件是否存在
-            if not os.path.exists(image_path):
-                logger.error(f"找不到要上傳的文件：{image_path}")
-                return None
-                
-            # 記錄文件大小
-            file_size = os.path.getsize(image_path)
-            logger.info(f"準備上傳到 Cloudinary 的文件大小：{file_size} bytes")
+                # 檢查原始圖片是否存在
+                if not os.path.exists(path):
+                    logger.error(f"找不到原始圖片：{path}")
+                    return None
             
-            # 檢查是否為直式照片 - 通過實際檢查圖片尺寸而不僅僅依賴文件名
-            is_portrait = False
-            try:
-                with Image.open(image_path) as img:
-                    width, height = img.size
-                    is_portrait = height > width
-                    logger.info(f"照片方向檢查: 尺寸={width}x{height}, 是否為直式={is_portrait}")
-            except Exception as e:
-                logger.error(f"檢查圖片方向時發生錯誤: {str(e)}")
-                # 如果無法檢查尺寸，則回退到使用文件名判斷
-                is_portrait = "portrait" in os.path.basename(image_path)
-                logger.info(f"使用文件名判斷照片方向: {'直式' if is_portrait else '橫式'}")
+            source = BytesIO(content) if content is not None else path
             
-            # 處理圖片，確保符合 LINE 平台的要求
-            try:
-                with Image.open(image_path) as img:
-                    # 檢查圖片尺寸
-                    width, height = img.size
-                    logger.info(f"原始圖片尺寸: {width}x{height}")
-                    
-                    # 調整圖片大小
-                    max_width = 1024  # LINE 平台的最大寬度限制
-                    max_height = 1024  # 設置一個合理的最大高度
+            # 同一張圖片的各階段計時都標記為 image_filename（asyncio.to_thread 會一併帶入執行緒）
+            with Tracer.trace(image_filename):
+                # 只讀取檔頭估計解碼需要的記憶體，預算不足時排隊，避免同時解碼多張大圖
+                nbytes = await asyncio.to_thread(ImageService.estimate_decode_bytes, source)
+                async with MemoryBudget.reserve(nbytes, image_filename):
+                    if settings.COMPOSITE_BACKEND == 'process':
+                        # 在子行程中合成，可同時使用多個核心
+                        from src.services.compositing_pool import CompositingPool
+                        return await CompositingPool.submit(content if content is not None else path, image_filename)
                     
-                    # 計算新尺寸，保持原始比例
-                    if is_portrait:
-                        # 直式照片 - 確保寬度不超過限制
-                        if width > max_width:
-                            ratio = max_width / width
-                            new_width = max_width
-                            new_height = int(height * ratio)
-                            # 確保高度也不超過限制
-                            if new_height > max_height:
-                                ratio = max_height / new_height
-                                new_height = max_height
-                                new_width = int(new_width * ratio)
-                            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                            logger.info(f"調整後的直式照片尺寸: {new_width}x{new_height}")
-                    else:
-                        # 橫式照片 - 確保高度不超過限制
-                        if height > max_height:
-                            ratio = max_height / height
-                            new_height = max_height
-                            new_width = int(width * ratio)
-                            # 確保寬度也不超過限制
-                            if new_width > max_width:
-                                ratio = max_width / new_width
-                                new_width = max_width
-                                new_height = int(new_height * ratio)
-                            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                            logger.info(f"調整後的橫式照片尺寸: {new_width}x{new_height}")
-                    
-                    # 確保圖片是 RGB 模式（移除透明度）
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                        logger.info("圖片已轉換為 RGB 模式")
-                    
-                    # 保存為 JPEG 格式，使用適當的質量
-                    quality = 85 if is_portrait else 90  # 直式照片使用稍低的質量以減小文件大小
-                    img.save(image_path, 'JPEG', quality=quality, optimize=True)
-                    new_size = os.path.getsize(image_path)
-                    logger.info(f"照片已調整，新大小：{new_size} bytes")
-                    
-                    # 如果文件仍然太大，進一步降低質量
-                    max_size = 500000  # 500KB
-                    if new_size > max_size:
-                        for q in [80, 75, 70, 65]:
-                            img.save(image_path, 'JPEG', quality=q, optimize=True)
-                            new_size = os.path.getsize(image_path)
-                            logger.info(f"進一步壓縮照片，質量={q}，新大小={new_size} bytes")
-                            if new_size <= max_size:
-                                break
-            except Exception as e:
-                logger.error(f"調整照片失敗：{str(e)}")
-                logger.error(traceback.format_exc())
-            
-            logger.info(f"開始上傳到 Cloudinary：{image_path}")
-            
-            # 配置 Cloudinary
-            cloudinary.config(
-                cloud_name=settings.CLOUDINARY_CLOUD_NAME,
-                api_key=settings.CLOUDINARY_API_KEY,
-                api_secret=settings.CLOUDINARY_API_SECRET
-            )
+                    # 在線程池中執行同步操作
+                    return await asyncio.to_thread(ImageService.compose_image_with_frame, source, image_filename)
+        except Exception as e:
+            logger.error(f"處理圖片時發生錯誤：{str(e)}")
+            logger.error(traceback.format_exc())
+            return None
+
+    @staticmethod
+    async def process_image_with_frame(image_filename, frame_style=None):
+        """
+        將用戶的圖片與選擇的框架合成，自動判斷照片方向，並將結果寫入上傳目錄
+        
+        Args:
+            image_filename (str): 原始圖片的檔名
+            frame_style (str, optional): 選擇的框架樣式，如果為 None 則自動根據照片方向選擇
             
-            # 上傳到 Cloudinary，添加轉換選項
+        Returns:
+            str: 處理後的圖片檔名，如果處理失敗則返回 None
+        """
+        processed = await ImageService.render_image_with_frame(image_filename)
+        if not processed:
+            return None
+        
+        try:
+            await asyncio.to_thread(processed.save)
+            logger.info(f"最終處理後的圖片大小：{processed.size} bytes")
+            return processed.filename
+        except Exception as e:
+            logger.error(f"儲存處理後的圖片失敗：{str(e)}")
+            logger.error(traceback.format_exc())
+            return None
+
+    @staticmethod
+    def _read_file(path):
+        """讀取檔案（在背景執行緒中執行）"""
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _write_file(data, path):
+        """寫入檔案（在背景執行緒中執行；先寫入暫存檔再改名，覆寫既有檔案時讀取端不會看到寫到一半的內容）"""
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
             try:
-                # 為直式照片添加特殊的轉換選項
-                transformation = []
+                # mkstemp 建立的檔案只有擁有者可讀，改為一般檔案的權限（nginx 以 X-Accel-Redirect 直接讀取）
+                os.fchmod(fd, 0o644)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            logger.info(f"檔案已寫入：{path}，大小：{len(data)} bytes")
+        except Exception as e:
+            logger.error(f"寫入檔案失敗：{path}，錯誤：{str(e)}")
+            raise
+
+    @staticmethod
+    def persist_in_background(data, path):
+        """
+        在背景將資料寫入磁碟，不阻塞目前的請求
+
+        Returns:
+            asyncio.Task: 寫入工作
+        """
+        task = asyncio.create_task(asyncio.to_thread(ImageService._write_file, data, path))
+        ImageService._background_tasks.add(task)
+        task.add_done_callback(ImageService._background_tasks.discard)
+        return task
+
+    @staticmethod
+    async def ensure_persisted(processed):
+        """確保合成結果已寫入磁碟（例如需要以本地 URL 提供圖片時）"""
+        if processed.persist_task is not None:
+            try:
+                await processed.persist_task
+                return
+            except Exception:
+                logger.warning(f"背景寫入失敗，重新寫入：{processed.path}")
+        await asyncio.to_thread(processed.save)
+
+    @staticmethod
+    def _prepare_file_for_upload(image_path):
+        """
+        調整圖片檔案以符合 LINE 平台的要求（尺寸與大小），並判斷照片方向
+
+        Returns:
+            bool: 是否為直式照片
+        """
+        # 記錄文件大小
+        file_size = os.path.getsize(image_path)
+        logger.info(f"準備上傳到 Cloudinary 的文件大小：{file_size} bytes")
+        
+        # 檢查是否為直式照片 - 通過實際檢查圖片尺寸而不僅僅依賴文件名
+        is_portrait = False
+        try:
+            with Image.open(image_path) as img:
+                width, height = img.size
+                is_portrait = height > width
+                logger.info(f"照片方向檢查: 尺寸={width}x{height}, 是否為直式={is_portrait}")
+        except Exception as e:
+            logger.error(f"檢查圖片方向時發生錯誤: {str(e)}")
+            # 如果無法檢查尺寸，則回退到使用文件名判斷
+            is_portrait = "portrait" in os.path.basename(image_path)
+            logger.info(f"使用文件名判斷照片方向: {'直式' if is_portrait else '橫式'}")
+        
+        # 處理圖片，確保符合 LINE 平台的要求
+        try:
+            with Image.open(image_path) as img:
+                # 檢查圖片尺寸
+                width, height = img.size
+                logger.info(f"原始圖片尺寸: {width}x{height}")
+                
+                # 調整圖片大小
+                max_width = 1024  # LINE 平台的最大寬度限制
+                max_height = 1024  # 設置一個合理的最大高度
+                
+                # 計算新尺寸，保持原始比例
                 if is_portrait:
-                    transformation = [
-                        {"width": 1024, "crop": "scale"},  # 確保寬度不超過 1024 像素
-                        {"quality": "auto:good"},          # 使用較高質量
-                        {"fetch_format": "auto"}           # 自動選擇最佳格式
-                    ]
+                    # 直式照片 - 確保寬度不超過限制
+                    if width > max_width:
+                        ratio = max_width / width
+                        new_width = max_width
+                        new_height = int(height * ratio)
+                        # 確保高度也不超過限制
+                        if new_height > max_height:
+                            ratio = max_height / new_height
+                            new_height = max_height
+                            new_width = int(new_width * ratio)
+                        # 以不小於目標尺寸的比例縮小解碼
+                        img = ImageService.reduce_for_target(img, (new_width, new_height))
+                        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                        logger.info(f"調整後的直式照片尺寸: {new_width}x{new_height}")
                 else:
-                    transformation = [
-                        {"quality": "auto:good"},  # 使用較高質量
-                        {"fetch_format": "auto"}   # 自動選擇最佳格式
-                    ]
+                    # 橫式照片 - 確保高度不超過限制
+                    if height > max_height:
+                        ratio = max_height / height
+                        new_height = max_height
+                        new_width = int(width * ratio)
+                        # 確保寬度也不超過限制
+                        if new_width > max_width:
+                            ratio = max_width / new_width
+                            new_width = max_width
+                            new_height = int(new_height * ratio)
+                        # 以不小於目標尺寸的比例縮小解碼
+                        img = ImageService.reduce_for_target(img, (new_width, new_height))
+                        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                        logger.info(f"調整後的橫式照片尺寸: {new_width}x{new_height}")
                 
-                # 添加更多的錯誤處理和重試邏輯
-                max_retries = 3
-                retry_count = 0
-                last_error = None
+                # 確保圖片是 RGB 模式（移除透明度）
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                    logger.info("圖片已轉換為 RGB 模式")
                 
-                while retry_count < max_retries:
-                    try:
-                        upload_result = cloudinary.uploader.upload(
-                            image_path,
-                            folder="line-bot-frames",
-                            transformation=transformation,
-                            timeout=30  # 設置超時時間
-                        )
-                        cloudinary_url = upload_result.get('secure_url')
-                        logger.info(f"Cloudinary 上傳成功：{cloudinary_url}")
-                        return cloudinary_url
-                    except Exception as e:
-                        last_error = e
-                        retry_count += 1
-                        logger.warning(f"Cloudinary 上傳失敗 (嘗試 {retry_count}/{max_retries}): {str(e)}")
-                        if retry_count < max_retries:
-                            # 等待一段時間後重試
-                            await asyncio.sleep(1)
+                # 保存為 JPEG 格式，使用適當的質量
+                # 在記憶體中搜尋符合大小上限的最高品質，最後只寫入一次檔案
+                quality = settings.JPEG_QUALITY_PORTRAIT if is_portrait else settings.JPEG_QUALITY_LANDSCAPE  # 直式照片使用稍低的質量以減小文件大小
+                encoded = JpegEncoder.encode(img, quality=quality)
+                encoded.save(image_path)
+                logger.info(f"照片已調整，新大小：{encoded.size} bytes，品質={encoded.quality}，嘗試次數={encoded.attempts}")
+        except Exception as e:
+            logger.error(f"調整照片失敗：{str(e)}")
+            logger.error(traceback.format_exc())
+        
+        return is_portrait
+
+    @staticmethod
+    async def store_image(image, transformation=None):
+        """
+        以設定的儲存後端（settings.STORAGE_BACKEND）保存圖片並取得 URL
+        
+        Args:
+            image (ProcessedImage | str): 記憶體中的合成結果（直接保存，不再重新處理），或圖片檔案路徑
+            transformation (list, optional): Cloudinary 轉換選項，預設依照片方向決定（預覽圖請傳入 []）
+            
+        Returns:
+            str: 圖片 URL，主要後端失敗時回傳本地簽署 URL，發生錯誤時回傳 None
+        """
+        try:
+            if isinstance(image, ProcessedImage):
+                # 合成結果已符合尺寸與大小限制，直接保存記憶體中的資料
+                is_portrait = image.is_portrait
+                local_filename = image.filename
+                data = image.data
+                logger.info(f"準備保存的圖片大小：{image.size} bytes，尺寸：{image.width}x{image.height}")
+            else:
+                image_path = image
+                local_filename = os.path.basename(image_path)
                 
-                # 如果所有重試都失敗
-                logger.error(f"所有 Cloudinary 上傳嘗試都失敗: {str(last_error)}")
-                # 嘗試使用本地 URL
-                base_url = settings.get_base_url()
-                local_url = f"{base_url}/tmp/uploads/{os.path.basename(image_path)}"
-                logger.info(f"使用本地 URL 替代：{local_url}")
-                return local_url
-            except Exception as e:
-                logger.error(f"Cloudinary 上傳失敗：{str(e)}")
-                # 嘗試使用本地 URL
-                base_url = settings.get_base_url()
-                local_url = f"{base_url}/tmp/uploads/{os.path.basename(image_path)}"
-                logger.info(f"使用本地 URL 替代：{local_url}")
-                return local_url
+                # 檢查文件是否存在
+                if not os.path.exists(image_path):
+                    logger.error(f"找不到要上傳的文件：{image_path}")
+                    return None
+                
+                is_portrait = await asyncio.to_thread(ImageService._prepare_file_for_upload, image_path)
+                data = await asyncio.to_thread(ImageService._read_file, image_path)
+            
+            logger.info(f"開始保存圖片：{local_filename}（{settings.STORAGE_BACKEND}）")
+            return await Storage.store(data, local_filename, is_portrait=is_portrait, transformation=transformation)
         except Exception as e:
-            logger.error(f"上傳到 Cloudinary 過程中發生錯誤：{str(e)}")
-            import traceback
+            logger.error(f"保存圖片過程中發生錯誤：{str(e)}")
             logger.error(traceback.format_exc())
             return None
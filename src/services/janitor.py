@@ -0,0 +1,224 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+from src.config import settings
+from src.services.storage_backend import LocalStorage
+
+logger = logging.getLogger(__name__)
+
+
+class JanitorPolicy:
+    """單一目錄的清理規則：保留時間（秒）與總大小上限（bytes），0 表示不限制"""
+
+    __slots__ = ('folder', 'max_age', 'max_bytes')
+
+    def __init__(self, folder, max_age, max_bytes):
+        self.folder = folder
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+
+class Janitor:
+    """
+    定期清理暫存目錄（tmp/uploads、static/pdf、本地儲存後端的物件目錄）
+
+    每個目錄依 JanitorPolicy 清理：
+        - 超過保留時間（最後使用時間，取 atime 與 mtime 較新者）的檔案
+        - 總大小超過上限時，從最久未使用的檔案開始刪除
+    仍被使用者狀態參照的檔案（pinned）與建立不到 settings.JANITOR_MIN_AGE 秒的檔案不會被刪除。
+
+    掃描與刪除都在線程池中以每批 settings.JANITOR_BATCH_SIZE 個檔案分次進行，
+    批次之間讓出事件迴圈，大目錄也不會阻塞請求。只處理目錄中的檔案，不進入子目錄。
+    """
+
+    _task = None
+    _stats = {'runs': 0, 'files_removed': 0, 'bytes_removed': 0, 'last_run_ms': None, 'folders': {}}
+
+    @staticmethod
+    def policies():
+        """目前設定的清理規則"""
+        return [
+            JanitorPolicy(settings.UPLOAD_FOLDER, settings.UPLOAD_RETENTION_SECONDS, settings.UPLOAD_MAX_BYTES),
+            JanitorPolicy(settings.PDF_FOLDER, settings.PDF_RETENTION_SECONDS, settings.PDF_MAX_BYTES),
+            # 本地儲存的物件在 URL 到期前都可能被取用
+            JanitorPolicy(
+                settings.STORAGE_OBJECT_FOLDER,
+                settings.STORAGE_URL_TTL + LocalStorage.EXPIRY_GRANULARITY,
+                settings.STORAGE_OBJECT_MAX_BYTES
+            )
+        ]
+
+    @staticmethod
+    def _scan_batch(iterator, batch_size):
+        """
+        從 os.scandir 的迭代器讀取下一批（最多 batch_size 個）項目
+
+        Returns:
+            tuple: ([(路徑, 大小, 最後使用時間, 修改時間), ...], 是否已讀完)
+        """
+        entries = []
+        count = 0
+        for entry in itertools.islice(iterator, batch_size):
+            count += 1
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue  # 掃描期間被刪除
+            entries.append((entry.path, stat.st_size, max(stat.st_atime, stat.st_mtime), stat.st_mtime))
+        return entries, count < batch_size
+
+    @staticmethod
+    async def _scan(folder, batch_size):
+        """分批掃描目錄，每批之間讓出事件迴圈"""
+        try:
+            iterator = await asyncio.to_thread(os.scandir, folder)
+        except FileNotFoundError:
+            return []
+        entries = []
+        try:
+            done = False
+            while not done:
+                batch, done = await asyncio.to_thread(Janitor._scan_batch, iterator, batch_size)
+                entries.extend(batch)
+        finally:
+            iterator.close()
+        return entries
+
+    @staticmethod
+    def _remove_batch(paths):
+        """刪除一批檔案，回傳實際刪除的 [(路徑, 大小), ...]"""
+        removed = []
+        for path, size in paths:
+            try:
+                os.remove(path)
+                removed.append((path, size))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"刪除暫存檔案失敗：{path}，錯誤：{str(e)}")
+        return removed
+
+    @staticmethod
+    def select(entries, policy, pinned, now):
+        """
+        決定要刪除的檔案（不實際刪除）
+
+        Args:
+            entries (list): _scan 的結果
+            policy (JanitorPolicy): 清理規則
+            pinned (set): 不可刪除的檔案路徑（絕對路徑）
+            now (float): 目前時間
+
+        Returns:
+            tuple: (要刪除的 [(路徑, 大小), ...], 刪除後剩下的總大小)
+        """
+        total = sum(size for _, size, _, _ in entries)
+        evictable = [
+            entry for entry in entries
+            if os.path.abspath(entry[0]) not in pinned and now - entry[3] >= settings.JANITOR_MIN_AGE
+        ]
+        # 最久未使用的排在前面
+        evictable.sort(key=lambda entry: entry[2])
+
+        victims = []
+        for path, size, last_used, _ in evictable:
+            expired = policy.max_age and now - last_used > policy.max_age
+            over_quota = policy.max_bytes and total > policy.max_bytes
+            if not expired and not over_quota:
+                # 依最後使用時間排序，之後的檔案都較新，且總大小已在上限內
+                break
+            victims.append((path, size))
+            total -= size
+        return victims, total
+
+    @staticmethod
+    async def sweep(pinned=frozenset()):
+        """
+        依清理規則清理一次所有目錄
+
+        Args:
+            pinned (set): 不可刪除的檔案路徑
+
+        Returns:
+            dict: 各目錄刪除的檔案數與位元組數
+        """
+        start = time.perf_counter()
+        pinned = {os.path.abspath(path) for path in pinned}
+        batch_size = settings.JANITOR_BATCH_SIZE
+        stats = Janitor._stats
+        result = {}
+
+        for policy in Janitor.policies():
+            entries = await Janitor._scan(policy.folder, batch_size)
+            victims, remaining = Janitor.select(entries, policy, pinned, time.time())
+
+            removed_files = removed_bytes = 0
+            for index in range(0, len(victims), batch_size):
+                removed = await asyncio.to_thread(Janitor._remove_batch, victims[index:index + batch_size])
+                removed_files += len(removed)
+                removed_bytes += sum(size for _, size in removed)
+
+            stats['files_removed'] += removed_files
+            stats['bytes_removed'] += removed_bytes
+            stats['folders'][policy.folder] = {
+                'files': len(entries) - removed_files,
+                'bytes': remaining,
+                'max_bytes': policy.max_bytes,
+                'max_age': policy.max_age
+            }
+            result[policy.folder] = {'files_removed': removed_files, 'bytes_removed': removed_bytes}
+            if removed_files:
+                logger.info(f"已清理暫存檔案：{policy.folder}，刪除 {removed_files} 個檔案，共 {removed_bytes} bytes")
+
+        stats['runs'] += 1
+        stats['last_run_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    @staticmethod
+    async def run_forever(pinned_provider=None):
+        """
+        每隔 settings.JANITOR_INTERVAL 秒清理一次
+
+        Args:
+            pinned_provider (callable, optional): 回傳不可刪除的檔案路徑集合
+        """
+        while True:
+            try:
+                pinned = pinned_provider() if pinned_provider else frozenset()
+                await Janitor.sweep(pinned)
+            except Exception as e:
+                logger.error(f"清理暫存檔案失敗：{str(e)}")
+            await asyncio.sleep(settings.JANITOR_INTERVAL)
+
+    @staticmethod
+    def start(pinned_provider=None):
+        """在目前的事件迴圈啟動定期清理（settings.JANITOR_INTERVAL 為 0 時不啟動）"""
+        if settings.JANITOR_INTERVAL <= 0 or Janitor._task is not None:
+            return None
+        Janitor._task = asyncio.create_task(Janitor.run_forever(pinned_provider))
+        return Janitor._task
+
+    @staticmethod
+    async def stop():
+        """停止定期清理"""
+        task, Janitor._task = Janitor._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    def stats():
+        """
+        回報清理統計資料
+
+        Returns:
+            dict: 執行次數、刪除的檔案數與位元組數、上次執行耗時與各目錄目前的檔案數與大小
+        """
+        return dict(Janitor._stats, folders=dict(Janitor._stats['folders']))
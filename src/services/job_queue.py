@@ -0,0 +1,227 @@
+import time
+import asyncio
+import logging
+import traceback
+from collections import deque
+from src.config import settings
+from src.utils.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """佇列已滿，無法再加入工作"""
+
+
+class Job:
+    """佇列中的一個工作：以 func(*args) 執行的協程，key 相同的工作依序執行"""
+
+    __slots__ = ('label', 'func', 'args', 'key', 'enqueued_at', 'started_at')
+
+    def __init__(self, label, func, args, key=None):
+        self.label = label
+        self.func = func
+        self.args = args
+        self.key = key
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+
+
+class JobQueue:
+    """
+    行程內的工作佇列
+
+    webhook 驗證簽章後只將事件放入佇列並立即回覆，由固定數量（settings.JOB_WORKERS）的
+    非同步 worker 依序取出執行 MessageHandler 的處理（下載、合成、上傳、回覆）。
+
+    不同用戶的事件同時執行（同時執行的數量即 worker 數），同一用戶（相同 key）的事件則經由
+    各自的序列（lane）依加入順序逐一執行：前一個工作完成後，下一個才放到佇列尾端。
+
+    等待中的工作（含 lane 中的）上限為 settings.JOB_QUEUE_MAX_SIZE，已滿時 submit 拋出 JobQueueFull；
+    submit_many 一次加入多個工作（同一個 webhook 的事件），空間不足時整批拒絕，不會只加入一部分：
+    lane 中的工作也佔用空間，檢查通過後才建立 lane，被拒絕的批次不會留下 lane 或已排隊的工作。
+    統計等待時間（放入佇列到開始執行）與執行時間，執行時間也以 job 階段記錄到 Tracer（附帶 wait_ms）。
+    """
+
+    _queue = None
+    _workers = []
+    _loop = None  # 佇列與 worker 所屬的事件迴圈
+    _lanes = {}   # key -> 同一用戶等待前一個工作完成的工作（有 key 表示該用戶有工作在佇列中或執行中）
+    _pending = 0  # 尚未開始執行的工作數（含 lane 中的）
+    _stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'running': 0, 'serialized': 0}
+    _wait_times = deque(maxlen=1000)  # 最近工作的等待時間（秒）
+    _run_times = deque(maxlen=1000)   # 最近工作的執行時間（秒）
+
+    @staticmethod
+    def start():
+        """在目前的事件迴圈建立佇列並啟動 worker（已啟動時不重複建立）"""
+        loop = asyncio.get_running_loop()
+        if JobQueue._loop is loop:
+            return
+        # 長度上限由 _pending 控制（lane 中的工作之後才放入佇列，不能因佇列已滿而失敗）
+        JobQueue._queue = asyncio.Queue()
+        JobQueue._lanes = {}
+        JobQueue._pending = 0
+        JobQueue._workers = [
+            asyncio.create_task(JobQueue._worker(), name=f"job-worker-{index}") for index in range(settings.JOB_WORKERS)
+        ]
+        JobQueue._loop = loop
+        logger.info(f"工作佇列已啟動：{settings.JOB_WORKERS} 個 worker，佇列上限 {settings.JOB_QUEUE_MAX_SIZE}")
+
+    @staticmethod
+    async def stop(timeout=None):
+        """
+        等待佇列中的工作完成後停止 worker
+
+        Args:
+            timeout (float, optional): 最多等待秒數，預設為 settings.JOB_SHUTDOWN_TIMEOUT，逾時則取消剩下的工作
+        """
+        if JobQueue._loop is not asyncio.get_running_loop():
+            return
+        timeout = settings.JOB_SHUTDOWN_TIMEOUT if timeout is None else timeout
+        try:
+            await asyncio.wait_for(JobQueue._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"關閉時仍有 {JobQueue._pending + JobQueue._stats['running']} 個工作未完成，已取消")
+        for worker in JobQueue._workers:
+            worker.cancel()
+        await asyncio.gather(*JobQueue._workers, return_exceptions=True)
+        JobQueue._queue = None
+        JobQueue._workers = []
+        JobQueue._lanes = {}
+        JobQueue._pending = 0
+        JobQueue._loop = None
+
+    @staticmethod
+    def submit(label, func, *args, key=None):
+        """
+        加入工作（不等待執行）
+
+        Args:
+            label (str): 工作名稱（記錄用）
+            func (callable): 回傳協程的函式
+            *args: func 的參數
+            key (str, optional): 序列的鍵（例如用戶 ID），相同 key 的工作依加入順序逐一執行
+
+        Raises:
+            JobQueueFull: 佇列已滿
+        """
+        JobQueue.submit_many([Job(label, func, args, key)])
+
+    @staticmethod
+    def submit_many(jobs):
+        """
+        一次加入多個工作：全部加入或全部不加入
+
+        webhook 回覆 503 時 LINE 會重送整批事件，若先加入一部分才拒絕，這些事件會被處理兩次。
+
+        Args:
+            jobs (list): 要加入的 Job（依加入順序，同一個 key 的工作依此順序執行）
+
+        Raises:
+            JobQueueFull: 佇列剩餘的空間不足以放入全部的工作（不會加入任何工作）
+        """
+        JobQueue.start()
+        stats = JobQueue._stats
+        if JobQueue._pending + len(jobs) > settings.JOB_QUEUE_MAX_SIZE:
+            stats['rejected'] += len(jobs)
+            labels = ', '.join(job.label for job in jobs)
+            raise JobQueueFull(
+                f"工作佇列已滿（{JobQueue._pending}/{settings.JOB_QUEUE_MAX_SIZE}），無法加入 {len(jobs)} 個工作：{labels}"
+            )
+        for job in jobs:
+            JobQueue._enqueue(job)
+
+    @staticmethod
+    def _enqueue(job):
+        """將已通過長度檢查的工作放入佇列，或放入同一用戶的 lane"""
+        stats = JobQueue._stats
+        JobQueue._pending += 1
+        stats['submitted'] += 1
+        if job.key is not None:
+            lane = JobQueue._lanes.get(job.key)
+            if lane is not None:
+                # 同一用戶已有工作在佇列中或執行中，等它完成後再放入佇列
+                lane.append(job)
+                stats['serialized'] += 1
+                return
+            JobQueue._lanes[job.key] = deque()
+        JobQueue._queue.put_nowait(job)
+
+    @staticmethod
+    def _release_lane(job):
+        """工作完成後將同一用戶的下一個工作放到佇列尾端（其他用戶不需要等待同一用戶的工作全部完成）"""
+        if job.key is None:
+            return
+        lane = JobQueue._lanes.get(job.key)
+        if lane:
+            JobQueue._queue.put_nowait(lane.popleft())
+        else:
+            JobQueue._lanes.pop(job.key, None)
+
+    @staticmethod
+    async def _worker():
+        queue = JobQueue._queue
+        while True:
+            job = await queue.get()
+            JobQueue._pending -= 1
+            try:
+                await JobQueue._run(job)
+            finally:
+                JobQueue._release_lane(job)
+                queue.task_done()
+
+    @staticmethod
+    async def _run(job):
+        """執行單一工作並記錄等待與執行時間（工作的例外只記錄，不影響 worker）"""
+        stats = JobQueue._stats
+        job.started_at = time.perf_counter()
+        wait = job.started_at - job.enqueued_at
+        JobQueue._wait_times.append(wait)
+
+        stats['running'] += 1
+        try:
+            with Tracer.span('job', job=job.label, wait_ms=round(wait * 1000, 1)):
+                await job.func(*job.args)
+            stats['completed'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"工作執行失敗：{job.label}，錯誤：{str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            stats['running'] -= 1
+            JobQueue._run_times.append(time.perf_counter() - job.started_at)
+
+    @staticmethod
+    def _summary(samples):
+        """最近樣本的平均、中位數、p95 與最大值（毫秒）"""
+        if not samples:
+            return {'count': 0}
+        ordered = sorted(samples)
+        count = len(ordered)
+        return {
+            'count': count,
+            'mean_ms': round(sum(ordered) / count * 1000, 1),
+            'p50_ms': round(ordered[count // 2] * 1000, 1),
+            'p95_ms': round(ordered[min(count - 1, int(count * 0.95))] * 1000, 1),
+            'max_ms': round(ordered[-1] * 1000, 1)
+        }
+
+    @staticmethod
+    def stats():
+        """
+        回報佇列統計資料
+
+        Returns:
+            dict: 佇列長度（含 lane 中的工作）、有工作的用戶數、worker 數、各狀態的工作數
+                  （serialized 為需要等待同一用戶前一個工作的次數），以及最近工作的等待與執行時間分佈
+        """
+        return dict(
+            JobQueue._stats,
+            depth=JobQueue._pending,
+            lanes=len(JobQueue._lanes),
+            max_depth=settings.JOB_QUEUE_MAX_SIZE,
+            workers=len(JobQueue._workers),
+            wait=JobQueue._summary(list(JobQueue._wait_times)),
+            run=JobQueue._summary(list(JobQueue._run_times))
+        )
@@ -0,0 +1,121 @@
+import math
+import logging
+from io import BytesIO
+from src.config import settings
+from src.utils.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+# JPEG 編碼設定檔
+JPEG_PROFILES = {
+    # 預設：最佳化 Huffman 表
+    'default': {'optimize': True},
+    # 漸進式：檔案通常更小，且在慢速網路上可以逐步顯示
+    'progressive': {'optimize': True, 'progressive': True},
+    # 快速：不做最佳化，編碼最快
+    'fast': {'optimize': False},
+    # 精簡：漸進式加上 4:2:0 色度抽樣，檔案最小
+    'compact': {'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+}
+
+
+class EncodedJpeg:
+    """JPEG 編碼結果"""
+
+    __slots__ = ('data', 'quality', 'attempts', 'profile')
+
+    def __init__(self, data, quality, attempts, profile):
+        self.data = data
+        self.quality = quality
+        self.attempts = attempts
+        self.profile = profile
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def save(self, path):
+        """將編碼結果一次寫入檔案"""
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+class JpegEncoder:
+    """
+    以檔案大小為目標的 JPEG 編碼器
+
+    所有嘗試都在記憶體中完成：先以指定品質編碼，若超過大小上限，
+    則從預測的品質開始以二分搜尋找出不超過上限的最高品質。
+    """
+
+    @staticmethod
+    def _encode(image, quality, options):
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, **options)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _predict_quality(quality, size, max_bytes, low, high):
+        """依目前大小與目標大小的比例預測起始品質（大小每減半約需降低 20 個品質）"""
+        predicted = quality - round(20 * math.log2(size / max_bytes))
+        return max(low, min(high, predicted))
+
+    @staticmethod
+    def encode(image, max_bytes=None, quality=90, min_quality=65, profile=None):
+        """
+        將圖片編碼為 JPEG，並盡量以最高品質符合大小上限
+
+        Args:
+            image (PIL.Image): 要編碼的圖片（RGB 或 L 模式）
+            max_bytes (int, optional): 大小上限，預設為 settings.JPEG_MAX_BYTES，0 表示不限制
+            quality (int): 起始品質
+            min_quality (int): 最低品質，若仍超過上限則使用此品質
+            profile (str, optional): 編碼設定檔名稱，預設為 settings.JPEG_PROFILE
+
+        Returns:
+            EncodedJpeg: 編碼結果（含資料、品質與嘗試次數）
+        """
+        max_bytes = settings.JPEG_MAX_BYTES if max_bytes is None else max_bytes
+        profile = profile or settings.JPEG_PROFILE
+        options = JPEG_PROFILES.get(profile)
+        if options is None:
+            logger.warning(f"未知的 JPEG 設定檔：{profile}，改用 default")
+            profile = 'default'
+            options = JPEG_PROFILES[profile]
+
+        with Tracer.span('encode', width=image.width, height=image.height, quality=quality, profile=profile) as span:
+            data = JpegEncoder._encode(image, quality, options)
+            span.set(bytes=len(data))
+        attempts = 1
+        logger.info(f"JPEG 編碼：品質={quality}，大小={len(data)} bytes")
+
+        if not max_bytes or len(data) <= max_bytes or quality <= min_quality:
+            return EncodedJpeg(data, quality, attempts, profile)
+
+        # 在 [min_quality, quality - 1] 之間搜尋不超過上限的最高品質
+        with Tracer.span('compression_loop', width=image.width, height=image.height, max_bytes=max_bytes) as span:
+            low, high = min_quality, quality - 1
+            best = None
+            lowest = None
+            probe = JpegEncoder._predict_quality(quality, len(data), max_bytes, low, high)
+            while low <= high:
+                candidate = JpegEncoder._encode(image, probe, options)
+                attempts += 1
+                logger.info(f"進一步壓縮照片，質量={probe}，新大小={len(candidate)} bytes")
+                if len(candidate) <= max_bytes:
+                    best = (probe, candidate)
+                    low = probe + 1
+                else:
+                    lowest = (probe, candidate)
+                    high = probe - 1
+                probe = (low + high) // 2
+
+            if best is None:
+                # 全部超過上限時，搜尋最後一定會嘗試最低品質，沿用該結果
+                best = lowest
+                logger.warning(f"最低品質 {min_quality} 仍超過大小上限 {max_bytes} bytes")
+
+            best_quality, best_data = best
+            span.set(quality=best_quality, bytes=len(best_data), attempts=attempts)
+        logger.info(f"JPEG 編碼完成：品質={best_quality}，大小={len(best_data)} bytes，嘗試次數={attempts}")
+        return EncodedJpeg(best_data, best_quality, attempts, profile)
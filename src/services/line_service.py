@@ -1,5 +1,10 @@
+import os
+import asyncio
+import hashlib
 import logging
 import aiohttp
+from io import BytesIO
+from PIL import Image
 from linebot.v3 import WebhookParser
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 from linebot.v3.messaging import TextMessage, ImageMessage, ReplyMessageRequest, PushMessageRequest
@@ -9,6 +14,34 @@ import traceback
 
 logger = logging.getLogger(__name__)
 
+
+class ContentRejected(Exception):
+    """下載的內容不符合要求（格式不支援、檔案或尺寸過大），訊息可直接回覆給用戶"""
+
+
+class MessageContent:
+    """
+    串流下載的訊息內容
+
+    小檔案保留在記憶體中（data），大檔案在下載時直接寫入檔案（path，data 為 None）。
+    """
+
+    __slots__ = ('data', 'path', 'size', 'format', 'width', 'height', 'sha256')
+
+    def __init__(self, data, path, size, image_format, width, height, sha256):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.sha256 = sha256
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+
 class LineService:
     def __init__(self):
         self.configuration = Configuration(access_token=settings.LINE_CHANNEL_ACCESS_TOKEN)
@@ -36,8 +69,8 @@ class LineService:
             logger.error(traceback.format_exc())
             raise
 
-    async def reply_image(self, reply_token, image_url):
-        """發送圖片訊息"""
+    async def reply_image(self, reply_token, image_url, preview_url=None):
+        """發送圖片訊息（preview_url 未提供時使用原圖作為預覽）"""
         try:
             logger.info(f"準備發送圖片訊息，圖片 URL：{image_url}")
             
@@ -51,7 +84,7 @@ class LineService:
             logger.info(f"圖片 URL 前20個字符: {image_url[:20]}...")
             logger.info(f"圖片 URL 後20個字符: ...{image_url[-20:]}")
                 
-            message = ImageMessage(original_content_url=image_url, preview_image_url=image_url)
+            message = ImageMessage(original_content_url=image_url, preview_image_url=preview_url or image_url)
             request = ReplyMessageRequest(
                 reply_token=reply_token,
                 messages=[message]
@@ -106,23 +139,139 @@ class LineService:
             raise
 
     async def get_message_content(self, message_id):
-        """獲取訊息內容"""
+        """獲取訊息內容（完整讀入記憶體，受 settings.CONTENT_MAX_BYTES 限制）"""
+        content = await self.download_message_content(message_id)
+        return content.data
+
+    @staticmethod
+    def _format_mb(size):
+        return f"{size / (1024 * 1024):.1f}".rstrip('0').rstrip('.') + 'MB'
+
+    @staticmethod
+    def _sniff(head):
+        """
+        從檔案開頭判斷圖片格式與尺寸
+
+        Returns:
+            tuple: (格式, 寬, 高)，資料不足以判斷時回傳 None
+        """
+        try:
+            with Image.open(BytesIO(head)) as image:
+                return image.format, image.size[0], image.size[1]
+        except Exception:
+            return None
+
+    @staticmethod
+    def _check_image(image_format, width, height):
+        """檢查格式與尺寸，不符合時拋出 ContentRejected"""
+        if image_format not in settings.CONTENT_ALLOWED_FORMATS:
+            raise ContentRejected(f"不支援的圖片格式（{image_format}），請上傳 JPEG 或 PNG 照片。")
+        if width * height > settings.CONTENT_MAX_PIXELS:
+            raise ContentRejected(f"圖片尺寸過大（{width}x{height}），請上傳較小的照片。")
+
+    @staticmethod
+    def _write_chunks(path, chunks, append=True):
+        with open(path, 'ab' if append else 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    async def download_message_content(self, message_id, spill_path=None, preview=False):
+        """
+        串流下載訊息內容
+        
+        一邊下載一邊計算 SHA-256，並在讀到檔頭時立即檢查格式與尺寸，不符合時提早中止。
+        超過 settings.CONTENT_SPILL_BYTES 且有提供 spill_path 時，內容直接寫入檔案而不保留在記憶體中。
+        
+        Args:
+            message_id (str): 訊息 ID
+            spill_path (str, optional): 大檔案的寫入路徑
+            preview (bool): 下載 LINE 產生的預覽圖（較小的 JPEG）而不是原圖
+            
+        Returns:
+            MessageContent: 下載的內容
+            
+        Raises:
+            ContentRejected: 格式不支援、檔案或尺寸超過上限
+        """
+        spilled = False
         try:
             session = await self.get_session()
             headers = {
                 'Authorization': f'Bearer {settings.LINE_CHANNEL_ACCESS_TOKEN}'
             }
+            url = f'https://api-data.line.me/v2/bot/message/{message_id}/content'
+            if preview:
+                url += '/preview'
             async with session.get(
-                f'https://api-data.line.me/v2/bot/message/{message_id}/content',
+                url,
                 headers=headers
             ) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     raise Exception(f"LINE API 回應狀態碼: {response.status}, 錯誤: {error_text}")
-                return await response.read()
+                
+                max_bytes = settings.CONTENT_MAX_BYTES
+                if response.content_length and response.content_length > max_bytes:
+                    raise ContentRejected(f"圖片檔案過大（{response.content_length} bytes），請上傳 {LineService._format_mb(max_bytes)} 以下的照片。")
+                
+                digest = hashlib.sha256()
+                chunks = []  # 尚未寫入檔案的區塊
+                buffered = 0
+                size = 0
+                sniffed = None
+                head = b''
+                
+                async for chunk in response.content.iter_chunked(settings.CONTENT_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ContentRejected(f"圖片檔案過大，請上傳 {LineService._format_mb(max_bytes)} 以下的照片。")
+                    digest.update(chunk)
+                    chunks.append(chunk)
+                    buffered += len(chunk)
+                    
+                    # 讀到檔頭後立即檢查格式與尺寸
+                    if sniffed is None:
+                        head += chunk
+                        sniffed = LineService._sniff(head)
+                        if sniffed is not None:
+                            LineService._check_image(*sniffed)
+                            logger.info(f"圖片格式: {sniffed[0]}, 尺寸: {sniffed[1]}x{sniffed[2]}")
+                            head = b''
+                        elif len(head) >= settings.CONTENT_SNIFF_BYTES:
+                            raise ContentRejected("無法辨識的圖片格式，請上傳 JPEG 或 PNG 照片。")
+                    
+                    # 超過門檻時改為寫入檔案，記憶體中只保留尚未寫入的區塊
+                    if spill_path and (spilled or size > settings.CONTENT_SPILL_BYTES) and buffered >= settings.CONTENT_CHUNK_SIZE * 16:
+                        append = spilled
+                        if not spilled:
+                            spilled = True
+                            logger.info(f"圖片超過 {settings.CONTENT_SPILL_BYTES} bytes，直接寫入檔案: {spill_path}")
+                        await asyncio.to_thread(LineService._write_chunks, spill_path, chunks, append)
+                        chunks = []
+                        buffered = 0
+                
+                if sniffed is None:
+                    sniffed = LineService._sniff(head)
+                    if sniffed is None:
+                        raise ContentRejected("無法辨識的圖片格式，請上傳 JPEG 或 PNG 照片。")
+                    LineService._check_image(*sniffed)
+                
+                if spilled:
+                    await asyncio.to_thread(LineService._write_chunks, spill_path, chunks)
+                    data = None
+                else:
+                    data = b''.join(chunks)
+                
+                logger.info(f"訊息{'預覽圖' if preview else '內容'}下載完成: {message_id}, 大小: {size} bytes")
+                return MessageContent(data, spill_path if spilled else None, size, *sniffed, digest.hexdigest())
         except Exception as e:
-            logger.error(f"獲取訊息內容失敗：{str(e)}")
-            logger.error(traceback.format_exc())
+            if spilled and os.path.exists(spill_path):
+                os.remove(spill_path)
+            if isinstance(e, ContentRejected):
+                logger.warning(f"拒絕訊息內容：{message_id}，原因：{str(e)}")
+            else:
+                logger.error(f"獲取訊息內容失敗：{str(e)}")
+                logger.error(traceback.format_exc())
             raise
             
     async def push_message(self, user_id, message):
@@ -149,8 +298,8 @@ class LineService:
             logger.error(traceback.format_exc())
             raise
             
-    async def push_image(self, user_id, image_url):
-        """專門用於發送圖片的推播訊息"""
+    async def push_image(self, user_id, image_url, preview_url=None):
+        """專門用於發送圖片的推播訊息（preview_url 未提供時使用原圖作為預覽）"""
         try:
             logger.info(f"準備發送圖片推播訊息，用戶 ID：{user_id}，圖片 URL：{image_url}")
             
@@ -167,7 +316,7 @@ class LineService:
             # 創建圖片訊息
             image_message = ImageMessage(
                 original_content_url=image_url,
-                preview_image_url=image_url
+                preview_image_url=preview_url or image_url
             )
             
             # 使用 push_message 方法發送
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget:
+    """
+    圖片解碼的記憶體預算（整個行程共用）
+
+    解碼前依檔頭估計需要的記憶體並預留，預留總量超過 settings.MEMORY_BUDGET_BYTES 時，
+    之後的請求依先後順序排隊等待，避免同時解碼多張大圖造成記憶體不足。
+    單一請求超過整個預算時，只在沒有其他預留時放行（一次只處理一張）。
+    settings.MEMORY_BUDGET_BYTES 為 0 時不限制。
+    """
+
+    _lock = threading.Lock()
+    _reserved = 0
+    _reservations = {}  # 預留編號 -> (名稱, bytes)
+    _waiters = deque()  # [(名稱, bytes, future), ...]，依先後順序
+    _next_id = 0
+    _stats = {'admitted': 0, 'queued': 0, 'wait_seconds': 0.0, 'peak_reserved': 0}
+
+    @staticmethod
+    def _fits(nbytes):
+        """預留 nbytes 後是否仍在預算內（呼叫端需持有鎖）"""
+        budget = settings.MEMORY_BUDGET_BYTES
+        return not budget or MemoryBudget._reserved == 0 or MemoryBudget._reserved + nbytes <= budget
+
+    @staticmethod
+    def _admit(label, nbytes):
+        """記錄預留並回傳預留編號（呼叫端需持有鎖）"""
+        MemoryBudget._next_id += 1
+        MemoryBudget._reservations[MemoryBudget._next_id] = (label, nbytes)
+        MemoryBudget._reserved += nbytes
+        MemoryBudget._stats['admitted'] += 1
+        MemoryBudget._stats['peak_reserved'] = max(MemoryBudget._stats['peak_reserved'], MemoryBudget._reserved)
+        return MemoryBudget._next_id
+
+    @staticmethod
+    def _wake_waiters():
+        """依先後順序喚醒預算足夠的等待者（呼叫端需持有鎖）"""
+        while MemoryBudget._waiters:
+            label, nbytes, future = MemoryBudget._waiters[0]
+            if future.done():
+                MemoryBudget._waiters.popleft()
+                continue
+            if not MemoryBudget._fits(nbytes):
+                break
+            MemoryBudget._waiters.popleft()
+            # 喚醒時就先預留，避免被後來的請求插隊
+            reservation = MemoryBudget._admit(label, nbytes)
+            future.get_loop().call_soon_threadsafe(MemoryBudget._resolve, future, reservation)
+
+    @staticmethod
+    def _resolve(future, reservation):
+        if future.done():
+            # 等待者已取消，歸還預留
+            MemoryBudget._release(reservation)
+        else:
+            future.set_result(reservation)
+
+    @staticmethod
+    def _release(reservation):
+        with MemoryBudget._lock:
+            _, nbytes = MemoryBudget._reservations.pop(reservation)
+            MemoryBudget._reserved -= nbytes
+            MemoryBudget._wake_waiters()
+
+    @staticmethod
+    async def acquire(nbytes, label=''):
+        """
+        預留記憶體，預算不足時排隊等待
+
+        Args:
+            nbytes (int): 預估需要的記憶體
+            label (str): 顯示在統計資料中的名稱（例如檔名）
+
+        Returns:
+            int: 預留編號，用於 release
+        """
+        with MemoryBudget._lock:
+            if not MemoryBudget._waiters and MemoryBudget._fits(nbytes):
+                return MemoryBudget._admit(label, nbytes)
+            future = asyncio.get_running_loop().create_future()
+            MemoryBudget._waiters.append((label, nbytes, future))
+            # 排在前面的等待者都已取消時可直接放行
+            MemoryBudget._wake_waiters()
+            if any(waiter is future for _, _, waiter in MemoryBudget._waiters):
+                MemoryBudget._stats['queued'] += 1
+                logger.info(
+                    f"記憶體預算不足，排隊等待解碼：{label}，需要 {nbytes} bytes，"
+                    f"已預留 {MemoryBudget._reserved}/{settings.MEMORY_BUDGET_BYTES} bytes"
+                )
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已放行（預留已記錄）但在繼續執行前被取消，歸還預留（同時喚醒後面的請求）
+                MemoryBudget._release(future.result())
+            else:
+                # 排在前面的請求取消時，讓後面的請求有機會放行
+                with MemoryBudget._lock:
+                    MemoryBudget._wake_waiters()
+            raise
+        finally:
+            MemoryBudget._stats['wait_seconds'] += loop.time() - start
+
+    @staticmethod
+    def release(reservation):
+        """
+        歸還預留的記憶體並喚醒排隊的請求
+
+        Args:
+            reservation (int): acquire 回傳的預留編號
+        """
+        MemoryBudget._release(reservation)
+
+    @staticmethod
+    @asynccontextmanager
+    async def reserve(nbytes, label=''):
+        """
+        在 async with 區塊內預留記憶體
+
+        Args:
+            nbytes (int): 預估需要的記憶體
+            label (str): 顯示在統計資料中的名稱
+        """
+        reservation = await MemoryBudget.acquire(nbytes, label)
+        try:
+            yield reservation
+        finally:
+            MemoryBudget.release(reservation)
+
+    @staticmethod
+    def stats():
+        """
+        回報目前的預留狀態
+
+        Returns:
+            dict: 預算、已預留的記憶體、各預留項目、排隊數與累計統計
+        """
+        with MemoryBudget._lock:
+            return dict(
+                MemoryBudget._stats,
+                budget=settings.MEMORY_BUDGET_BYTES,
+                reserved=MemoryBudget._reserved,
+                reservations=[
+                    {'label': label, 'bytes': nbytes} for label, nbytes in MemoryBudget._reservations.values()
+                ],
+                waiting=sum(1 for _, _, future in MemoryBudget._waiters if not future.done())
+            )
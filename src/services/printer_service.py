@@ -6,6 +6,7 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.units import inch
 import logging
+from src.config import settings
 from src.services.print_service import PrintService
 import traceback
 
@@ -13,7 +14,7 @@ logger = logging.getLogger(__name__)
 
 class PrinterService:
     def __init__(self):
-        self.pdf_dir = 'static/pdf'
+        self.pdf_dir = settings.PDF_FOLDER
         os.makedirs(self.pdf_dir, exist_ok=True)
         
         # A6 紙張尺寸（105mm x 148mm，1英吋 = 25.4mm）
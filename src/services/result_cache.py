@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from src.config import settings
+from src.services.frame_manifest import FrameManifest
+from src.services.image_service import ProcessedImage
+from src.services.jpeg_encoder import JPEG_PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResult:
+    """快取中的處理結果：合成後的圖片（含預覽圖）與已上傳的 URL"""
+
+    __slots__ = ('processed', 'url', 'preview_url')
+
+    def __init__(self, processed, url, preview_url=None):
+        self.processed = processed
+        self.url = url
+        self.preview_url = preview_url
+
+    @property
+    def size(self):
+        preview = self.processed.preview
+        return self.processed.size + (preview.size if preview else 0)
+
+
+class ResultCache:
+    """
+    以內容定址的處理結果快取
+
+    鍵為上傳圖片內容的 SHA-256 加上相框清單版本與輸出設定，相同的照片（重複上傳或 LINE 重送）
+    會直接取得先前的合成結果與 Cloudinary URL，不再合成、編碼與上傳。
+
+    分為兩層：
+        - 記憶體：LRU，超過 settings.RESULT_CACHE_MEMORY_BYTES 時淘汰最久未使用的項目
+        - 磁碟：settings.RESULT_CACHE_FOLDER 中的 <key>.jpg、<key>.preview.jpg 與 <key>.json，
+          超過 settings.RESULT_CACHE_DISK_BYTES 時依最後使用時間淘汰
+    """
+
+    _lock = threading.Lock()
+    _memory = OrderedDict()  # key -> CachedResult
+    _memory_bytes = 0
+    _disk_bytes = None  # 第一次使用時掃描磁碟計算
+    _stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+    @staticmethod
+    def _settings_signature():
+        """會影響輸出結果（含預覽圖）的設定與相框版本"""
+        frames = [settings.PORTRAIT_FRAME, settings.LANDSCAPE_FRAME]
+        versions = [FrameManifest.version(os.path.join(settings.FRAME_FOLDER, name)) for name in frames]
+        # 設定檔的編碼選項也納入，修改設定檔內容時不會取得舊的結果
+        profile_options = sorted(JPEG_PROFILES.get(settings.JPEG_PROFILE, JPEG_PROFILES['default']).items())
+        return ':'.join(versions + [
+            settings.JPEG_PROFILE,
+            repr(profile_options),
+            str(settings.JPEG_MAX_BYTES),
+            f"q{settings.JPEG_QUALITY_PORTRAIT}/{settings.JPEG_QUALITY_LANDSCAPE}",
+            f"{settings.MAX_OUTPUT_WIDTH}x{settings.MAX_OUTPUT_HEIGHT}",
+            str(settings.COMPOSE_AT_OUTPUT_RESOLUTION),
+            f"preview{settings.PREVIEW_MAX_SIZE}q{settings.PREVIEW_QUALITY}"
+        ])
+
+    @staticmethod
+    def key(digest):
+        """
+        計算快取鍵
+
+        Args:
+            digest (str): 上傳圖片內容的 SHA-256（十六進位）
+
+        Returns:
+            str: 快取鍵
+        """
+        signature = ResultCache._settings_signature()
+        return hashlib.sha256(f"{digest}:{signature}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _paths(key):
+        """(圖片, 中繼資料, 預覽圖) 的路徑"""
+        folder = settings.RESULT_CACHE_FOLDER
+        return (
+            os.path.join(folder, f"{key}.jpg"),
+            os.path.join(folder, f"{key}.json"),
+            os.path.join(folder, f"{key}.preview.jpg")
+        )
+
+    @staticmethod
+    def _entry_size(key):
+        """磁碟項目的總大小（不存在的檔案不計）"""
+        return sum(os.path.getsize(path) for path in ResultCache._paths(key) if os.path.exists(path))
+
+    @staticmethod
+    def _remember(key, entry):
+        """放入記憶體層並淘汰超過大小上限的項目（呼叫端需持有鎖）"""
+        previous = ResultCache._memory.pop(key, None)
+        if previous is not None:
+            ResultCache._memory_bytes -= previous.size
+        if entry.size > settings.RESULT_CACHE_MEMORY_BYTES:
+            return
+        ResultCache._memory[key] = entry
+        ResultCache._memory_bytes += entry.size
+        while ResultCache._memory_bytes > settings.RESULT_CACHE_MEMORY_BYTES:
+            _, evicted = ResultCache._memory.popitem(last=False)
+            ResultCache._memory_bytes -= evicted.size
+
+    @staticmethod
+    def _read_disk(key):
+        """從磁碟層讀取，不存在或損壞時回傳 None"""
+        data_path, meta_path, preview_path = ResultCache._paths(key)
+        if not os.path.exists(meta_path) or not os.path.exists(data_path):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(data_path, 'rb') as f:
+                data = f.read()
+            preview = None
+            if meta.get('preview') and os.path.exists(preview_path):
+                with open(preview_path, 'rb') as f:
+                    preview_meta = meta['preview']
+                    preview = ProcessedImage(
+                        preview_meta['filename'], f.read(), (preview_meta['width'], preview_meta['height']),
+                        meta['orientation'], preview_meta['quality']
+                    )
+            # 更新最後使用時間，讓淘汰依 LRU 順序進行
+            now = time.time()
+            os.utime(meta_path, (now, now))
+            processed = ProcessedImage(
+                meta['filename'], data, (meta['width'], meta['height']), meta['orientation'], meta['quality'], preview
+            )
+            return CachedResult(processed, meta['url'], meta.get('preview_url'))
+        except Exception as e:
+            logger.warning(f"讀取結果快取失敗：{key}，錯誤：{str(e)}")
+            return None
+
+    @staticmethod
+    def _disk_entries():
+        """磁碟層的項目 [(最後使用時間, key, bytes), ...]"""
+        folder = settings.RESULT_CACHE_FOLDER
+        entries = []
+        for name in os.listdir(folder):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            try:
+                entries.append((os.path.getmtime(ResultCache._paths(key)[1]), key, ResultCache._entry_size(key)))
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def _evict_disk():
+        """淘汰最久未使用的磁碟項目直到低於大小上限（呼叫端需持有鎖）"""
+        if ResultCache._disk_bytes <= settings.RESULT_CACHE_DISK_BYTES:
+            return
+
+        for _, key, size in sorted(ResultCache._disk_entries()):
+            for path in ResultCache._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            ResultCache._disk_bytes -= size
+            logger.info(f"淘汰結果快取：{key}，{size} bytes")
+            if ResultCache._disk_bytes <= settings.RESULT_CACHE_DISK_BYTES:
+                break
+
+    @staticmethod
+    def get(key):
+        """
+        取得快取的處理結果
+
+        Args:
+            key (str): 快取鍵
+
+        Returns:
+            CachedResult: 快取的結果，未命中時回傳 None
+        """
+        if not settings.RESULT_CACHE_ENABLED:
+            return None
+
+        with ResultCache._lock:
+            entry = ResultCache._memory.get(key)
+            if entry is not None:
+                ResultCache._memory.move_to_end(key)
+                ResultCache._stats['memory_hits'] += 1
+                ResultCache._stats['bytes_saved'] += entry.size
+                return entry
+
+            entry = ResultCache._read_disk(key)
+            if entry is not None:
+                ResultCache._remember(key, entry)
+                ResultCache._stats['disk_hits'] += 1
+                ResultCache._stats['bytes_saved'] += entry.size
+                return entry
+
+            ResultCache._stats['misses'] += 1
+            return None
+
+    @staticmethod
+    def lookup(digest):
+        """
+        計算快取鍵並查詢快取
+
+        Args:
+            digest (str): 上傳圖片內容的 SHA-256（十六進位）
+
+        Returns:
+            tuple: (快取鍵, CachedResult 或 None)
+        """
+        key = ResultCache.key(digest)
+        return key, ResultCache.get(key)
+
+    @staticmethod
+    def put(key, processed, url, preview_url=None):
+        """
+        儲存處理結果（記憶體與磁碟）
+
+        Args:
+            key (str): 快取鍵
+            processed (ProcessedImage): 合成結果（含預覽圖）
+            url (str): 已上傳的圖片 URL
+            preview_url (str, optional): 已上傳的預覽圖 URL
+        """
+        if not settings.RESULT_CACHE_ENABLED:
+            return
+
+        entry = CachedResult(processed, url, preview_url)
+        data_path, meta_path, preview_path = ResultCache._paths(key)
+        preview = processed.preview
+        meta = {
+            'filename': processed.filename,
+            'width': processed.width,
+            'height': processed.height,
+            'orientation': processed.orientation,
+            'quality': processed.quality,
+            'url': url,
+            'preview_url': preview_url,
+            'preview': {
+                'filename': preview.filename,
+                'width': preview.width,
+                'height': preview.height,
+                'quality': preview.quality
+            } if preview else None,
+            'created': time.time()
+        }
+
+        with ResultCache._lock:
+            ResultCache._remember(key, entry)
+            try:
+                if ResultCache._disk_bytes is None:
+                    ResultCache._disk_bytes = sum(size for _, _, size in ResultCache._disk_entries())
+                if os.path.exists(meta_path):
+                    ResultCache._disk_bytes -= ResultCache._entry_size(key)
+                # 先寫入圖片，最後寫入中繼資料，讀取時以中繼資料存在與否判斷項目是否完整
+                with open(data_path, 'wb') as f:
+                    f.write(processed.data)
+                if preview:
+                    with open(preview_path, 'wb') as f:
+                        f.write(preview.data)
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                ResultCache._disk_bytes += ResultCache._entry_size(key)
+                ResultCache._evict_disk()
+            except Exception as e:
+                logger.warning(f"寫入結果快取失敗：{key}，錯誤：{str(e)}")
+
+    @staticmethod
+    def stats():
+        """
+        回報快取統計資料
+
+        Returns:
+            dict: 命中次數、命中率、節省的位元組數與各層使用量
+        """
+        with ResultCache._lock:
+            stats = dict(ResultCache._stats)
+            hits = stats['memory_hits'] + stats['disk_hits']
+            total = hits + stats['misses']
+            stats['hit_rate'] = hits / total if total else 0.0
+            stats['memory_entries'] = len(ResultCache._memory)
+            stats['memory_bytes'] = ResultCache._memory_bytes
+            stats['disk_bytes'] = ResultCache._disk_bytes
+            return stats
+
+    @staticmethod
+    def clear():
+        """清除記憶體層（磁碟層保留）"""
+        with ResultCache._lock:
+            ResultCache._memory.clear()
+            ResultCache._memory_bytes = 0
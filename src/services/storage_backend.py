@@ -0,0 +1,284 @@
+import os
+import hmac
+import time
+import hashlib
+import asyncio
+import secrets
+import logging
+import tempfile
+from urllib.parse import urlencode
+from src.config import settings
+from src.services.cloudinary_uploader import CloudinaryUploader
+
+logger = logging.getLogger(__name__)
+
+
+class StorageError(Exception):
+    """儲存圖片失敗"""
+
+
+class StorageBackend:
+    """
+    儲存後端的介面：保存合成後的圖片並回傳 LINE 可以取得的 URL
+
+    子類別實作 store()；durable 表示 URL 不依賴本機的暫存檔案（可放入處理結果快取）。
+    """
+
+    name = None
+    durable = False
+
+    async def store(self, data, filename, is_portrait=False, transformation=None):
+        """
+        保存圖片
+
+        Args:
+            data (bytes): JPEG 資料
+            filename (str): 本地檔名（記錄與 multipart 檔名用）
+            is_portrait (bool): 是否為直式照片
+            transformation (list, optional): Cloudinary 轉換選項（其他後端忽略）
+
+        Returns:
+            str: 圖片 URL
+
+        Raises:
+            StorageError: 保存失敗
+        """
+        raise NotImplementedError
+
+    def owns(self, url):
+        """URL 是否由此後端產生"""
+        return False
+
+
+class CloudinaryStorage(StorageBackend):
+    """上傳到 Cloudinary（CloudinaryUploader），回傳 secure_url"""
+
+    name = 'cloudinary'
+    durable = True
+
+    @staticmethod
+    def default_transformation(is_portrait):
+        """依照片方向決定的轉換選項"""
+        if is_portrait:
+            return [
+                {"width": 1024, "crop": "scale"},  # 確保寬度不超過 1024 像素
+                {"quality": "auto:good"},          # 使用較高質量
+                {"fetch_format": "auto"}           # 自動選擇最佳格式
+            ]
+        return [
+            {"quality": "auto:good"},  # 使用較高質量
+            {"fetch_format": "auto"}   # 自動選擇最佳格式
+        ]
+
+    async def store(self, data, filename, is_portrait=False, transformation=None):
+        # 檢查 Cloudinary 配置是否完整
+        if not all([settings.CLOUDINARY_CLOUD_NAME, settings.CLOUDINARY_API_KEY, settings.CLOUDINARY_API_SECRET]):
+            raise StorageError("Cloudinary 配置不完整")
+
+        if transformation is None:
+            transformation = self.default_transformation(is_portrait)
+        try:
+            # 以共用的連線池非同步上傳（重試、退避與每次嘗試的期限由 CloudinaryUploader 處理）
+            upload_result = await CloudinaryUploader.upload(
+                data, filename, folder="line-bot-frames", transformation=transformation
+            )
+        except Exception as e:
+            raise StorageError(f"所有 Cloudinary 上傳嘗試都失敗: {str(e)}") from e
+        url = upload_result.get('secure_url')
+        if not url:
+            raise StorageError(f"Cloudinary 回應缺少 secure_url: {upload_result}")
+        logger.info(f"Cloudinary 上傳成功：{url}")
+        return url
+
+
+class LocalStorage(StorageBackend):
+    """
+    寫入本地的物件目錄（settings.STORAGE_OBJECT_FOLDER），由 serve_uploads 路由提供
+
+    檔名為內容的 SHA-256（相同內容只寫入一次，內容不會改變，可使用 immutable 快取標頭），
+    URL 附帶 HMAC 簽章與到期時間，放在自己的 CDN 後方時可省去上傳 Cloudinary 的往返。
+    """
+
+    name = 'local'
+    durable = False  # 物件檔案放在暫存目錄中，不放入處理結果快取
+
+    # URL 路徑中的物件目錄（相對於 /tmp/uploads）
+    URL_PREFIX = 'objects'
+    # 到期時間以此秒數為單位無條件進位，同一個物件在一段時間內產生相同的 URL（CDN 快取可以命中）
+    EXPIRY_GRANULARITY = 3600
+
+    @staticmethod
+    def object_name(data):
+        return f"{hashlib.sha256(data).hexdigest()}.jpg"
+
+    @staticmethod
+    def _write_object(data, name):
+        """
+        寫入物件檔案（先寫入暫存檔再改名，讀取端不會看到寫到一半的檔案）
+
+        已存在時不重新寫入，只更新修改時間：新的 URL 有效期間從現在起算，
+        暫存檔案清理（依最後使用時間）不能在新的 URL 到期前刪除檔案。
+        """
+        path = os.path.join(settings.STORAGE_OBJECT_FOLDER, name)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        fd, temp_path = tempfile.mkstemp(dir=settings.STORAGE_OBJECT_FOLDER, suffix='.part')
+        try:
+            # mkstemp 建立的檔案只有擁有者可讀，改為一般檔案的權限（nginx 以 X-Accel-Redirect 直接讀取）
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return path
+
+    @staticmethod
+    def ensure_secret():
+        """
+        確認已設定簽章金鑰（啟動時呼叫）
+
+        未設定 STORAGE_URL_SECRET，或與 LINE_CHANNEL_SECRET 相同時，產生臨時的隨機金鑰並記錄警告：
+        重新啟動後（或多個行程之間）先前產生的 URL 會無法驗證。
+        """
+        secret = settings.STORAGE_URL_SECRET
+        if secret and secret != settings.LINE_CHANNEL_SECRET:
+            return
+        reason = '與 LINE_CHANNEL_SECRET 相同' if secret else '未設定'
+        settings.STORAGE_URL_SECRET = secrets.token_hex(32)
+        logger.warning(
+            f"STORAGE_URL_SECRET {reason}，已產生臨時的簽章金鑰；重新啟動後先前的本地 URL 將失效，"
+            f"請設定獨立的 STORAGE_URL_SECRET"
+        )
+
+    @staticmethod
+    def _secret():
+        secret = settings.STORAGE_URL_SECRET
+        if not secret:
+            raise StorageError("未設定 STORAGE_URL_SECRET，無法簽署本地 URL")
+        return secret.encode('utf-8')
+
+    @staticmethod
+    def sign(name, expires):
+        """
+        計算物件 URL 的簽章
+
+        Args:
+            name (str): 物件檔名
+            expires (int): 到期時間（Unix 時間）
+
+        Returns:
+            str: HMAC-SHA256 簽章（十六進位）
+        """
+        message = f"{LocalStorage.URL_PREFIX}/{name}:{expires}".encode('utf-8')
+        return hmac.new(LocalStorage._secret(), message, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def verify(name, expires, signature, now=None):
+        """
+        驗證物件 URL 的簽章與到期時間
+
+        Returns:
+            bool: 簽章正確且尚未到期
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if not signature or expires < (now or time.time()):
+            return False
+        try:
+            expected = LocalStorage.sign(name, expires)
+        except StorageError:
+            return False
+        return hmac.compare_digest(expected, signature)
+
+    @staticmethod
+    def url_for(name, now=None):
+        """產生物件的簽署 URL（有效期間 settings.STORAGE_URL_TTL 秒）"""
+        granularity = LocalStorage.EXPIRY_GRANULARITY
+        expires = int((now or time.time()) + settings.STORAGE_URL_TTL)
+        expires = -(-expires // granularity) * granularity
+        query = urlencode({'expires': expires, 'sig': LocalStorage.sign(name, expires)})
+        base_url = (settings.STORAGE_PUBLIC_BASE_URL or settings.get_base_url()).rstrip('/')
+        return f"{base_url}/tmp/uploads/{LocalStorage.URL_PREFIX}/{name}?{query}"
+
+    async def store(self, data, filename, is_portrait=False, transformation=None):
+        name = self.object_name(data)
+        try:
+            await asyncio.to_thread(self._write_object, data, name)
+        except OSError as e:
+            raise StorageError(f"寫入本地物件失敗：{name}，錯誤：{str(e)}") from e
+        url = self.url_for(name)
+        logger.info(f"已保存到本地物件：{filename} -> {name}")
+        return url
+
+    def owns(self, url):
+        return f"/tmp/uploads/{self.URL_PREFIX}/" in url
+
+
+class Storage:
+    """
+    依 settings.STORAGE_BACKEND 選擇儲存後端（cloudinary 或 local）
+
+    主要後端失敗時改用本地後端，LINE 仍可取得圖片。
+    """
+
+    _backends = {'cloudinary': CloudinaryStorage(), 'local': LocalStorage()}
+
+    @staticmethod
+    def backend(name=None):
+        """
+        取得儲存後端
+
+        Args:
+            name (str, optional): 後端名稱，預設為 settings.STORAGE_BACKEND
+
+        Returns:
+            StorageBackend: 儲存後端
+        """
+        name = name or settings.STORAGE_BACKEND
+        backend = Storage._backends.get(name)
+        if backend is None:
+            raise ValueError(f"未知的儲存後端：{name}")
+        return backend
+
+    @staticmethod
+    def register(backend):
+        """加入自訂的儲存後端（以 backend.name 選擇）"""
+        Storage._backends[backend.name] = backend
+        return backend
+
+    @staticmethod
+    async def store(data, filename, is_portrait=False, transformation=None):
+        """
+        以設定的後端保存圖片，失敗時改用本地後端
+
+        Returns:
+            str: 圖片 URL，全部失敗時回傳 None
+        """
+        primary = Storage.backend()
+        try:
+            return await primary.store(data, filename, is_portrait=is_portrait, transformation=transformation)
+        except StorageError as e:
+            logger.error(f"{primary.name} 儲存失敗：{str(e)}")
+            if primary.name == LocalStorage.name:
+                return None
+
+        local = Storage.backend(LocalStorage.name)
+        try:
+            url = await local.store(data, filename, is_portrait=is_portrait)
+        except StorageError as e:
+            logger.error(f"本地儲存失敗：{str(e)}")
+            return None
+        logger.info(f"使用本地 URL 替代：{url}")
+        return url
+
+    @staticmethod
+    def is_durable(url):
+        """URL 是否可以放入處理結果快取（不依賴本機暫存檔案）"""
+        return not any(backend.owns(url) for backend in Storage._backends.values() if not backend.durable)
@@ -0,0 +1,235 @@
+import numpy as np
+from src.utils.region_labeling import find_runs
+
+
+def _div255(value):
+    """與 Pillow 相同的四捨五入除以 255"""
+    tmp = value + 128
+    return ((tmp >> 8) + tmp) >> 8
+
+
+def _blend(premultiplied, dst, alpha):
+    """
+    以 Pillow paste 相同的整數運算混合：(src * alpha + dst * (255 - alpha)) / 255
+
+    Args:
+        premultiplied (np.ndarray): 上層顏色乘上 alpha（int32）
+        dst (np.ndarray): 底層顏色（int32）
+        alpha (np.ndarray): 上層 alpha（int32），形狀需可與 dst 廣播
+    """
+    return _div255(premultiplied + dst * (255 - alpha))
+
+
+def _merge_runs(rows, starts, ends):
+    """
+    將連續列中欄位範圍相同的區段合併為矩形區塊
+
+    Returns:
+        list: [(y0, y1, x0, x1), ...]，y1 與 x1 不含端點
+    """
+    if len(rows) == 0:
+        return []
+    order = np.lexsort((rows, ends, starts))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    new_block = np.ones(len(rows), dtype=bool)
+    new_block[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1]) | (rows[1:] != rows[:-1] + 1)
+    first = np.nonzero(new_block)[0]
+    last = np.append(first[1:], len(rows)) - 1
+    return list(zip(rows[first].tolist(), (rows[last] + 1).tolist(), starts[first].tolist(), ends[first].tolist()))
+
+
+class SlotMask:
+    """
+    單一透明區域（照片窗口）的可見像素遮罩
+
+    只記錄照片在相框下實際可見的像素，圓形、心形等非矩形窗口也只處理窗口內的像素：
+        box: 可見像素的邊界框 (x0, y0, x1, y1)，x1 與 y1 不含端點
+        mask: 邊界框內可見（相框非不透明）的像素
+        row_spans: 每列可見像素的欄位範圍 [lo, hi)（絕對座標），整列不可見時 lo == hi
+        blocks: 完全透明像素合併成的矩形區塊 [(y0, y1, x0, x1), ...]，直接複製照片
+        edge_*: 半透明像素的座標、alpha 與預先乘上 alpha 的相框顏色，需要混合
+    """
+
+    __slots__ = ('box', 'mask', 'row_spans', 'blocks', 'edge_rows', 'edge_cols', 'edge_alpha', 'edge_premultiplied')
+
+    @property
+    def visible_pixels(self):
+        return int(self.mask.sum())
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__[1:] if name != 'blocks')
+
+
+class FrameOverlay:
+    """
+    預先計算的相框疊加資料
+
+    將相框像素分為三類：完全不透明（直接使用相框顏色）、完全透明（直接使用照片）
+    與半透明（邊緣反鋸齒，需要混合）。base 為相框疊在空白畫布上的結果（照片以外的區域），
+    半透明像素依列排序並預先乘上 alpha，每列另外記錄非不透明像素的欄位範圍，
+    合成時可略過完全被相框蓋住的區域。透明區域的 SlotMask 以 prepare_slots 預先建立。
+    """
+
+    __slots__ = (
+        'size', 'base', 'see_through', 'row_spans',
+        'run_ptr', 'run_rows', 'run_starts', 'run_ends',
+        'row_ptr', 'partial_rows', 'partial_cols', 'partial_alpha', 'premultiplied',
+        'slots'
+    )
+
+    def __init__(self, frame_image):
+        """
+        Args:
+            frame_image (PIL.Image): RGBA 相框
+        """
+        rgba = np.asarray(frame_image.convert('RGBA') if frame_image.mode != 'RGBA' else frame_image)
+        height, width = rgba.shape[:2]
+        alpha = rgba[..., 3]
+
+        self.size = (width, height)
+        self.slots = {}  # (x1, y1, x2, y2) -> SlotMask
+        transparent = alpha == 0
+
+        # 完全透明像素的區段（依列排序，run_ptr 為每列的起始索引）
+        self.run_rows, self.run_starts, self.run_ends = find_runs(transparent)
+        self.run_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.run_rows, minlength=height))])
+
+        # 每列非不透明像素的欄位範圍 [lo, hi)，整列不透明時 lo == hi == 0
+        self.see_through = alpha < 255
+        self.row_spans = FrameOverlay._row_spans(self.see_through)
+
+        # 半透明像素（依列排序，row_ptr 為每列的起始索引）
+        partial = self.see_through & ~transparent
+        rows, cols = np.nonzero(partial)
+        self.row_ptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=height))])
+        self.partial_rows = rows
+        self.partial_cols = cols
+        self.partial_alpha = alpha[rows, cols].astype(np.int32)
+        # 相框顏色乘上 alpha 只需計算一次
+        self.premultiplied = rgba[rows, cols, :3].astype(np.int32) * self.partial_alpha[:, None]
+
+        # 相框疊在空白畫布（顏色為 0）上的結果
+        self.base = np.array(rgba[..., :3])
+        self.base[transparent] = 0
+        self.base[rows, cols] = _div255(self.premultiplied)
+
+    @staticmethod
+    def _row_spans(mask, offset=0):
+        """每列 True 像素的欄位範圍 [lo, hi)，整列皆為 False 時 lo == hi == offset"""
+        width = mask.shape[1]
+        has_any = mask.any(axis=1)
+        lo = np.where(has_any, mask.argmax(axis=1), 0)
+        hi = np.where(has_any, width - mask[:, ::-1].argmax(axis=1), 0)
+        return np.stack([lo, hi], axis=1) + offset
+
+    @property
+    def nbytes(self):
+        nbytes = sum(getattr(self, name).nbytes for name in self.__slots__ if name not in ('size', 'slots'))
+        return nbytes + sum(slot.nbytes for slot in self.slots.values())
+
+    def _see_through_box(self, x0, y0, x1, y1):
+        """在 [x0, x1) x [y0, y1) 內找出非不透明像素的邊界框，全部不透明時回傳 None"""
+        spans = self.row_spans[y0:y1]
+        rows = np.nonzero(spans[:, 1] > spans[:, 0])[0]
+        if len(rows) == 0:
+            return None
+        lo = max(x0, int(spans[rows, 0].min()))
+        hi = min(x1, int(spans[rows, 1].max()))
+        if lo >= hi:
+            return None
+        return lo, y0 + int(rows[0]), hi, y0 + int(rows[-1]) + 1
+
+    def build_slot(self, box):
+        """
+        建立照片放在 box 時的可見像素遮罩
+
+        Args:
+            box (tuple): 照片範圍 (x1, y1, x2, y2)，x2 與 y2 不含端點
+
+        Returns:
+            SlotMask: 可見像素遮罩，照片完全被相框蓋住時回傳 None
+        """
+        width, height = self.size
+        x, y, right, bottom = box
+        visible = self._see_through_box(max(x, 0), max(y, 0), min(right, width), min(bottom, height))
+        if visible is None:
+            return None
+        x0, y0, x1, y1 = visible
+
+        slot = SlotMask()
+        slot.box = visible
+        slot.mask = self.see_through[y0:y1, x0:x1]
+        slot.row_spans = FrameOverlay._row_spans(slot.mask, offset=x0)
+
+        # 完全透明的區段裁剪到邊界框內，並合併成矩形區塊
+        start, end = self.run_ptr[y0], self.run_ptr[y1]
+        starts = np.maximum(self.run_starts[start:end], x0)
+        ends = np.minimum(self.run_ends[start:end], x1)
+        keep = starts < ends
+        slot.blocks = _merge_runs(self.run_rows[start:end][keep], starts[keep], ends[keep])
+
+        # 邊界框內的半透明像素
+        start, end = self.row_ptr[y0], self.row_ptr[y1]
+        cols = self.partial_cols[start:end]
+        index = np.arange(start, end)[(cols >= x0) & (cols < x1)]
+        slot.edge_rows = self.partial_rows[index]
+        slot.edge_cols = self.partial_cols[index]
+        slot.edge_alpha = self.partial_alpha[index][:, None]
+        slot.edge_premultiplied = self.premultiplied[index]
+        return slot
+
+    def prepare_slots(self, regions):
+        """
+        預先建立透明區域的可見像素遮罩（每個區域只建立一次）
+
+        Args:
+            regions (list): 透明區域 [(x1, y1, x2, y2), ...]
+        """
+        for region in regions:
+            region = tuple(int(v) for v in region)
+            if region not in self.slots:
+                self.slots[region] = self.build_slot(region)
+
+    def composite(self, placements):
+        """
+        將照片放在相框下方並合成為 RGB 陣列
+
+        結果與「建立透明 RGBA 畫布、依序 paste 照片與相框、再轉為 RGB」完全相同，
+        但只配置一個輸出陣列，且只處理照片實際可見的像素。照片範圍與預先建立的
+        透明區域相同時直接使用該區域的遮罩。
+
+        Args:
+            placements (list): [(image, (x, y)), ...]，image 為 RGB 或 RGBA 的 PIL 圖片，
+                各照片之間不可重疊
+
+        Returns:
+            np.ndarray: (高, 寬, 3) 的 uint8 陣列
+        """
+        out = self.base.copy()
+
+        for image, (x, y) in placements:
+            box = (x, y, x + image.width, y + image.height)
+            slot = self.slots[box] if box in self.slots else self.build_slot(box)
+            if slot is None:
+                continue
+            x0, y0, x1, y1 = slot.box
+            layer = np.asarray(image.crop((x0 - x, y0 - y, x1 - x, y1 - y)))
+
+            if image.mode == 'RGBA':
+                # 照片本身有透明度時，先與透明畫布混合（畫布顏色為 0）
+                layer_alpha = layer[..., 3:].astype(np.int32)
+                layer = _div255(layer[..., :3].astype(np.int32) * layer_alpha).astype(np.uint8)
+            elif image.mode != 'RGB':
+                raise ValueError(f"不支援的照片模式：{image.mode}")
+
+            # 完全透明的相框像素直接使用照片
+            for top, bottom, left, right in slot.blocks:
+                out[top:bottom, left:right] = layer[top - y0:bottom - y0, left - x0:right - x0]
+
+            # 半透明的相框像素與照片混合
+            if len(slot.edge_rows):
+                under = layer[slot.edge_rows - y0, slot.edge_cols - x0].astype(np.int32)
+                out[slot.edge_rows, slot.edge_cols] = _blend(slot.edge_premultiplied, under, slot.edge_alpha)
+
+        return out
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+def find_runs(mask):
+    """
+    找出遮罩中每一列的連續 True 區段（run-length）
+
+    Args:
+        mask (np.ndarray): 二維布林遮罩
+
+    Returns:
+        tuple: (rows, starts, ends) 三個等長陣列，ends 為不含端點
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    diff = np.diff(padded, axis=1)
+
+    # np.nonzero 依列優先順序回傳，因此起點與終點會一一對應
+    start_rows, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return start_rows, starts, ends
+
+
+def _link_runs(rows, starts, ends, width):
+    """
+    找出相鄰兩列之間互相重疊（4-連通）的區段配對
+
+    Returns:
+        tuple: (a, b) 兩個等長陣列，代表區段 a[i] 與 b[i] 相連
+    """
+    stride = width + 1
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+
+    # 對每個區段，在下一列中找出重疊的區段範圍 [lo, hi)
+    next_row = (rows + 1) * stride
+    lo = np.searchsorted(end_keys, next_row + starts, side='right')
+    hi = np.searchsorted(start_keys, next_row + ends, side='left')
+
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = np.repeat(lo, counts) + offsets
+    return a, b
+
+
+def _merge_labels(count, a, b):
+    """
+    以向量化的 hook + pointer jumping 合併相連區段，回傳每個區段的根節點
+    """
+    parent = np.arange(count)
+    if len(a) == 0:
+        return parent
+
+    while True:
+        root_a = parent[a]
+        root_b = parent[b]
+        pending = root_a != root_b
+        if not pending.any():
+            return parent
+
+        # 將較大的根掛到較小的根底下
+        low = np.minimum(root_a[pending], root_b[pending])
+        high = np.maximum(root_a[pending], root_b[pending])
+        np.minimum.at(parent, high, low)
+
+        # 壓縮路徑直到每個節點都直接指向根
+        while True:
+            compressed = parent[parent]
+            if np.array_equal(compressed, parent):
+                break
+            parent = compressed
+
+
+def label_regions(mask):
+    """
+    標記二維遮罩中的 4-連通區域，並以陣列運算計算每個區域的統計資料
+
+    Args:
+        mask (np.ndarray): 二維布林遮罩
+
+    Returns:
+        dict: 每個欄位皆為長度等於區域數的陣列
+            - x1, y1: 區域左上角（含）
+            - x2, y2: 區域右下角（含）
+            - pixels: 區域內的像素數
+            - fill_ratio: 像素數佔邊界框面積的比例
+    """
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    rows, starts, ends = find_runs(mask)
+
+    if len(rows) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {
+            'x1': empty, 'y1': empty, 'x2': empty, 'y2': empty,
+            'pixels': empty, 'fill_ratio': np.zeros(0, dtype=np.float64)
+        }
+
+    a, b = _link_runs(rows, starts, ends, width)
+    roots = _merge_labels(len(rows), a, b)
+    _, labels = np.unique(roots, return_inverse=True)
+    count = labels.max() + 1
+
+    x1 = np.full(count, width, dtype=np.int64)
+    y1 = np.full(count, height, dtype=np.int64)
+    x2 = np.zeros(count, dtype=np.int64)
+    y2 = np.zeros(count, dtype=np.int64)
+    np.minimum.at(x1, labels, starts)
+    np.minimum.at(y1, labels, rows)
+    np.maximum.at(x2, labels, ends - 1)
+    np.maximum.at(y2, labels, rows)
+
+    pixels = np.bincount(labels, weights=ends - starts, minlength=count).astype(np.int64)
+    box_area = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    return {
+        'x1': x1,
+        'y1': y1,
+        'x2': x2,
+        'y2': y2,
+        'pixels': pixels,
+        'fill_ratio': pixels / box_area
+    }
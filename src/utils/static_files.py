@@ -0,0 +1,91 @@
+import os
+import stat
+import asyncio
+import mimetypes
+from urllib.parse import quote
+from quart import current_app, request, abort
+from werkzeug.security import safe_join
+from src.config import settings
+
+DEFAULT_MIMETYPE = 'application/octet-stream'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def file_etag(file_stat):
+    """
+    由檔案識別（inode、大小、修改時間）產生強 ETag，不需要讀取檔案內容
+
+    Args:
+        file_stat (os.stat_result): 檔案的 stat
+
+    Returns:
+        str: ETag（不含引號）
+    """
+    return f"{file_stat.st_ino:x}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"
+
+
+def cache_control(immutable=False, max_age=None):
+    """
+    Cache-Control 標頭
+
+    Args:
+        immutable (bool): 內容以雜湊命名、不會改變（可長期快取且不需重新驗證）
+        max_age (int, optional): 快取秒數，預設為 settings.STATIC_MAX_AGE（immutable 時為一年）
+    """
+    if max_age is None:
+        max_age = IMMUTABLE_MAX_AGE if immutable else settings.STATIC_MAX_AGE
+    value = f"public, max-age={max_age}"
+    return f"{value}, immutable" if immutable else value
+
+
+async def send_static_file(directory, filename, accel_location, immutable=False, max_age=None):
+    """
+    回傳靜態檔案，支援 If-None-Match（304）與 Range（206）
+
+    settings.STATIC_ACCEL_REDIRECT 啟用時只回傳 X-Accel-Redirect 標頭，由前方的 nginx 以 sendfile
+    傳送檔案內容（nginx.conf 中 settings.STATIC_ACCEL_PREFIX/<accel_location>/ 的 internal location），
+    否則由 Quart 分段讀取檔案傳送。
+
+    Args:
+        directory (str): 檔案所在目錄
+        filename (str): 相對於 directory 的路徑（來自 URL，會檢查不可跳出目錄）
+        accel_location (str): directory 在 nginx internal location 中的名稱（例如 uploads、static）
+        immutable (bool): 內容以雜湊命名、不會改變
+        max_age (int, optional): 快取秒數
+
+    Returns:
+        Response: 檔案內容、304 或 X-Accel-Redirect 回應
+    """
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    try:
+        file_stat = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        abort(404)
+    if not stat.S_ISREG(file_stat.st_mode):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or DEFAULT_MIMETYPE
+    etag = file_etag(file_stat)
+
+    if settings.STATIC_ACCEL_REDIRECT:
+        response = current_app.response_class('', mimetype=mimetype)
+        # 已有相同版本時直接回覆 304，不需要交給 nginx
+        if etag in request.if_none_match:
+            response.status_code = 304
+        else:
+            # nginx 會自行處理 Range 與條件請求，ETag 也由 nginx 依修改時間與大小產生
+            location = f"{settings.STATIC_ACCEL_PREFIX.rstrip('/')}/{accel_location}/{quote(filename)}"
+            response.headers['X-Accel-Redirect'] = location
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control(immutable, max_age)
+        return response
+
+    response = current_app.response_class(current_app.response_class.file_body_class(path), mimetype=mimetype)
+    response.content_length = file_stat.st_size
+    response.last_modified = file_stat.st_mtime
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control(immutable, max_age)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return await response.make_conditional(request, accept_ranges=True, complete_length=file_stat.st_size)
@@ -0,0 +1,260 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 目前處理中的圖片（同一張圖片的各階段共用），asyncio.to_thread 會一併帶入執行緒
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Span:
+    """
+    單一處理階段的計時（time.perf_counter）
+
+    attrs 記錄圖片尺寸、位元組數等資訊，可在階段結束前以 set() 補上。
+    """
+
+    __slots__ = ('name', 'trace', 'attrs', 'start', 'duration_ms')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.trace = _current_trace.get()
+        self.attrs = attrs
+        self.start = None
+        self.duration_ms = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        Tracer.emit(self)
+        return False
+
+    def to_dict(self):
+        return {'name': self.name, 'trace': self.trace, 'duration_ms': round(self.duration_ms, 3), **self.attrs}
+
+
+class _NoopSpan:
+    """沒有任何輸出目標時使用，不計時也不配置物件"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class LogSink:
+    """每個階段輸出一行 log"""
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def record(self, span):
+        attrs = ' '.join(f"{key}={value}" for key, value in span.attrs.items())
+        logger.log(self.level, f"[span] {span.name} {span.duration_ms:.1f}ms trace={span.trace} {attrs}".rstrip())
+
+
+class HistogramSink:
+    """
+    依階段累計耗時分佈（記憶體中）
+
+    以固定的毫秒區間計數，另外記錄次數、總和、最小與最大值，百分位數由區間估計。
+    """
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, span):
+        duration = span.duration_ms
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = {
+                    'count': 0, 'total_ms': 0.0, 'min_ms': duration, 'max_ms': duration,
+                    'buckets': [0] * (len(self.BOUNDS_MS) + 1)
+                }
+            stage['count'] += 1
+            stage['total_ms'] += duration
+            stage['min_ms'] = min(stage['min_ms'], duration)
+            stage['max_ms'] = max(stage['max_ms'], duration)
+            index = next((i for i, bound in enumerate(self.BOUNDS_MS) if duration <= bound), len(self.BOUNDS_MS))
+            stage['buckets'][index] += 1
+
+    def _percentile(self, stage, ratio):
+        """以區間上限估計百分位數（最後一個區間使用最大值）"""
+        target = stage['count'] * ratio
+        seen = 0
+        for index, count in enumerate(stage['buckets']):
+            seen += count
+            if seen >= target and count:
+                return self.BOUNDS_MS[index] if index < len(self.BOUNDS_MS) else stage['max_ms']
+        return stage['max_ms']
+
+    def export(self):
+        """
+        匯出各階段的統計資料
+
+        Returns:
+            dict: {階段: {count, total_ms, mean_ms, min_ms, max_ms, p50_ms, p95_ms, buckets}}
+        """
+        with self._lock:
+            result = {}
+            for name, stage in self._stages.items():
+                result[name] = {
+                    'count': stage['count'],
+                    'total_ms': round(stage['total_ms'], 3),
+                    'mean_ms': round(stage['total_ms'] / stage['count'], 3),
+                    'min_ms': round(stage['min_ms'], 3),
+                    'max_ms': round(stage['max_ms'], 3),
+                    'p50_ms': self._percentile(stage, 0.5),
+                    'p95_ms': self._percentile(stage, 0.95),
+                    'buckets': dict(zip([f"<={bound}" for bound in self.BOUNDS_MS] + ['>'], stage['buckets']))
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+class JsonLinesSink:
+    """每個階段以一行 JSON 附加寫入檔案"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class CollectSink:
+    """
+    暫存階段而不輸出（合成子行程中使用）
+
+    子行程的階段連同工作結果傳回主行程，再由主行程的 Tracer.emit 記錄到主行程的輸出目標，
+    histogram 等記憶體中的統計才會包含子行程的階段。
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def record(self, span):
+        self.spans.append(span)
+
+
+class Tracer:
+    """
+    處理流程各階段的計時
+
+    用法：
+        with Tracer.span('encode', width=w, height=h) as span:
+            data = ...
+            span.set(bytes=len(data))
+
+    沒有設定任何輸出目標（sink）時 span() 直接回傳共用的空物件，幾乎沒有額外負擔。
+    輸出目標需提供 record(span) 方法，可用 add_sink 加入自訂的目標。
+    """
+
+    _lock = threading.Lock()
+    _sinks = ()  # 以 tuple 保存，記錄時不需要加鎖
+
+    @staticmethod
+    def configure(names, json_path=None):
+        """
+        依名稱設定輸出目標（取代目前的設定）
+
+        Args:
+            names (list): 'log'、'histogram'、'json' 的組合，空白表示停用
+            json_path (str, optional): json 目標的檔案路徑
+        """
+        sinks = []
+        for name in names:
+            if name == 'log':
+                sinks.append(LogSink())
+            elif name == 'histogram':
+                sinks.append(HistogramSink())
+            elif name == 'json' and json_path:
+                sinks.append(JsonLinesSink(json_path))
+            else:
+                logger.warning(f"未知或缺少設定的計時輸出目標：{name}")
+        with Tracer._lock:
+            Tracer._sinks = tuple(sinks)
+
+    @staticmethod
+    def add_sink(sink):
+        with Tracer._lock:
+            Tracer._sinks = Tracer._sinks + (sink,)
+        return sink
+
+    @staticmethod
+    def remove_sink(sink):
+        with Tracer._lock:
+            Tracer._sinks = tuple(s for s in Tracer._sinks if s is not sink)
+
+    @staticmethod
+    def enabled():
+        return bool(Tracer._sinks)
+
+    @staticmethod
+    def find_sink(sink_type):
+        """回傳第一個指定類型的輸出目標，沒有時回傳 None"""
+        return next((sink for sink in Tracer._sinks if isinstance(sink, sink_type)), None)
+
+    @staticmethod
+    def span(name, **attrs):
+        """
+        建立一個階段的計時（需以 with 使用）
+
+        Args:
+            name (str): 階段名稱
+            **attrs: 附加資訊（圖片尺寸、位元組數等）
+        """
+        if not Tracer._sinks:
+            return _NOOP_SPAN
+        return Span(name, attrs)
+
+    @staticmethod
+    @contextmanager
+    def trace(label):
+        """在區塊內的階段都標記為同一張圖片（label 通常為圖片檔名）"""
+        token = _current_trace.set(label)
+        try:
+            yield
+        finally:
+            _current_trace.reset(token)
+
+    @staticmethod
+    def emit(span):
+        for sink in Tracer._sinks:
+            try:
+                sink.record(span)
+            except Exception as e:
+                logger.warning(f"記錄計時失敗：{span.name}，錯誤：{str(e)}")
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+from PIL import Image
+
+# 設定 logging（只顯示警告以上，避免影響計時）
+logging.basicConfig(level=logging.WARNING)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.services.image_service import ImageService
+from src.services.frame_manifest import FrameManifest
+from src.services.frame_registry import FrameRegistry
+
+ITERATIONS = 20
+
+
+def get_test_image():
+    """獲取測試圖片路徑"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.jpg')
+
+
+def build_placements(frame_filename, photo):
+    """依相框清單的透明區域建立照片位置（與實際合成流程相同）"""
+    frame = FrameRegistry.get(frame_filename)
+    output_size = ImageService.output_size(frame.size)
+    regions = FrameManifest.get_regions(frame.path, frame.image)
+    regions = ImageService.scale_regions(regions, frame.size, output_size)
+    scaled = FrameRegistry.get_scaled(frame_filename, output_size)
+
+    placements = []
+    for x1, y1, x2, y2 in regions:
+        fitted = ImageService.fit_image_to_region(photo, x2 - x1, y2 - y1, fill=True)
+        placements.append((fitted, (x1, y1)))
+    return scaled, placements
+
+
+def run(kernel, frame, placements):
+    """以指定的合成核心執行，回傳 (結果, 每次平均毫秒數)"""
+    settings.COMPOSITE_KERNEL = kernel
+    result = ImageService.composite_with_frame(frame, placements)
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        ImageService.composite_with_frame(frame, placements)
+    elapsed = (time.perf_counter() - start) / ITERATIONS * 1000
+    return result, elapsed
+
+
+def main():
+    with Image.open(get_test_image()) as image:
+        photo = image.convert('RGB')
+
+    for frame_filename in (settings.PORTRAIT_FRAME, settings.LANDSCAPE_FRAME):
+        frame, placements = build_placements(frame_filename, photo)
+
+        # 第一次使用時建立相框疊加資料，不計入合成時間
+        start = time.perf_counter()
+        frame.overlay
+        overlay_ms = (time.perf_counter() - start) * 1000
+
+        pillow_result, pillow_ms = run('pillow', frame, placements)
+        numpy_result, numpy_ms = run('numpy', frame, placements)
+
+        diff = np.abs(np.asarray(pillow_result, dtype=np.int16) - np.asarray(numpy_result, dtype=np.int16))
+        print(f"=== {frame_filename} ({frame.size[0]}x{frame.size[1]}, {len(placements)} 個區域) ===")
+        print(f"pillow：{pillow_ms:.1f} ms")
+        print(f"numpy ：{numpy_ms:.1f} ms（相框疊加資料建立一次 {overlay_ms:.1f} ms）")
+        print(f"最大像素差異：{diff.max()}，不同的像素數：{int((diff.max(axis=2) > 0).sum())}")
+
+        if diff.max() != 0:
+            print("❌ 合成結果不一致")
+            sys.exit(1)
+    print("✅ 合成結果一致")
+
+
+if __name__ == "__main__":
+    main()
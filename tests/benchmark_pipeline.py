@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import ctypes
+import ctypes.util
+import platform
+import resource
+import tempfile
+import gc
+import statistics
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+# 設定 logging（只顯示錯誤，避免影響計時；沒有透明區域的相框每次都會發出警告）
+logging.basicConfig(level=logging.ERROR)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.services.image_service import ImageService
+from src.services.jpeg_encoder import JpegEncoder
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(TESTS_DIR, 'benchmark_baseline.json')
+DEFAULT_MEGAPIXELS = (2, 8, 12)
+
+# 低於此差異不視為退步（避免計時雜訊）
+MIN_TIME_DIFF_MS = 2.0
+MIN_RSS_DIFF_MB = 4.0
+
+
+def generate_photo(path, megapixels, portrait, seed):
+    """
+    產生測試照片（漸層加上雜訊，JPEG 大小與壓縮難度接近一般照片），不需要網路或外部檔案
+
+    Args:
+        path (str): 輸出路徑
+        megapixels (float): 像素數（百萬）
+        portrait (bool): 是否為直式（3:4），否則為橫式（4:3）
+        seed (int): 亂數種子，相同參數產生相同的照片
+    """
+    long_side = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    short_side = long_side * 3 // 4
+    width, height = (short_side, long_side) if portrait else (long_side, short_side)
+
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, (a, b) in enumerate(rng.uniform(40, 200, size=(3, 2))):
+        noise = rng.normal(0, 12, size=(height, width)).astype(np.float32)
+        pixels[..., channel] = np.clip(a * x + b * y + 30 * np.sin(9 * x + 5 * y + channel) + noise, 0, 255)
+    Image.fromarray(pixels).save(path, 'JPEG', quality=92)
+    return width, height
+
+
+def build_corpus(folder, megapixels):
+    """產生直式與橫式、各種像素數的測試照片，回傳 [(名稱, 檔名), ...]"""
+    corpus = []
+    for index, mp in enumerate(megapixels):
+        for portrait in (True, False):
+            name = f"{'portrait' if portrait else 'landscape'}_{mp:g}mp"
+            filename = f"20990101_{name}.jpg"
+            width, height = generate_photo(os.path.join(folder, filename), mp, portrait, seed=index * 2 + portrait)
+            corpus.append((name, filename))
+            print(f"測試照片：{name}（{width}x{height}）")
+    return corpus
+
+
+def list_frames():
+    """static/frames 中的全部相框"""
+    return sorted(name for name in os.listdir(settings.FRAME_FOLDER) if name.lower().endswith('.png'))
+
+
+def _status_kb(field):
+    """從 /proc/self/status 讀取記憶體欄位（KB），不支援時回傳 None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _release_free_memory():
+    """回收垃圾並將 malloc 的空閒記憶體還給系統，讓各階段的 RSS 從相近的起點開始"""
+    gc.collect()
+    libc_path = ctypes.util.find_library('c')
+    if libc_path:
+        try:
+            ctypes.CDLL(libc_path).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+def _reset_peak_rss():
+    """重設行程的最高 RSS（Linux 的 clear_refs），成功時回傳 True"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure(func, repeat):
+    """
+    執行 func 並量測
+
+    先執行一次暖身（不計入），再以 repeat 次計時並記錄最高 RSS（不啟用 tracemalloc），
+    最後再執行一次並以 tracemalloc 記錄 Python 與 NumPy 的配置量。
+
+    Returns:
+        dict: wall_ms（中位數）、min_ms、peak_rss_mb（此階段增加的最高 RSS）、
+              alloc_peak_mb 與 alloc_blocks（tracemalloc 的最高配置量與區塊數）
+    """
+    func()
+    _release_free_memory()
+    rss_before = _status_kb('VmRSS')
+    can_reset = rss_before is not None and _reset_peak_rss()
+    if not can_reset:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    rss_peak = _status_kb('VmHWM') if can_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    func()
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    alloc_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return {
+        'wall_ms': round(statistics.median(times), 2),
+        'min_ms': round(min(times), 2),
+        'peak_rss_mb': round(max(0, rss_peak - rss_before) / 1024, 1),
+        'alloc_peak_mb': round(alloc_peak / (1024 * 1024), 2),
+        'alloc_blocks': alloc_blocks
+    }
+
+
+def run_suite(folder, corpus, frames, repeat):
+    """
+    對每個相框與測試照片執行各個階段
+
+    Returns:
+        dict: {'階段|相框|照片': 量測結果}
+    """
+    results = {}
+
+    def record(stage, frame_filename, photo_name, func):
+        key = f"{stage}|{frame_filename}|{photo_name}"
+        results[key] = measure(func, repeat)
+        print(f"{key:<70} {results[key]['wall_ms']:>9.1f} ms  rss+{results[key]['peak_rss_mb']:>6.1f} MB  "
+              f"alloc {results[key]['alloc_peak_mb']:>6.1f} MB")
+
+    photos = {}
+    for name, filename in corpus:
+        with Image.open(os.path.join(folder, filename)) as image:
+            photos[name] = image.convert('RGB')
+
+    # JPEG 大小限制的編碼迴圈（與相框無關）
+    for name, photo in photos.items():
+        record('jpeg_encode', '-', name, lambda photo=photo: JpegEncoder.encode(photo))
+
+    original_frames = settings.PORTRAIT_FRAME, settings.LANDSCAPE_FRAME
+    try:
+        for frame_filename in frames:
+            frame_path = os.path.join(settings.FRAME_FOLDER, frame_filename)
+            with Image.open(frame_path) as frame_image:
+                frame_image.load()
+            record('find_transparent_regions', frame_filename, '-',
+                   lambda: ImageService.find_transparent_regions(frame_image))
+            regions = ImageService.find_transparent_regions(frame_image) or [(0, 0, frame_image.width, frame_image.height)]
+            x1, y1, x2, y2 = max(regions, key=lambda r: (r[2] - r[0]) * (r[3] - r[1]))
+
+            # 直式與橫式照片都使用此相框
+            settings.PORTRAIT_FRAME = settings.LANDSCAPE_FRAME = frame_filename
+            for name, filename in corpus:
+                record('fit_image_to_region', frame_filename, name,
+                       lambda photo=photos[name]: ImageService.fit_image_to_region(photo, x2 - x1, y2 - y1, fill=True))
+
+                def process(filename=filename):
+                    output = asyncio.run(ImageService.process_image_with_frame(filename))
+                    if output is None:
+                        raise RuntimeError(f"處理失敗：{frame_filename} {filename}")
+                    os.remove(os.path.join(folder, output))
+                record('process_image_with_frame', frame_filename, name, process)
+    finally:
+        settings.PORTRAIT_FRAME, settings.LANDSCAPE_FRAME = original_frames
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    與基準比較，回傳退步的項目
+
+    時間（min_ms，受其他行程干擾最小）或最高 RSS 超過基準的 (1 + threshold) 倍，且差異大於雜訊下限時視為退步。
+
+    Returns:
+        list: [(項目, 指標, 基準值, 目前值), ...]
+    """
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric, floor in (('min_ms', MIN_TIME_DIFF_MS), ('peak_rss_mb', MIN_RSS_DIFF_MB)):
+            if current[metric] > previous[metric] * (1 + threshold) and current[metric] - previous[metric] > floor:
+                regressions.append((key, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def environment():
+    """記錄執行環境，比較不同機器的結果時參考"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pillow': Image.__version__,
+        'numpy': np.__version__,
+        'composite_kernel': settings.COMPOSITE_KERNEL,
+        'jpeg_profile': settings.JPEG_PROFILE
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='圖片處理流程效能測試（完全離線執行）')
+    parser.add_argument('--megapixels', type=float, nargs='+', default=DEFAULT_MEGAPIXELS, help='測試照片的像素數（百萬）')
+    parser.add_argument('--frames', nargs='+', help='要測試的相框檔名（預設為 static/frames 中的全部相框）')
+    parser.add_argument('--repeat', type=int, default=5, help='每個項目計時的次數')
+    parser.add_argument('--output', help='將結果存為 JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='比較用的基準 JSON')
+    parser.add_argument('--save-baseline', action='store_true', help='將本次結果存為新的基準')
+    parser.add_argument('--threshold', type=float, default=0.25, help='退步門檻（0.25 表示慢 25%%）')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    upload_folder = settings.UPLOAD_FOLDER
+    settings.UPLOAD_FOLDER = folder
+    try:
+        corpus = build_corpus(folder, args.megapixels)
+        frames = args.frames or list_frames()
+        ImageService.preload_frames()
+        results = run_suite(folder, corpus, frames, args.repeat)
+    finally:
+        settings.UPLOAD_FOLDER = upload_folder
+        shutil.rmtree(folder, ignore_errors=True)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存：{args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基準已更新：{args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"找不到基準檔案：{args.baseline}（以 --save-baseline 建立）")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline['results'], args.threshold)
+    if regressions:
+        print(f"❌ 發現 {len(regressions)} 個退步的項目（門檻 {args.threshold:.0%}）：")
+        for key, metric, previous, current in regressions:
+            print(f"  {key} {metric}: {previous} -> {current}")
+        sys.exit(1)
+    print(f"✅ 與基準相比沒有退步（門檻 {args.threshold:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import logging
+import argparse
+import cloudinary.utils
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class CloudinaryStub:
+    """
+    本地的 Cloudinary 上傳 API 替代伺服器（測試用，不需要網路）
+
+    驗證上傳參數的簽章並回傳與 Cloudinary 相同格式的結果，可模擬失敗與延遲：
+        fail_next: 接下來幾個請求回傳 fail_status
+        delay: 每個請求的延遲秒數
+        delay_next: 接下來的請求依序使用的延遲秒數（優先於 delay）
+    並記錄收到的上傳與同時處理中的最大請求數。
+    """
+
+    def __init__(self, api_secret, host='127.0.0.1', port=0):
+        self.api_secret = api_secret
+        self.host = host
+        self.port = port
+        self.fail_next = 0
+        self.fail_status = 500
+        self.delay = 0
+        self.delay_next = []
+        self.uploads = []  # [(參數, 檔案大小), ...]
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def handle_upload(self, request):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            params = {}
+            file_size = 0
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == 'file':
+                    file_size = len(await part.read())
+                else:
+                    params[part.name] = await part.text()
+
+            delay = self.delay_next.pop(0) if self.delay_next else self.delay
+            if delay:
+                await asyncio.sleep(delay)
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return web.json_response({'error': {'message': '模擬失敗'}}, status=self.fail_status)
+
+            signature = params.pop('signature', None)
+            params.pop('api_key', None)
+            expected = cloudinary.utils.api_sign_request(params, self.api_secret)
+            if signature != expected:
+                return web.json_response({'error': {'message': 'Invalid Signature'}}, status=401)
+
+            name = params.get('public_id') or f"stub_{len(self.uploads) + 1}"
+            public_id = f"{params.get('folder', '')}/{name}".lstrip('/')
+            self.uploads.append((params, file_size))
+            cloud_name = request.match_info['cloud_name']
+            return web.json_response({
+                'public_id': public_id,
+                'bytes': file_size,
+                'format': 'jpg',
+                'secure_url': f"{self.base_url}/{cloud_name}/image/upload/{public_id}.jpg"
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def start(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post('/v1_1/{cloud_name}/image/upload', self.handle_upload)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Cloudinary 替代伺服器已啟動：{self.base_url}")
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def serve(args):
+    stub = await CloudinaryStub(args.api_secret, port=args.port).start()
+    stub.fail_next = args.fail_next
+    stub.delay = args.delay
+    print(f"CLOUDINARY_API_BASE={stub.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地的 Cloudinary 上傳 API 替代伺服器')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--api-secret', default=os.getenv('CLOUDINARY_API_SECRET', 'test-secret'))
+    parser.add_argument('--fail-next', type=int, default=0, help='接下來幾個請求回傳 500')
+    parser.add_argument('--delay', type=float, default=0, help='每個請求的延遲秒數')
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(parser.parse_args()))
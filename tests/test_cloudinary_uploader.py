@@ -0,0 +1,278 @@
+import os
+import sys
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.services.image_service import ImageService, ProcessedImage
+from src.services.cloudinary_uploader import CloudinaryUploader, CloudinaryUploadError
+from tests.cloudinary_stub import CloudinaryStub
+
+
+def get_test_image():
+    """獲取測試圖片內容"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.jpg'), 'rb') as f:
+        return f.read()
+
+
+async def check_upload(stub, data):
+    """簽署正確、回傳 secure_url，且附帶轉換選項"""
+    result = await CloudinaryUploader.upload(data, 'a.jpg', folder='line-bot-frames', transformation=[{'quality': 'auto:good'}])
+    params, size = stub.uploads[-1]
+    assert result['secure_url'].startswith(stub.base_url), result
+    assert size == len(data), (size, len(data))
+    assert params['transformation'] == 'q_auto:good', params
+    # 以內容的雜湊命名並覆寫，對沖或重試的上傳寫入同一個資源
+    assert params['public_id'] == hashlib.sha256(data).hexdigest(), params
+    assert params['overwrite'] == '1', params
+    assert result['public_id'] == f"line-bot-frames/{params['public_id']}", result
+
+
+async def check_retry(stub, data):
+    """5xx 以退避重試後成功"""
+    stub.fail_next = 2
+    before = stub.requests
+    await CloudinaryUploader.upload(data, 'b.jpg', folder='line-bot-frames')
+    assert stub.requests - before == 3, stub.requests - before
+
+
+async def check_no_retry_on_client_error(stub, data):
+    """4xx 不重試"""
+    stub.fail_next, stub.fail_status = 1, 400
+    before = stub.requests
+    try:
+        await CloudinaryUploader.upload(data, 'c.jpg', folder='line-bot-frames')
+        raise AssertionError('應該拋出 CloudinaryUploadError')
+    except CloudinaryUploadError as e:
+        assert e.status == 400 and not e.retryable, e
+    finally:
+        stub.fail_status = 500
+    assert stub.requests - before == 1, stub.requests - before
+
+
+async def check_attempt_timeout(stub, data):
+    """每次嘗試的期限到了就放棄，重試次數用盡後拋出錯誤"""
+    stub.delay = settings.UPLOAD_ATTEMPT_TIMEOUT * 3
+    start = time.perf_counter()
+    try:
+        await CloudinaryUploader.upload(data, 'd.jpg', folder='line-bot-frames')
+        raise AssertionError('應該拋出 CloudinaryUploadError')
+    except CloudinaryUploadError as e:
+        assert '逾時' in str(e), e
+    finally:
+        stub.delay = 0
+    elapsed = time.perf_counter() - start
+    assert elapsed < settings.UPLOAD_ATTEMPT_TIMEOUT * 3 * settings.UPLOAD_MAX_ATTEMPTS, elapsed
+
+
+async def check_concurrency(stub, data):
+    """同時上傳數量不超過上限"""
+    # 等待先前逾時的請求在替代伺服器結束
+    while stub.in_flight:
+        await asyncio.sleep(0.05)
+    stub.delay = 0.05
+    stub.max_in_flight = 0
+    try:
+        await asyncio.gather(*[
+            CloudinaryUploader.upload(data, f"e{i}.jpg", folder='line-bot-frames') for i in range(12)
+        ])
+    finally:
+        stub.delay = 0
+    assert stub.max_in_flight == settings.UPLOAD_MAX_CONCURRENCY, stub.max_in_flight
+
+
+async def check_event_loop_free(stub, data):
+    """上傳期間事件迴圈仍可處理其他工作"""
+    stub.delay = settings.UPLOAD_ATTEMPT_TIMEOUT / 2
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    try:
+        await CloudinaryUploader.upload(data, 'f.jpg', folder='line-bot-frames')
+    finally:
+        task.cancel()
+        stub.delay = 0
+    assert ticks >= 5, ticks
+
+
+async def check_hedge(stub, data):
+    """第一個上傳過慢時送出第二個上傳，採用先完成的結果"""
+    while stub.in_flight:
+        await asyncio.sleep(0.05)
+    settings.UPLOAD_HEDGE_DEFAULT_DELAY = settings.UPLOAD_HEDGE_MIN_DELAY = 0.03
+    stub.delay_next = [settings.UPLOAD_ATTEMPT_TIMEOUT * 0.75]
+    before = dict(CloudinaryUploader.stats())
+    start = time.perf_counter()
+    try:
+        await CloudinaryUploader.upload(data, 'g.jpg', folder='line-bot-frames')
+    finally:
+        stub.delay_next = []
+        settings.UPLOAD_HEDGE_DEFAULT_DELAY = settings.UPLOAD_HEDGE_MIN_DELAY = 10
+    elapsed = time.perf_counter() - start
+    after = CloudinaryUploader.stats()
+    assert after['hedges'] - before['hedges'] == 1, after
+    assert after['hedges_won'] - before['hedges_won'] == 1, after
+    assert elapsed < settings.UPLOAD_ATTEMPT_TIMEOUT * 0.75, elapsed
+
+
+async def check_hedge_after_slot(stub, data):
+    """等待上傳名額的時間不計入對沖的等待時間"""
+    _, semaphore = await CloudinaryUploader._resources()
+    settings.UPLOAD_HEDGE_DEFAULT_DELAY = settings.UPLOAD_HEDGE_MIN_DELAY = 0.03
+    before = dict(CloudinaryUploader.stats())
+    # 佔用全部的上傳名額，排隊時間遠超過對沖的等待時間
+    for _ in range(settings.UPLOAD_MAX_CONCURRENCY):
+        await semaphore.acquire()
+    try:
+        task = asyncio.create_task(CloudinaryUploader.upload(data, 'g2.jpg', folder='line-bot-frames'))
+        await asyncio.sleep(0.1)
+    finally:
+        for _ in range(settings.UPLOAD_MAX_CONCURRENCY):
+            semaphore.release()
+    try:
+        await task
+    finally:
+        settings.UPLOAD_HEDGE_DEFAULT_DELAY = settings.UPLOAD_HEDGE_MIN_DELAY = 10
+    after = CloudinaryUploader.stats()
+    assert after['hedges'] == before['hedges'], after
+
+
+async def check_loop_switch(stub, data):
+    """換到其他事件迴圈上傳時關閉先前事件迴圈的 session（已關閉或仍在其他執行緒執行的迴圈）"""
+    # 在另一個執行緒的事件迴圈上傳，該迴圈結束後已關閉
+    await asyncio.to_thread(asyncio.run, CloudinaryUploader.upload(data, 'i1.jpg', folder='line-bot-frames'))
+    previous = CloudinaryUploader._session
+    assert not previous.closed
+    await CloudinaryUploader.upload(data, 'i2.jpg', folder='line-bot-frames')
+    assert previous.closed, '已關閉的事件迴圈的 session 應該被關閉'
+    assert CloudinaryUploader._session is not previous
+
+    # 在仍在執行中的事件迴圈（其他執行緒）上傳，之後換回目前的事件迴圈
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever)
+    thread.start()
+    try:
+        future = asyncio.run_coroutine_threadsafe(
+            CloudinaryUploader.upload(data, 'i3.jpg', folder='line-bot-frames'), other_loop
+        )
+        await asyncio.wrap_future(future)
+        previous = CloudinaryUploader._session
+        await CloudinaryUploader.upload(data, 'i4.jpg', folder='line-bot-frames')
+        for _ in range(100):
+            if previous.closed:
+                break
+            await asyncio.sleep(0.01)
+        assert previous.closed, '其他事件迴圈的 session 應該在該迴圈上被關閉'
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        await asyncio.to_thread(thread.join)
+        other_loop.close()
+
+
+async def check_deadline_covers_retry(stub, data):
+    """整體期限與每次嘗試的期限的比例和預設值相同時，逾時的嘗試之後仍有時間重試"""
+    deadline, settings.UPLOAD_DEADLINE = settings.UPLOAD_DEADLINE, settings.UPLOAD_ATTEMPT_TIMEOUT * 2.5
+    stub.delay_next = [settings.UPLOAD_ATTEMPT_TIMEOUT * 3]
+    try:
+        assert CloudinaryUploader.check_settings()
+        result = await CloudinaryUploader.upload(data, 'j.jpg', folder='line-bot-frames')
+        assert result['secure_url'], result
+    finally:
+        stub.delay_next = []
+        settings.UPLOAD_DEADLINE = deadline
+
+    # 整體期限不長於每次嘗試的期限時記錄警告
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    uploader_logger = logging.getLogger(CloudinaryUploader.__module__)
+    uploader_logger.addHandler(handler)
+    deadline, settings.UPLOAD_DEADLINE = settings.UPLOAD_DEADLINE, settings.UPLOAD_ATTEMPT_TIMEOUT
+    try:
+        assert not CloudinaryUploader.check_settings()
+    finally:
+        settings.UPLOAD_DEADLINE = deadline
+        uploader_logger.removeHandler(handler)
+    assert any(record.levelno == logging.WARNING and 'UPLOAD_DEADLINE' in record.getMessage()
+               for record in records), records
+
+
+async def check_deadline(stub, data):
+    """整個上傳（含重試）不超過整體期限"""
+    deadline, settings.UPLOAD_DEADLINE = settings.UPLOAD_DEADLINE, settings.UPLOAD_ATTEMPT_TIMEOUT * 1.5
+    stub.delay = settings.UPLOAD_ATTEMPT_TIMEOUT * 3
+    start = time.perf_counter()
+    try:
+        await CloudinaryUploader.upload(data, 'h.jpg', folder='line-bot-frames')
+        raise AssertionError('應該拋出 CloudinaryUploadError')
+    except CloudinaryUploadError as e:
+        assert '整體期限' in str(e) and not e.retryable, e
+    finally:
+        stub.delay = 0
+        settings.UPLOAD_DEADLINE = deadline
+    elapsed = time.perf_counter() - start
+    assert elapsed < settings.UPLOAD_ATTEMPT_TIMEOUT * 2, elapsed
+    assert CloudinaryUploader.stats()['deadline_exceeded'] == 1
+
+
+async def check_image_service(stub, data):
+    """ImageService.store_image 以 cloudinary 後端非同步上傳"""
+    processed = ProcessedImage('processed_test.jpg', data, (1024, 682), 'portrait', 85)
+    url = await ImageService.store_image(processed)
+    assert url.startswith(stub.base_url), url
+    params, _ = stub.uploads[-1]
+    assert params['transformation'] == 'c_scale,w_1024/q_auto:good/f_auto', params
+
+
+async def main():
+    settings.CLOUDINARY_CLOUD_NAME = 'demo'
+    settings.CLOUDINARY_API_KEY = '123456'
+    settings.CLOUDINARY_API_SECRET = 'test-secret'
+    settings.UPLOAD_ATTEMPT_TIMEOUT = 0.2
+    settings.UPLOAD_BACKOFF_BASE = 0.01
+    settings.UPLOAD_MAX_CONCURRENCY = 3
+    # 對沖只在 check_hedge 中啟用
+    settings.UPLOAD_HEDGE_DEFAULT_DELAY = settings.UPLOAD_HEDGE_MIN_DELAY = 10
+
+    stub = await CloudinaryStub(settings.CLOUDINARY_API_SECRET).start()
+    settings.CLOUDINARY_API_BASE = stub.base_url
+    data = get_test_image()
+
+    failed = 0
+    try:
+        for check in (check_upload, check_retry, check_no_retry_on_client_error, check_attempt_timeout,
+                      check_concurrency, check_event_loop_free, check_hedge, check_hedge_after_slot,
+                      check_loop_switch, check_deadline_covers_retry, check_deadline, check_image_service):
+            try:
+                await check(stub, data)
+                print(f"✅ {check.__name__}：{check.__doc__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    finally:
+        await CloudinaryUploader.close()
+        await stub.stop()
+
+    print(f"上傳統計：{CloudinaryUploader.stats()}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.services.janitor import Janitor
+
+HOUR = 3600
+
+
+def make_file(folder, name, size, age):
+    """建立指定大小的檔案，最後使用時間為 age 秒前"""
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    timestamp = time.time() - age
+    os.utime(path, (timestamp, timestamp))
+    return path
+
+
+def remaining(folder):
+    return sorted(os.listdir(folder))
+
+
+async def check_ttl(folders):
+    """超過保留時間的檔案被刪除，未超過的保留"""
+    uploads = folders['uploads']
+    make_file(uploads, 'old.jpg', 100, 30 * HOUR)
+    make_file(uploads, 'new.jpg', 100, 2 * HOUR)
+    await Janitor.sweep()
+    assert remaining(uploads) == ['new.jpg'], remaining(uploads)
+
+
+async def check_quota_lru(folders):
+    """超過總大小上限時從最久未使用的檔案開始刪除"""
+    pdf = folders['pdf']
+    for index, age in enumerate((5, 4, 3, 2, 1)):
+        make_file(pdf, f"{index}.pdf", 1000, age * HOUR)
+    settings.PDF_MAX_BYTES = 3000
+    try:
+        await Janitor.sweep()
+    finally:
+        settings.PDF_MAX_BYTES = 0
+    assert remaining(pdf) == ['2.pdf', '3.pdf', '4.pdf'], remaining(pdf)
+    assert Janitor.stats()['folders'][pdf]['bytes'] == 3000
+
+
+async def check_pinned_and_young(folders):
+    """用戶狀態參照的檔案與剛建立的檔案不會被刪除"""
+    uploads = folders['uploads']
+    pinned = make_file(uploads, 'pinned.jpg', 100, 30 * HOUR)
+    make_file(uploads, 'young.jpg', 100, 0)
+    make_file(uploads, 'stale.jpg', 100, 30 * HOUR)
+    settings.UPLOAD_MAX_BYTES = 1
+    try:
+        await Janitor.sweep({pinned})
+    finally:
+        settings.UPLOAD_MAX_BYTES = 0
+    # 超過上限時其他檔案（含未過期的 new.jpg）都會被刪除
+    assert remaining(uploads) == ['pinned.jpg', 'young.jpg'], remaining(uploads)
+
+
+async def check_subfolders_untouched(folders):
+    """只清理目錄中的檔案，不進入子目錄"""
+    nested = os.path.join(folders['uploads'], 'nested')
+    os.makedirs(nested)
+    make_file(nested, 'inner.jpg', 100, 30 * HOUR)
+    await Janitor.sweep()
+    assert remaining(nested) == ['inner.jpg'], remaining(nested)
+
+
+async def check_incremental(folders):
+    """大量檔案分批處理，清理期間事件迴圈仍可執行其他工作"""
+    objects = folders['objects']
+    for index in range(2000):
+        make_file(objects, f"{index:05d}.jpg", 10, (settings.STORAGE_URL_TTL + 2 * HOUR))
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    try:
+        result = await Janitor.sweep()
+    finally:
+        task.cancel()
+    assert result[objects]['files_removed'] == 2000, result
+    assert remaining(objects) == []
+    # 至少每批讓出一次（掃描與刪除各 2000 / 100 批）
+    assert ticks >= 2000 // settings.JANITOR_BATCH_SIZE * 2, ticks
+
+
+async def check_background_task(folders):
+    """start() 啟動定期清理，stop() 停止"""
+    uploads = folders['uploads']
+    make_file(uploads, 'background.jpg', 100, 30 * HOUR)
+    task = Janitor.start(lambda: set())
+    assert task is not None
+    for _ in range(100):
+        if 'background.jpg' not in remaining(uploads):
+            break
+        await asyncio.sleep(0.01)
+    await Janitor.stop()
+    assert task.done()
+    assert 'background.jpg' not in remaining(uploads), remaining(uploads)
+
+
+async def main():
+    root = tempfile.mkdtemp(prefix='janitor_')
+    folders = {name: os.path.join(root, name) for name in ('uploads', 'pdf', 'objects')}
+    for folder in folders.values():
+        os.makedirs(folder)
+
+    # 使用暫存目錄，不影響 tmp/uploads 與 static/pdf
+    original = (settings.UPLOAD_FOLDER, settings.PDF_FOLDER, settings.STORAGE_OBJECT_FOLDER)
+    settings.UPLOAD_FOLDER, settings.PDF_FOLDER, settings.STORAGE_OBJECT_FOLDER = (
+        folders['uploads'], folders['pdf'], folders['objects']
+    )
+    settings.UPLOAD_RETENTION_SECONDS = settings.PDF_RETENTION_SECONDS = 24 * HOUR
+    settings.UPLOAD_MAX_BYTES = settings.PDF_MAX_BYTES = settings.STORAGE_OBJECT_MAX_BYTES = 0
+    settings.JANITOR_MIN_AGE = 60
+    settings.JANITOR_BATCH_SIZE = 100
+
+    failed = 0
+    try:
+        for check in (check_ttl, check_quota_lru, check_pinned_and_young, check_subfolders_untouched,
+                      check_incremental, check_background_task):
+            try:
+                await check(folders)
+                print(f"✅ {check.__name__}：{check.__doc__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    finally:
+        settings.UPLOAD_FOLDER, settings.PDF_FOLDER, settings.STORAGE_OBJECT_FOLDER = original
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"清理統計：{Janitor.stats()}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,380 @@
+import os
+import sys
+import json
+import time
+import hmac
+import base64
+import hashlib
+import asyncio
+import logging
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 匯入 src.app 前需要 LINE 的設定
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-token')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-secret')
+
+from src.config import settings
+from src.services.job_queue import Job, JobQueue, JobQueueFull
+import src.app as app_module
+
+
+def text_event_body(count=1):
+    """LINE webhook 的文字訊息事件"""
+    events = [{
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'webhookEventId': f"01TEST{index:020d}",
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': f"reply-token-{index}",
+        'source': {'type': 'user', 'userId': f"U{index:032d}"},
+        'message': {'type': 'text', 'id': str(1000 + index), 'quoteToken': 'q', 'text': '列印'}
+    } for index in range(count)]
+    return json.dumps({'destination': 'Udest', 'events': events})
+
+
+def sign(body):
+    digest = hmac.new(settings.LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+async def fill_queue(func, free=0):
+    """讓全部的 worker 忙碌並填滿佇列（保留 free 個空位）"""
+    for _ in range(settings.JOB_WORKERS):
+        JobQueue.submit('blocked', func)
+    # 讓 worker 取出工作，之後的工作才會留在佇列中
+    await asyncio.sleep(0)
+    for _ in range(settings.JOB_QUEUE_MAX_SIZE - free):
+        JobQueue.submit('blocked', func)
+
+
+async def check_worker_pool():
+    """固定數量的 worker 同時執行工作"""
+    running = peak = 0
+    done = []
+
+    async def job(index):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        done.append(index)
+
+    for index in range(12):
+        JobQueue.submit('test', job, index)
+    await JobQueue._queue.join()
+    assert sorted(done) == list(range(12)), done
+    assert peak == settings.JOB_WORKERS, peak
+    stats = JobQueue.stats()
+    assert stats['depth'] == 0 and stats['running'] == 0, stats
+    assert stats['wait']['count'] >= 12 and stats['run']['p50_ms'] >= 20, stats
+
+
+async def check_failure_isolated():
+    """工作拋出例外時 worker 繼續處理之後的工作"""
+    done = []
+
+    async def broken():
+        raise RuntimeError('測試用的錯誤')
+
+    async def ok():
+        done.append(True)
+
+    failed = JobQueue.stats()['failed']
+    for _ in range(settings.JOB_WORKERS):
+        JobQueue.submit('broken', broken)
+    JobQueue.submit('ok', ok)
+    await JobQueue._queue.join()
+    assert done == [True]
+    assert JobQueue.stats()['failed'] - failed == settings.JOB_WORKERS
+
+
+async def check_queue_full():
+    """佇列已滿時拋出 JobQueueFull"""
+    release = asyncio.Event()
+
+    async def blocked():
+        await release.wait()
+
+    try:
+        await fill_queue(blocked)
+        try:
+            JobQueue.submit('blocked', blocked)
+            raise AssertionError('應該拋出 JobQueueFull')
+        except JobQueueFull:
+            pass
+    finally:
+        release.set()
+    await JobQueue._queue.join()
+
+
+async def check_batch_overflow():
+    """整批工作超過剩餘空間時全部拒絕，不會只加入一部分"""
+    release = asyncio.Event()
+    done = []
+
+    async def blocked():
+        await release.wait()
+
+    async def job(index):
+        done.append(index)
+
+    try:
+        await fill_queue(blocked, free=2)
+        depth = JobQueue.stats()['depth']
+        try:
+            JobQueue.submit_many([Job('batch', job, (index,)) for index in range(3)])
+            raise AssertionError('應該拋出 JobQueueFull')
+        except JobQueueFull:
+            pass
+        assert JobQueue.stats()['depth'] == depth, JobQueue.stats()
+        # 剩餘空間足夠時整批加入
+        JobQueue.submit_many([Job('batch', job, (index,)) for index in range(3, 5)])
+        assert JobQueue.stats()['depth'] == depth + 2, JobQueue.stats()
+    finally:
+        release.set()
+    await JobQueue._queue.join()
+    assert sorted(done) == [3, 4], done
+
+
+async def check_user_lanes():
+    """同一用戶的工作依序執行，不同用戶的工作同時執行"""
+    timeline = []
+    running = peak = 0
+
+    async def job(user, index, duration):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        timeline.append(('start', user, index, time.perf_counter()))
+        await asyncio.sleep(duration)
+        timeline.append(('end', user, index, time.perf_counter()))
+        running -= 1
+
+    serialized = JobQueue.stats()['serialized']
+    for index in range(3):
+        JobQueue.submit('a', job, 'A', index, 0.05, key='A')
+    JobQueue.submit('b', job, 'B', 0, 0.02, key='B')
+    await JobQueue._queue.join()
+
+    # A 的工作依加入順序執行，且不會重疊
+    a_events = [(kind, index) for kind, user, index, _ in timeline if user == 'A']
+    assert a_events == [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)], a_events
+    # B 不需要等待 A 的工作全部完成
+    b_end = next(t for kind, user, _, t in timeline if user == 'B' and kind == 'end')
+    a_first_end = next(t for kind, user, index, t in timeline if user == 'A' and kind == 'end' and index == 0)
+    assert b_end < a_first_end, (b_end, a_first_end)
+    assert peak == 2, peak
+    assert JobQueue.stats()['serialized'] - serialized == 2
+    assert JobQueue.stats()['lanes'] == 0
+
+
+async def check_keyed_batch_overflow():
+    """整批拒絕同一用戶的工作時不會建立 lane，之後同一用戶的工作仍可正常執行"""
+    release = asyncio.Event()
+    done = []
+
+    async def blocked():
+        await release.wait()
+
+    async def job(index):
+        done.append(index)
+
+    try:
+        await fill_queue(blocked, free=2)
+        before = JobQueue.stats()
+        try:
+            JobQueue.submit_many([Job('keyed', job, (index,), key='C') for index in range(3)])
+            raise AssertionError('應該拋出 JobQueueFull')
+        except JobQueueFull:
+            pass
+        after = JobQueue.stats()
+        assert after['lanes'] == before['lanes'] and 'C' not in JobQueue._lanes, after
+        assert after['serialized'] == before['serialized'] and after['depth'] == before['depth'], after
+    finally:
+        release.set()
+    await JobQueue._queue.join()
+    assert done == [] and JobQueue.stats()['lanes'] == 0, (done, JobQueue.stats())
+
+    JobQueue.submit_many([Job('keyed', job, (index,), key='C') for index in range(3)])
+    await JobQueue._queue.join()
+    assert done == [0, 1, 2], done
+
+
+async def check_global_cap():
+    """不同用戶同時執行的工作數不超過 worker 數"""
+    running = peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    for index in range(10):
+        JobQueue.submit('user', job, key=f"user-{index}")
+    await JobQueue._queue.join()
+    assert peak == settings.JOB_WORKERS, peak
+
+
+async def check_webhook_fast_ack():
+    """webhook 驗證簽章後立即回覆，事件由 worker 在背景處理"""
+    handled = []
+
+    async def slow_handler(event):
+        await asyncio.sleep(0.5)
+        handled.append(event.reply_token)
+
+    original = app_module.message_handler.handle_event
+    app_module.message_handler.handle_event = slow_handler
+    try:
+        client = app_module.app.test_client()
+        body = text_event_body(3)
+        start = time.perf_counter()
+        response = await client.post('/callback', data=body, headers={
+            'X-Line-Signature': sign(body), 'Content-Type': 'application/json'
+        })
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200, response.status_code
+        assert elapsed < 0.2, elapsed
+        assert handled == []
+
+        response = await client.post('/callback', data=body, headers={
+            'X-Line-Signature': 'invalid', 'Content-Type': 'application/json'
+        })
+        assert response.status_code == 400, response.status_code
+
+        await JobQueue._queue.join()
+        assert sorted(handled) == ['reply-token-0', 'reply-token-1', 'reply-token-2'], handled
+
+        response = await client.get('/metrics/jobs')
+        metrics = await response.get_json()
+        assert metrics['depth'] == 0 and metrics['workers'] == settings.JOB_WORKERS, metrics
+    finally:
+        app_module.message_handler.handle_event = original
+
+
+async def check_webhook_user_order():
+    """同一個 webhook 中同一用戶的事件依序處理"""
+    handled = []
+
+    async def handler(event):
+        # 第一個事件較慢，若同時執行會比第二個晚完成
+        await asyncio.sleep(0.1 if event.reply_token == 'reply-token-0' else 0)
+        handled.append(event.reply_token)
+
+    body = json.loads(text_event_body(3))
+    for event in body['events']:
+        event['source']['userId'] = 'U' + '0' * 32
+    body = json.dumps(body)
+
+    original = app_module.message_handler.handle_event
+    app_module.message_handler.handle_event = handler
+    try:
+        client = app_module.app.test_client()
+        response = await client.post('/callback', data=body, headers={
+            'X-Line-Signature': sign(body), 'Content-Type': 'application/json'
+        })
+        assert response.status_code == 200, response.status_code
+        await JobQueue._queue.join()
+    finally:
+        app_module.message_handler.handle_event = original
+    assert handled == ['reply-token-0', 'reply-token-1', 'reply-token-2'], handled
+
+
+async def check_webhook_queue_full():
+    """佇列已滿時回覆 503，讓 LINE 稍後重送"""
+    release = asyncio.Event()
+
+    async def blocked():
+        await release.wait()
+
+    client = app_module.app.test_client()
+    try:
+        await fill_queue(blocked)
+        body = text_event_body()
+        response = await client.post('/callback', data=body, headers={
+            'X-Line-Signature': sign(body), 'Content-Type': 'application/json'
+        })
+        assert response.status_code == 503, response.status_code
+    finally:
+        release.set()
+    await JobQueue._queue.join()
+
+
+async def check_webhook_batch_overflow():
+    """剩餘空間不足以放入整個 webhook 的事件時回覆 503，且不處理任何事件（LINE 會重送整批）"""
+    release = asyncio.Event()
+    handled = []
+
+    async def blocked():
+        await release.wait()
+
+    async def handler(event):
+        handled.append(event.reply_token)
+
+    original = app_module.message_handler.handle_event
+    app_module.message_handler.handle_event = handler
+    client = app_module.app.test_client()
+    try:
+        await fill_queue(blocked, free=2)
+        body = text_event_body(3)
+        response = await client.post('/callback', data=body, headers={
+            'X-Line-Signature': sign(body), 'Content-Type': 'application/json'
+        })
+        assert response.status_code == 503, response.status_code
+    finally:
+        release.set()
+    try:
+        await JobQueue._queue.join()
+    finally:
+        app_module.message_handler.handle_event = original
+    assert handled == [], handled
+
+
+async def check_stop_drains():
+    """關閉時等待佇列中的工作完成"""
+    done = []
+
+    async def job():
+        await asyncio.sleep(0.05)
+        done.append(True)
+
+    for _ in range(settings.JOB_WORKERS * 2):
+        JobQueue.submit('drain', job)
+    await JobQueue.stop(timeout=5)
+    assert len(done) == settings.JOB_WORKERS * 2, done
+    assert JobQueue.stats()['workers'] == 0
+
+
+async def main():
+    settings.JOB_WORKERS = 3
+    settings.JOB_QUEUE_MAX_SIZE = 20
+
+    failed = 0
+    for check in (check_worker_pool, check_failure_isolated, check_queue_full, check_batch_overflow, check_user_lanes,
+                  check_keyed_batch_overflow, check_global_cap, check_webhook_fast_ack, check_webhook_user_order, check_webhook_queue_full,
+                  check_webhook_batch_overflow, check_stop_drains):
+        try:
+            await check()
+            print(f"✅ {check.__name__}：{check.__doc__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    await JobQueue.stop(timeout=1)
+
+    print(f"工作佇列統計：{JobQueue.stats()}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
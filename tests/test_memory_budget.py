@@ -0,0 +1,95 @@
+import os
+import sys
+import asyncio
+import logging
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.services.memory_budget import MemoryBudget
+
+BUDGET = 1000
+
+
+def assert_idle():
+    stats = MemoryBudget.stats()
+    assert stats['reserved'] == 0 and not stats['reservations'], stats
+    assert stats['waiting'] == 0, stats
+
+
+async def check_fifo():
+    """預算不足時依先後順序放行"""
+    first = await MemoryBudget.acquire(800, 'first')
+    order = []
+
+    async def waiter(label, nbytes):
+        async with MemoryBudget.reserve(nbytes, label):
+            order.append(label)
+
+    tasks = [asyncio.create_task(waiter('large', 900)), asyncio.create_task(waiter('small', 100))]
+    await asyncio.sleep(0.01)
+    # small 雖然放得下，但不能插隊到 large 之前
+    assert order == [], order
+    MemoryBudget.release(first)
+    await asyncio.gather(*tasks)
+    assert order == ['large', 'small'], order
+    assert_idle()
+
+
+async def check_cancel_while_waiting():
+    """排隊中取消不會佔用預算，後面的請求可以放行"""
+    first = await MemoryBudget.acquire(800, 'first')
+    cancelled = asyncio.create_task(MemoryBudget.acquire(900, 'cancelled'))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(MemoryBudget.acquire(100, 'second'))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    reservation = await asyncio.wait_for(second, 1)
+    MemoryBudget.release(reservation)
+    MemoryBudget.release(first)
+    assert_idle()
+
+
+async def check_cancel_after_grant():
+    """放行後、繼續執行前被取消時歸還預留"""
+    first = await MemoryBudget.acquire(800, 'first')
+    task = asyncio.create_task(MemoryBudget.acquire(900, 'granted'))
+    await asyncio.sleep(0)
+    assert MemoryBudget.stats()['waiting'] == 1
+    MemoryBudget.release(first)
+    # 讓放行的回呼先執行（future 已有結果），再在等待者恢復執行前取消
+    await asyncio.sleep(0)
+    assert MemoryBudget.stats()['reserved'] == 900
+    task.cancel()
+    try:
+        await task
+        raise AssertionError("等待者應該被取消")
+    except asyncio.CancelledError:
+        pass
+    assert_idle()
+
+
+async def main():
+    settings.MEMORY_BUDGET_BYTES = BUDGET
+
+    failed = 0
+    for check in (check_fifo, check_cancel_while_waiting, check_cancel_after_grant):
+        try:
+            await check()
+            print(f"✅ {check.__name__}：{check.__doc__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+
+    print(f"記憶體預算統計：{MemoryBudget.stats()}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import os
+import sys
+import random
+import logging
+from PIL import Image
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.image_service import ImageService
+
+
+def sizes():
+    """各種原始圖片尺寸與目標區域尺寸的組合（含極端長寬比與隨機尺寸）"""
+    rng = random.Random(5)
+    fixed = [1, 2, 3, 7, 99, 100, 101, 239, 240, 241, 1079, 1080, 1081, 1599, 1600, 4031, 4032]
+    for width in fixed:
+        for height in fixed:
+            yield (width, height), (max(1, width // 3 + 1), max(1, height // 2 + 1))
+            yield (width, height), (1080, 1920)
+            yield (width, height), (1920, 1080)
+    for _ in range(20000):
+        yield ((rng.randint(1, 6000), rng.randint(1, 6000)),
+               (rng.randint(1, 3000), rng.randint(1, 3000)))
+
+
+def check_fill_box_inside_image():
+    """填滿模式的取樣範圍一定在原始圖片內且不為空"""
+    for image_size, (region_width, region_height) in sizes():
+        new_size, box = ImageService.plan_fit(image_size, region_width, region_height, fill=True)
+        left, top, right, bottom = box
+        width, height = image_size
+        assert new_size == (region_width, region_height), (image_size, new_size)
+        assert 0 <= left < right <= width, (image_size, region_width, region_height, box)
+        assert 0 <= top < bottom <= height, (image_size, region_width, region_height, box)
+
+
+def check_fill_box_keeps_aspect():
+    """填滿模式的取樣範圍與目標區域的長寬比相同（誤差在一個像素內）"""
+    for image_size, (region_width, region_height) in sizes():
+        _, (left, top, right, bottom) = ImageService.plan_fit(image_size, region_width, region_height, fill=True)
+        expected = (bottom - top) * region_width / region_height
+        assert abs((right - left) - expected) <= 1, (image_size, region_width, region_height)
+
+
+def check_fit_mode():
+    """適應模式取樣整張圖片，輸出尺寸不超過目標區域"""
+    for image_size, (region_width, region_height) in sizes():
+        new_size, box = ImageService.plan_fit(image_size, region_width, region_height, fill=False)
+        assert box == (0, 0, image_size[0], image_size[1]), box
+        assert new_size[0] <= max(1, region_width) and new_size[1] <= max(1, region_height), new_size
+
+
+def check_pillow_accepts_box():
+    """Pillow 直接接受規劃出的取樣範圍（不經由 fit_image_to_region 的錯誤處理）"""
+    rng = random.Random(7)
+    for _ in range(300):
+        image = Image.new('RGB', (rng.randint(1, 800), rng.randint(1, 800)))
+        region_width, region_height = rng.randint(1, 900), rng.randint(1, 900)
+        new_size, box = ImageService.plan_fit(image.size, region_width, region_height, fill=True)
+        resized = image.resize(new_size, Image.Resampling.LANCZOS, box=box)
+        assert resized.size == (region_width, region_height), resized.size
+
+
+def main():
+    failed = 0
+    for check in (check_fill_box_inside_image, check_fill_box_keeps_aspect, check_fit_mode,
+                  check_pillow_accepts_box):
+        try:
+            check()
+            print(f"✅ {check.__name__}：{check.__doc__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+from types import SimpleNamespace
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 建立 MessageHandler 前需要 LINE 的設定
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-token')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-secret')
+
+from src.config import settings
+from src.handlers.message_handler import MessageHandler
+from src.services.image_service import ImageService, ProcessedImage
+from src.services.line_service import MessageContent
+from src.services.result_cache import ResultCache
+
+USER_ID = 'U' + '0' * 32
+CACHED_URL = 'https://res.cloudinary.com/demo/image/upload/line-bot-frames/cached.jpg'
+
+
+def get_test_image():
+    """獲取測試圖片內容"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.jpg'), 'rb') as f:
+        return f.read()
+
+
+class RecordingLineService:
+    """以固定內容回應下載、記錄發送的訊息（不連線到 LINE）"""
+
+    def __init__(self, data):
+        self.data = data
+        self.sent = []
+
+    async def download_message_content(self, message_id, spill_path=None, preview=False):
+        digest = hashlib.sha256(self.data).hexdigest()
+        return MessageContent(self.data, None, len(self.data), 'JPEG', 1024, 682, digest)
+
+    async def _record(self, *args):
+        self.sent.append(args)
+
+    reply_text = reply_image = reply_message = push_message = push_image = _record
+
+
+def image_event(message_id):
+    return SimpleNamespace(
+        message=SimpleNamespace(id=message_id),
+        source=SimpleNamespace(user_id=USER_ID),
+        reply_token=f"reply-{message_id}"
+    )
+
+
+async def handle_cached_upload(data, message_id):
+    """以快取命中處理一次圖片訊息，等待背景寫入完成後回傳用戶狀態"""
+    handler = MessageHandler()
+    handler.line_service = RecordingLineService(data)
+    await handler.handle_image_message(image_event(message_id))
+    await asyncio.gather(*list(ImageService._background_tasks))
+    assert handler.line_service.sent, '應該回覆處理結果'
+    assert handler.user_states[USER_ID]['cloudinary_url'] == CACHED_URL, handler.user_states
+    return handler.user_states[USER_ID]
+
+
+async def check_hit_restores_removed_file(data, processed):
+    """快取命中時，先前請求的合成檔案已被清理也會重新寫入，列印流程可使用"""
+    if os.path.exists(processed.path):
+        os.remove(processed.path)
+    state = await handle_cached_upload(data, '1001')
+    assert state['processed_path'] == processed.path, state
+    assert os.path.exists(state['processed_path']), state['processed_path']
+    with open(state['processed_path'], 'rb') as f:
+        assert f.read() == processed.data
+
+
+async def check_hit_refreshes_mtime(data, processed):
+    """快取命中時更新合成檔案的修改時間，暫存檔案清理不會在使用中刪除"""
+    old = time.time() - 30 * 24 * 3600
+    os.utime(processed.path, (old, old))
+    state = await handle_cached_upload(data, '1002')
+    assert os.path.getmtime(state['processed_path']) > time.time() - 60, os.path.getmtime(state['processed_path'])
+
+
+async def main():
+    data = get_test_image()
+
+    # 上傳目錄與快取目錄使用暫存目錄，不影響 tmp/uploads 與 tmp/result_cache
+    root = tempfile.mkdtemp(prefix='cache_hit_')
+    original = (settings.UPLOAD_FOLDER, settings.RESULT_CACHE_FOLDER, settings.INGEST_MODE,
+                settings.RESULT_CACHE_ENABLED)
+    settings.UPLOAD_FOLDER = os.path.join(root, 'uploads')
+    settings.RESULT_CACHE_FOLDER = os.path.join(root, 'result_cache')
+    os.makedirs(settings.UPLOAD_FOLDER)
+    os.makedirs(settings.RESULT_CACHE_FOLDER)
+    settings.INGEST_MODE = 'full'
+    settings.RESULT_CACHE_ENABLED = True
+
+    # 先前的請求已合成並上傳，結果放在快取中
+    processed = ProcessedImage('processed_20990101_000000_1000.jpg', data, (1024, 682), 'landscape', 90)
+    key, _ = ResultCache.lookup(hashlib.sha256(data).hexdigest())
+    ResultCache.put(key, processed, CACHED_URL, CACHED_URL)
+
+    failed = 0
+    try:
+        for check in (check_hit_restores_removed_file, check_hit_refreshes_mtime):
+            try:
+                await check(data, processed)
+                print(f"✅ {check.__name__}：{check.__doc__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    finally:
+        (settings.UPLOAD_FOLDER, settings.RESULT_CACHE_FOLDER, settings.INGEST_MODE,
+         settings.RESULT_CACHE_ENABLED) = original
+        shutil.rmtree(root, ignore_errors=True)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+import os
+import sys
+import shutil
+import asyncio
+import logging
+import tempfile
+from urllib.parse import urlsplit
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 匯入 src.app 前需要 LINE 的設定
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-token')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-secret')
+
+from src.config import settings
+from src.app import app
+from src.services.storage_backend import Storage
+
+FILENAME = '20990101_000000_static_test.jpg'
+
+
+def get_test_image():
+    """獲取測試圖片內容"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.jpg'), 'rb') as f:
+        return f.read()
+
+
+async def check_etag(client, data):
+    """回傳強 ETag，If-None-Match 相同時回覆 304"""
+    response = await client.get(f"/tmp/uploads/{FILENAME}")
+    assert response.status_code == 200, response.status_code
+    assert await response.get_data() == data
+    etag = response.headers['ETag']
+    assert etag.startswith('"') and not etag.startswith('W/'), etag
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'immutable' not in response.headers['Cache-Control']
+
+    response = await client.get(f"/tmp/uploads/{FILENAME}", headers={'If-None-Match': etag})
+    assert response.status_code == 304, response.status_code
+    assert await response.get_data() == b''
+
+    response = await client.get(f"/tmp/uploads/{FILENAME}", headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200, response.status_code
+
+
+async def check_range(client, data):
+    """Range 請求回覆 206 與指定的位元組"""
+    response = await client.get(f"/tmp/uploads/{FILENAME}", headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206, response.status_code
+    assert await response.get_data() == data[100:200]
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(data)}", response.headers['Content-Range']
+
+
+async def check_static(client, data):
+    """/static 由 serve_static 提供（相框圖片）"""
+    response = await client.get('/static/frames/cute.png')
+    assert response.status_code == 200, response.status_code
+    assert response.headers['Content-Type'] == 'image/png', response.headers['Content-Type']
+    assert 'ETag' in response.headers
+
+
+async def check_not_found(client, data):
+    """不存在的檔案、目錄與跳出目錄的路徑回覆 404"""
+    for path in ('/tmp/uploads/missing.jpg', '/tmp/uploads/objects', '/static/..%2Fsrc%2Fapp.py',
+                 '/tmp/uploads/..%2F..%2Fsrc%2Fapp.py'):
+        response = await client.get(path)
+        assert response.status_code == 404, (path, response.status_code)
+
+
+async def check_immutable_object(client, data):
+    """以雜湊命名的物件使用 immutable 快取"""
+    url = await Storage.backend('local').store(data, FILENAME)
+    parts = urlsplit(url)
+    response = await client.get(f"{parts.path}?{parts.query}")
+    assert response.status_code == 200, response.status_code
+    assert 'immutable' in response.headers['Cache-Control'], response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    response = await client.get(f"{parts.path}?{parts.query}", headers={'If-None-Match': etag})
+    assert response.status_code == 304, response.status_code
+
+
+async def check_object_requires_signature(client, data):
+    """物件目錄中的檔案只能以簽署的 URL 取得（. 與 .. 路徑片段、連結都不能略過簽章檢查）"""
+    url = await Storage.backend('local').store(data, FILENAME)
+    name = urlsplit(url).path.rsplit('/', 1)[1]
+    response = await client.get(f"/tmp/uploads/objects/{name}")
+    assert response.status_code == 403, response.status_code
+
+    os.symlink(settings.STORAGE_OBJECT_FOLDER, os.path.join(settings.UPLOAD_FOLDER, 'linked'))
+    for path in (f"/tmp/uploads/./objects/{name}", f"/tmp/uploads/x/../objects/{name}",
+                 f"/tmp/uploads/objects/./{name}", f"/tmp/uploads/linked/{name}"):
+        response = await client.get(path)
+        assert response.status_code in (403, 404), (path, response.status_code)
+
+
+async def check_accel_redirect(client, data):
+    """X-Accel-Redirect 模式只回傳標頭，由 nginx 傳送檔案內容"""
+    settings.STATIC_ACCEL_REDIRECT = True
+    try:
+        response = await client.get(f"/tmp/uploads/{FILENAME}")
+        assert response.status_code == 200, response.status_code
+        assert response.headers['X-Accel-Redirect'] == f"/_accel/uploads/{FILENAME}", response.headers
+        assert response.headers['Content-Type'] == 'image/jpeg', response.headers['Content-Type']
+        assert await response.get_data() == b''
+        etag = response.headers['ETag']
+
+        response = await client.get(f"/tmp/uploads/{FILENAME}", headers={'If-None-Match': etag})
+        assert response.status_code == 304, response.status_code
+        assert 'X-Accel-Redirect' not in response.headers
+
+        response = await client.get('/static/frames/cute.png')
+        assert response.headers['X-Accel-Redirect'] == '/_accel/static/frames/cute.png', response.headers
+    finally:
+        settings.STATIC_ACCEL_REDIRECT = False
+
+
+async def main():
+    settings.STORAGE_URL_SECRET = 'url-secret'
+    data = get_test_image()
+
+    # 上傳目錄與物件目錄使用暫存目錄，不影響 tmp/uploads
+    root = tempfile.mkdtemp(prefix='static_')
+    original = settings.UPLOAD_FOLDER, settings.STORAGE_OBJECT_FOLDER
+    settings.UPLOAD_FOLDER = root
+    settings.STORAGE_OBJECT_FOLDER = os.path.join(root, 'objects')
+    os.makedirs(settings.STORAGE_OBJECT_FOLDER)
+    with open(os.path.join(root, FILENAME), 'wb') as f:
+        f.write(data)
+
+    client = app.test_client()
+    failed = 0
+    try:
+        for check in (check_etag, check_range, check_static, check_not_found, check_immutable_object,
+                      check_object_requires_signature, check_accel_redirect):
+            try:
+                await check(client, data)
+                print(f"✅ {check.__name__}：{check.__doc__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    finally:
+        settings.UPLOAD_FOLDER, settings.STORAGE_OBJECT_FOLDER = original
+        shutil.rmtree(root, ignore_errors=True)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
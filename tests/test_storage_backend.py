@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+
+# 設定 logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# 添加 src 到 Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 匯入 src.app 前需要 LINE 的設定
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-token')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-secret')
+
+from src.config import settings
+from src.services.image_service import ImageService, ProcessedImage
+from src.services.storage_backend import Storage, LocalStorage, StorageError
+
+
+def get_test_image():
+    """獲取測試圖片內容"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.jpg'), 'rb') as f:
+        return f.read()
+
+
+def split_url(url):
+    """回傳 (物件檔名, expires, sig)"""
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path.rsplit('/', 1)[1], query['expires'][0], query['sig'][0]
+
+
+async def check_content_addressed(data):
+    """以內容雜湊命名，相同內容只寫入一次"""
+    url = await Storage.backend('local').store(data, 'a.jpg')
+    name, _, _ = split_url(url)
+    assert name == LocalStorage.object_name(data), name
+    path = os.path.join(settings.STORAGE_OBJECT_FOLDER, name)
+    inode = os.stat(path).st_ino
+    again = await Storage.backend('local').store(data, 'b.jpg')
+    assert split_url(again)[0] == name, again
+    # 重新寫入會以新的檔案取代（inode 改變），已存在時只更新修改時間
+    assert os.stat(path).st_ino == inode, '相同內容不應重新寫入'
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert not [n for n in os.listdir(settings.STORAGE_OBJECT_FOLDER) if n.endswith('.part')]
+
+
+async def check_signature(data):
+    """簽章可驗證，竄改或過期的 URL 無效"""
+    url = await Storage.backend('local').store(data, 'a.jpg')
+    name, expires, sig = split_url(url)
+    assert url.startswith(f"{settings.STORAGE_PUBLIC_BASE_URL}/tmp/uploads/objects/"), url
+    assert LocalStorage.verify(name, expires, sig)
+    assert int(expires) >= time.time() + settings.STORAGE_URL_TTL
+    assert not LocalStorage.verify(name, int(expires) + 1, sig)
+    assert not LocalStorage.verify('0' * 64 + '.jpg', expires, sig)
+    assert not LocalStorage.verify(name, expires, sig[:-1] + ('0' if sig[-1] != '0' else '1'))
+    assert not LocalStorage.verify(name, 'abc', sig)
+    assert not LocalStorage.verify(name, expires, sig, now=int(expires) + 1)
+
+
+async def check_fallback(data):
+    """cloudinary 設定不完整時改用本地後端，且不視為可快取的 URL"""
+    settings.STORAGE_BACKEND = 'cloudinary'
+    cloud_name, settings.CLOUDINARY_CLOUD_NAME = settings.CLOUDINARY_CLOUD_NAME, None
+    try:
+        processed = ProcessedImage('processed_test.jpg', data, (1024, 682), 'landscape', 85)
+        url = await ImageService.store_image(processed)
+    finally:
+        settings.CLOUDINARY_CLOUD_NAME = cloud_name
+        settings.STORAGE_BACKEND = 'local'
+    assert LocalStorage().owns(url), url
+    assert not Storage.is_durable(url)
+    assert Storage.is_durable('https://res.cloudinary.com/demo/image/upload/a.jpg')
+
+
+async def check_missing_secret(data):
+    """沒有簽章金鑰時無法產生本地 URL"""
+    secret, settings.STORAGE_URL_SECRET = settings.STORAGE_URL_SECRET, None
+    try:
+        await Storage.backend('local').store(data, 'a.jpg')
+        raise AssertionError('應該拋出 StorageError')
+    except StorageError:
+        pass
+    finally:
+        settings.STORAGE_URL_SECRET = secret
+
+
+async def check_store_refreshes_mtime(data):
+    """相同內容再次保存時更新物件檔案的修改時間，清理不會在新的 URL 到期前刪除"""
+    url = await Storage.backend('local').store(data, 'a.jpg')
+    path = os.path.join(settings.STORAGE_OBJECT_FOLDER, split_url(url)[0])
+    old = time.time() - settings.STORAGE_URL_TTL
+    os.utime(path, (old, old))
+    await Storage.backend('local').store(data, 'a.jpg')
+    assert os.path.getmtime(path) > time.time() - 60, os.path.getmtime(path)
+
+
+async def check_generated_secret(data):
+    """未設定或與 LINE_CHANNEL_SECRET 相同時產生獨立的臨時金鑰，已設定時保留"""
+    secret = settings.STORAGE_URL_SECRET
+    try:
+        for value in (None, '', settings.LINE_CHANNEL_SECRET):
+            settings.STORAGE_URL_SECRET = value
+            LocalStorage.ensure_secret()
+            generated = settings.STORAGE_URL_SECRET
+            assert generated and generated != settings.LINE_CHANNEL_SECRET, generated
+            assert len(generated) == 64, generated
+        settings.STORAGE_URL_SECRET = 'dedicated-secret'
+        LocalStorage.ensure_secret()
+        assert settings.STORAGE_URL_SECRET == 'dedicated-secret'
+    finally:
+        settings.STORAGE_URL_SECRET = secret
+
+
+async def check_route(data):
+    """serve_uploads 驗證簽章並回傳 immutable 快取標頭"""
+    from src.app import app
+
+    url = await Storage.backend('local').store(data, 'a.jpg')
+    parts = urlsplit(url)
+    client = app.test_client()
+
+    response = await client.get(f"{parts.path}?{parts.query}")
+    assert response.status_code == 200, response.status_code
+    assert await response.get_data() == data
+    cache_control = response.headers['Cache-Control']
+    assert 'immutable' in cache_control and 'public' in cache_control, cache_control
+    max_age = int(cache_control.split('max-age=')[1].split(',')[0])
+    assert 0 < max_age <= settings.STORAGE_URL_TTL + LocalStorage.EXPIRY_GRANULARITY, max_age
+
+    name, expires, sig = split_url(url)
+    response = await client.get(f"{parts.path}?expires={expires}&sig={'0' * len(sig)}")
+    assert response.status_code == 403, response.status_code
+    response = await client.get(parts.path)
+    assert response.status_code == 403, response.status_code
+
+
+async def main():
+    settings.STORAGE_BACKEND = 'local'
+    settings.STORAGE_URL_SECRET = 'url-secret'
+    settings.STORAGE_PUBLIC_BASE_URL = 'https://cdn.example.com'
+
+    # 物件寫入暫存目錄，不影響 tmp/uploads
+    object_folder = settings.STORAGE_OBJECT_FOLDER
+    settings.STORAGE_OBJECT_FOLDER = tempfile.mkdtemp(prefix='objects_')
+    data = get_test_image()
+
+    failed = 0
+    try:
+        for check in (check_content_addressed, check_signature, check_fallback, check_missing_secret,
+                      check_store_refreshes_mtime, check_generated_secret, check_route):
+            try:
+                await check(data)
+                print(f"✅ {check.__name__}：{check.__doc__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}：{check.__doc__}（{type(e).__name__}: {e}）")
+    finally:
+        for name in os.listdir(settings.STORAGE_OBJECT_FOLDER):
+            os.remove(os.path.join(settings.STORAGE_OBJECT_FOLDER, name))
+        os.rmdir(settings.STORAGE_OBJECT_FOLDER)
+        settings.STORAGE_OBJECT_FOLDER = object_folder
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())